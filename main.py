@@ -1,14 +1,60 @@
 import os
+import json
+import re
+import base64
+import codecs
+import difflib
+import hashlib
+import ipaddress
+import time
 import random
 import string
 import secrets
+import tempfile
+import fcntl
+import mmap
+import threading
+import itertools
+import urllib.error
+import urllib.parse
+import urllib.request
+import queue
+import sqlite3
+import zlib
+import math
+import sys
+import functools
+import tracemalloc
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
-from flask import Flask, request, redirect, url_for, flash, Response
-from flask import render_template_string
+import click
+from flask import Flask, request, redirect, url_for, flash, Response, abort
+from flask import render_template_string, g, has_request_context, jsonify, send_file
 from flask_sqlalchemy import SQLAlchemy
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session as SASession
+from vm_compile import TOKENS, advanced_tokenize, compile_segment
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SESSION_SECRET', 'CHANGE_THIS')
+# Machine/operator endpoints (diagnostics, APIs) require this bearer token and
+# answer 404 while it is unset.
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+# /metrics needs this bearer token (ADMIN_TOKEN when unset), so the scraper
+# does not have to hold the admin token.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or ADMIN_TOKEN
+# Reverse proxies in front of the app (1 behind Heroku's router or one
+# nginx). request.remote_addr, which bans, auto-bans and key usage key on,
+# is then taken from X-Forwarded-For; with 0 it is the proxy's address.
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '0'))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
 
 # Configure PostgreSQL database
 DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -20,8 +66,40 @@ else:
     app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# SQLite profile for single-node installs. WAL lets readers run alongside
+# the one writer, busy_timeout makes a blocked writer wait instead of failing
+# with "database is locked", and synchronous=NORMAL only fsyncs at WAL
+# checkpoints. Every pooled connection can read concurrently; writes are
+# still serialised by SQLite, so append-only loader writes go through
+# write_queue (see "Write Queue") to keep write transactions few and short.
+SQLITE_PROFILE = app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_CACHE_KB = int(os.environ.get('SQLITE_CACHE_KB', 64 * 1024))
+SQLITE_MMAP_BYTES = int(os.environ.get('SQLITE_MMAP_BYTES', 256 << 20))
+if SQLITE_PROFILE:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('SQLITE_POOL_SIZE', 8)),
+        'max_overflow': 8,
+        'pool_pre_ping': False,
+        'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000, 'check_same_thread': False},
+    }
+
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, 'connect')
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_KB}')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute(f'PRAGMA mmap_size={SQLITE_MMAP_BYTES}')
+    cursor.close()
+
 ############################
 # Database Models
 ############################
@@ -41,36 +119,409 @@ class Project(db.Model):
 class Script(db.Model):
     """Scripts belonging to a project."""
     id = db.Column(db.Integer, primary_key=True)
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
     version = db.Column(db.String(20), nullable=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    code = db.Column(db.Text, nullable=True)
+    build_hash = db.Column(db.String(64), nullable=True)  # sha256 of the published payload file
 
 class BlockedIP(db.Model):
     """Example of blocked IP addresses with a reason."""
     id = db.Column(db.Integer, primary_key=True)
-    ip_address = db.Column(db.String(50), nullable=False)
+    ip_address = db.Column(db.String(50), nullable=False, index=True)
     reason = db.Column(db.String(200), nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    expires_at = db.Column(db.DateTime, nullable=True)  # NULL = permanent
 
 class KillSwitch(db.Model):
     """Toggle to disable all scripts if active is True."""
     id = db.Column(db.Integer, primary_key=True)
     active = db.Column(db.Boolean, default=False)
 
-class Revenue(db.Model):
-    """Monthly revenue or monthly execution data for a line chart."""
-    id = db.Column(db.Integer, primary_key=True)
-    month = db.Column(db.String(20), nullable=False)  # e.g. 'Jan','Feb'...
-    amount = db.Column(db.Integer, nullable=False)    # e.g. 500, 1000, etc.
-
 class Key(db.Model):
     """Keys for whitelisting logic (like Luarmor)."""
     id = db.Column(db.Integer, primary_key=True)
     value = db.Column(db.String(64), unique=True, nullable=False)
-    hwid = db.Column(db.String(128), nullable=True)
-    expires_at = db.Column(db.DateTime, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    hwid = db.Column(db.String(128), nullable=True, index=True)
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+############################
+# Time-Series Rollups
+############################
+# Revenue bookings and loader executions are written as raw SeriesEvent rows.
+# rollup_events() folds everything past its watermark into hourly, daily and
+# monthly SeriesRollup buckets (scope 0 = all projects, otherwise the project
+# id). Charts only read rollup rows for the requested range, so their cost
+# depends on the number of buckets shown, not on how much history exists.
+SERIES_GRANULARITIES = ('hour', 'day', 'month')
+RAW_EVENT_RETENTION_DAYS = int(os.environ.get('RAW_EVENT_RETENTION_DAYS', '35'))
+HOURLY_ROLLUP_RETENTION_DAYS = int(os.environ.get('HOURLY_ROLLUP_RETENTION_DAYS', '90'))
+ROLLUP_BATCH_SIZE = 50000
+ROLLUP_INTERVAL = 30        # seconds between background rollups per worker
+ROLLUP_SETTLE_SECONDS = 10  # newer events may still have uncommitted lower ids
+MAX_SERIES_POINTS = 1000
+
+class SeriesEvent(db.Model):
+    """One raw revenue booking or loader execution."""
+    __tablename__ = "series_event"
+    id = db.Column(db.Integer, primary_key=True)
+    series = db.Column(db.String(20), nullable=False)  # 'revenue', 'executions'
+    project_id = db.Column(db.Integer, nullable=True)
+    amount = db.Column(db.Integer, nullable=False, default=1)
+    occurred_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class SeriesRollup(db.Model):
+    """Pre-aggregated bucket of SeriesEvent amounts."""
+    __tablename__ = "series_rollup"
+    id = db.Column(db.Integer, primary_key=True)
+    series = db.Column(db.String(20), nullable=False)
+    granularity = db.Column(db.String(10), nullable=False)  # 'hour', 'day', 'month'
+    scope = db.Column(db.Integer, nullable=False, default=0)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    total = db.Column(db.BigInteger, nullable=False, default=0)
+    events = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (
+        db.UniqueConstraint('series', 'granularity', 'scope', 'bucket_start', name='uq_series_rollup_bucket'),
+    )
+
+class SeriesWatermark(db.Model):
+    """Highest SeriesEvent id already folded into the rollups (single row)."""
+    __tablename__ = "series_watermark"
+    id = db.Column(db.Integer, primary_key=True)
+    last_event_id = db.Column(db.Integer, nullable=False, default=0)
+
+def bucket_start(ts, granularity):
+    if granularity == 'hour':
+        return ts.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    return ts.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_bucket(ts, granularity):
+    if granularity == 'hour':
+        return ts + timedelta(hours=1)
+    if granularity == 'day':
+        return ts + timedelta(days=1)
+    return (ts.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def record_series_event(series, amount=1, project_id=None, occurred_at=None, deferred=False):
+    """Add a raw event to the session; it is written by the caller's commit.
+
+    deferred=True hands it to write_queue instead when that is enabled, for
+    hot paths that can tolerate losing the last few events on a crash.
+    """
+    values = dict(series=series, amount=amount, project_id=project_id,
+                  occurred_at=occurred_at or datetime.utcnow())
+    if deferred and write_queue.enabled:
+        write_queue.put(SeriesEvent.__table__, values)
+        return
+    db.session.add(SeriesEvent(**values))
+
+def _upsert_rollups(conn, totals):
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    table = SeriesRollup.__table__
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['series', 'granularity', 'scope', 'bucket_start'],
+        set_={'total': table.c.total + stmt.excluded.total,
+              'events': table.c.events + stmt.excluded.events}
+    )
+    rows = [
+        {'series': series, 'granularity': gran, 'scope': scope, 'bucket_start': start,
+         'total': total, 'events': count}
+        for (series, gran, scope, start), (total, count) in totals.items()
+    ]
+    conn.execute(stmt, rows)
+
+def rollup_events():
+    """Fold raw events past the watermark into the rollups. Returns the number processed."""
+    events = SeriesEvent.__table__
+    mark_table = SeriesWatermark.__table__
+    processed = 0
+    while True:
+        cutoff = datetime.utcnow() - timedelta(seconds=ROLLUP_SETTLE_SECONDS)
+        with db.engine.begin() as conn:
+            mark = conn.execute(db.select(mark_table.c.last_event_id).where(mark_table.c.id == 1)).scalar()
+            if mark is None:
+                conn.execute(mark_table.insert().values(id=1, last_event_id=0))
+                mark = 0
+            rows = conn.execute(
+                db.select(events.c.id, events.c.series, events.c.project_id, events.c.amount, events.c.occurred_at)
+                .where(events.c.id > mark)
+                .order_by(events.c.id)
+                .limit(ROLLUP_BATCH_SIZE)
+            ).fetchall()
+            fetched = len(rows)
+            # Never move the watermark past an event that is too fresh: a lower
+            # id from a transaction still in flight could otherwise be skipped.
+            for i, row in enumerate(rows):
+                if row.occurred_at > cutoff:
+                    rows = rows[:i]
+                    break
+            if not rows:
+                return processed
+            # Compare-and-set claims the batch; a worker racing on the same
+            # batch blocks on the row lock, then updates nothing and backs off.
+            claimed = conn.execute(
+                mark_table.update()
+                .where(mark_table.c.id == 1, mark_table.c.last_event_id == mark)
+                .values(last_event_id=rows[-1].id)
+            ).rowcount
+            if not claimed:
+                return processed
+            totals = {}
+            for row in rows:
+                scopes = (0, row.project_id) if row.project_id else (0,)
+                for gran in SERIES_GRANULARITIES:
+                    start = bucket_start(row.occurred_at, gran)
+                    for scope in scopes:
+                        t = totals.setdefault((row.series, gran, scope, start), [0, 0])
+                        t[0] += row.amount
+                        t[1] += 1
+            _upsert_rollups(conn, totals)
+            processed += len(rows)
+        if len(rows) < fetched or fetched < ROLLUP_BATCH_SIZE:
+            return processed
+
+_rollup_thread = {'pid': None}
+
+def _rollup_loop():
+    while True:
+        time.sleep(ROLLUP_INTERVAL)
+        for task in (rollup_events, purge_expired_routes, fail_stale_compile_jobs):
+            try:
+                with app.app_context():
+                    task()
+            except Exception as e:
+                print(f"[ROLLUP] {task.__name__} failed: {e}")
+
+def ensure_rollup_thread():
+    """Start this worker's rollup and route-purge thread (once per process, so after fork too).
+
+    Called at boot and from the routes that create loader routes, so a forked
+    worker that never serves the dashboard still purges expired routes.
+    """
+    if _rollup_thread['pid'] == os.getpid():
+        return
+    _rollup_thread['pid'] = os.getpid()
+    threading.Thread(target=_rollup_loop, name='series-rollup', daemon=True).start()
+
+def apply_series_retention():
+    """Drop raw events and hourly buckets older than their retention windows."""
+    now = datetime.utcnow()
+    mark = db.session.query(SeriesWatermark.last_event_id).filter_by(id=1).scalar() or 0
+    raw_deleted = SeriesEvent.query.filter(
+        SeriesEvent.occurred_at < now - timedelta(days=RAW_EVENT_RETENTION_DAYS),
+        SeriesEvent.id <= mark  # only events the rollups already contain
+    ).delete(synchronize_session=False)
+    hourly_deleted = SeriesRollup.query.filter(
+        SeriesRollup.granularity == 'hour',
+        SeriesRollup.bucket_start < now - timedelta(days=HOURLY_ROLLUP_RETENTION_DAYS)
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return raw_deleted, hourly_deleted
+
+def series_points(series, granularity, start, end, scope=0):
+    """[(bucket_start, total), ...] for every bucket in [start, end], zero-filled."""
+    first = bucket_start(start, granularity)
+    rows = SeriesRollup.query.filter(
+        SeriesRollup.series == series,
+        SeriesRollup.granularity == granularity,
+        SeriesRollup.scope == scope,
+        SeriesRollup.bucket_start >= first,
+        SeriesRollup.bucket_start <= end
+    ).all()
+    totals = {r.bucket_start: r.total for r in rows}
+    points = []
+    ts = first
+    while ts <= end and len(points) < MAX_SERIES_POINTS:
+        points.append((ts, totals.get(ts, 0)))
+        ts = next_bucket(ts, granularity)
+    return points
+
+def series_total(series, scope=0):
+    """All-time total, summed over the monthly buckets."""
+    return db.session.query(db.func.coalesce(db.func.sum(SeriesRollup.total), 0)).filter(
+        SeriesRollup.series == series,
+        SeriesRollup.granularity == 'month',
+        SeriesRollup.scope == scope
+    ).scalar()
+
+def months_back(n, now=None):
+    """Start of the month n-1 months before now's month (so n months inclusive)."""
+    ts = bucket_start(now or datetime.utcnow(), 'month')
+    for _ in range(n - 1):
+        ts = (ts - timedelta(days=1)).replace(day=1)
+    return ts
+
+############################
+# Schema Migrations
+############################
+# db.create_all() only creates missing tables and never alters existing ones.
+# Each entry in MIGRATIONS runs once per database, in order, and is recorded
+# in schema_version. Append new migrations; never edit one that has shipped.
+# Helpers are idempotent, so a fresh database (where create_all already built
+# everything) just records the versions.
+MIGRATION_LOCK_ID = 804201  # pg_advisory_lock key, any constant will do
+
+class SchemaVersion(db.Model):
+    __tablename__ = "schema_version"
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+def _quote(name):
+    return db.engine.dialect.identifier_preparer.quote(name)
+
+def create_index(name, table, columns, unique=False):
+    """Create an index if it is missing. On PostgreSQL this is CONCURRENTLY so writes keep flowing."""
+    cols = ', '.join(_quote(c) for c in columns)
+    unique_sql = 'UNIQUE ' if unique else ''
+    if db.engine.dialect.name == 'postgresql':
+        # CONCURRENTLY refuses to run inside a transaction block
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            valid = conn.execute(text(
+                "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                "WHERE c.relname = :name"
+            ), {'name': name}).scalar()
+            if valid is False:
+                # left behind by an interrupted CONCURRENTLY build
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {_quote(name)}'))
+            conn.execute(text(
+                f'CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {_quote(name)} ON {_quote(table)} ({cols})'
+            ))
+    else:
+        with db.engine.begin() as conn:
+            conn.execute(text(f'CREATE {unique_sql}INDEX IF NOT EXISTS {_quote(name)} ON {_quote(table)} ({cols})'))
+
+def add_column(table, column, ddl_type):
+    """ALTER TABLE ... ADD COLUMN unless the column already exists. ddl_type must allow NULL or carry a DEFAULT."""
+    if column in {c['name'] for c in inspect(db.engine).get_columns(table)}:
+        return
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE {_quote(table)} ADD COLUMN {_quote(column)} {ddl_type}'))
+    except OperationalError:
+        # another worker added it between the check and the ALTER
+        if column not in {c['name'] for c in inspect(db.engine).get_columns(table)}:
+            raise
+
+def _migration_hot_path_indexes():
+    create_index('ix_blocked_ip_ip_address', 'blocked_ip', ['ip_address'])
+    create_index('ix_blocked_ip_created_at', 'blocked_ip', ['created_at'])
+    create_index('ix_script_project_id', 'script', ['project_id'])
+    create_index('ix_key_hwid', 'key', ['hwid'])
+    create_index('ix_key_expires_at', 'key', ['expires_at'])
+    create_index('ix_key_created_at', 'key', ['created_at'])
+    create_index('ix_ephemeral_route_single_created_at', 'ephemeral_route_single', ['created_at'])
+    create_index('ix_ephemeral_route_vm_advanced2_created_at', 'ephemeral_route_vm_advanced2', ['created_at'])
+
+def _migration_revenue_to_series():
+    # The old Revenue table held month names without a year; treat each as the
+    # most recent such month and replay it as a raw event on the 1st. The
+    # revenue table itself is left in place.
+    if not inspect(db.engine).has_table('revenue'):
+        return
+    month_names = ["Jan","Feb","Mar","Apr","May","Jun","Jul","Aug","Sep","Oct","Nov","Dec"]
+    now = datetime.utcnow()
+    with db.engine.connect() as conn:
+        rows = conn.execute(text('SELECT month, amount FROM revenue ORDER BY id')).fetchall()
+    for month, amount in rows:
+        if month[:3].title() not in month_names:
+            continue
+        number = month_names.index(month[:3].title()) + 1
+        year = now.year if number <= now.month else now.year - 1
+        record_series_event('revenue', amount, occurred_at=datetime(year, number, 1))
+    db.session.commit()
+
+def _migration_payload_store_columns():
+    add_column('script', 'code', 'TEXT')
+    add_column('script', 'build_hash', 'VARCHAR(64)')
+    add_column('main_script_single', 'build_hash', 'VARCHAR(64)')
+    add_column('virtual_script_advanced', 'build_hash', 'VARCHAR(64)')
+    add_column('ephemeral_route_single', 'script_id', 'INTEGER')
+
+def _migration_streamed_blob_columns():
+    add_column('main_script_single', 'source_hash', 'VARCHAR(64)')
+    add_column('virtual_script_advanced', 'bytecode_hash', 'VARCHAR(64)')
+
+def _migration_route_expires_at():
+    for table in ('ephemeral_route_single', 'ephemeral_route_vm_advanced2'):
+        add_column(table, 'expires_at', 'TIMESTAMP')
+        # routes only live for minutes, so backfilling row by row is cheap
+        with db.engine.begin() as conn:
+            rows = conn.execute(text(
+                f'SELECT id, created_at, expires_in FROM {_quote(table)} WHERE expires_at IS NULL'
+            )).fetchall()
+            for row_id, created_at, expires_in in rows:
+                if isinstance(created_at, str):
+                    created_at = datetime.fromisoformat(created_at)
+                conn.execute(text(f'UPDATE {_quote(table)} SET expires_at = :expires_at WHERE id = :id'),
+                             {'expires_at': created_at + timedelta(seconds=expires_in or 0), 'id': row_id})
+
+def _migration_route_consumption():
+    for table in ('ephemeral_route_single', 'ephemeral_route_vm_advanced2'):
+        add_column(table, 'consumed_at', 'TIMESTAMP')
+        add_column(table, 'consumed_by', 'VARCHAR(64)')
+
+def _migration_blocked_ip_expiry():
+    add_column('blocked_ip', 'expires_at', 'TIMESTAMP')
+
+def _migration_cache_versions():
+    CacheVersion.__table__.create(db.engine, checkfirst=True)
+    present = {entity for (entity,) in db.session.query(CacheVersion.entity)}
+    db.session.add_all(CacheVersion(entity=e, version=0) for e in INVALIDATION_ENTITIES if e not in present)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # a parallel worker seeded them
+
+MIGRATIONS = [
+    (1, 'index hot-path filter columns', _migration_hot_path_indexes),
+    (2, 'move Revenue rows into series events', _migration_revenue_to_series),
+    (3, 'payload store build pointers', _migration_payload_store_columns),
+    (4, 'source and bytecode blob pointers', _migration_streamed_blob_columns),
+    (5, 'ephemeral route expiry column', _migration_route_expires_at),
+    (6, 'resumable route consumption', _migration_route_consumption),
+    (7, 'expiring IP bans', _migration_blocked_ip_expiry),
+    (8, 'cache invalidation versions', _migration_cache_versions),
+]
+
+def run_migrations():
+    """Apply pending MIGRATIONS in order and return the names applied."""
+    SchemaVersion.__table__.create(db.engine, checkfirst=True)
+    lock_conn = None
+    if db.engine.dialect.name == 'postgresql':
+        # Serialize concurrent workers. AUTOCOMMIT so this connection holds no
+        # snapshot that CREATE INDEX CONCURRENTLY would wait on.
+        lock_conn = db.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        lock_conn.execute(text('SELECT pg_advisory_lock(:k)'), {'k': MIGRATION_LOCK_ID})
+    try:
+        applied = {v for (v,) in db.session.query(SchemaVersion.version)}
+        db.session.rollback()
+        done = []
+        for version, name, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            migrate()
+            try:
+                db.session.add(SchemaVersion(version=version, name=name))
+                db.session.commit()
+            except IntegrityError:
+                # a parallel SQLite worker recorded it first
+                db.session.rollback()
+            print(f"[MIGRATE] applied {version}: {name}")
+            done.append(name)
+        return done
+    finally:
+        if lock_conn is not None:
+            lock_conn.execute(text('SELECT pg_advisory_unlock(:k)'), {'k': MIGRATION_LOCK_ID})
+            lock_conn.close()
 
 ############################
 # Seed Data
@@ -104,11 +555,11 @@ def seed_data():
         db.session.add(ks)
 
     # Revenue chart data
-    if not Revenue.query.first():
-        months = ["Jan","Feb","Mar","Apr","May","Jun","Jul","Aug"]
-        for m in months:
-            r = Revenue(month=m, amount=random.randint(300, 2000))
-            db.session.add(r)
+    if not SeriesEvent.query.filter_by(series='revenue').first():
+        ts = months_back(8)
+        for _ in range(8):
+            record_series_event('revenue', random.randint(300, 2000), occurred_at=ts)
+            ts = next_bucket(ts, 'month')
 
     # Sample keys
     if not Key.query.first():
@@ -119,6 +570,857 @@ def seed_data():
 
     db.session.commit()
 
+############################
+# Metrics
+############################
+# Every gunicorn worker keeps its own counters in memory and dumps them to
+# METRICS_DIR/<pid>.json every few seconds. /metrics sums all the files in
+# that directory, so whichever worker serves the scrape reports node totals.
+# Clear METRICS_DIR when the whole server restarts (like prometheus multiproc).
+METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'eaglehub_metrics')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_HELP = {
+    'eaglehub_request_duration_seconds': ('histogram', 'Request latency by endpoint.'),
+    'eaglehub_request_sql_queries_total': ('counter', 'SQL statements executed by endpoint.'),
+    'eaglehub_request_sql_seconds_total': ('counter', 'Time spent waiting on SQL by endpoint.'),
+    'eaglehub_loader_outcomes_total': ('counter', 'Loader responses by loader and outcome.'),
+    'eaglehub_cache_requests_total': ('counter', 'In-process cache lookups by cache and result.'),
+    'eaglehub_cache_hit_ratio': ('gauge', 'Hits / lookups per cache, derived at scrape time.'),
+}
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for k, v in pairs:
+        v = v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{k}="{v}"')
+    return '{' + ','.join(escaped) + '}'
+
+class Metrics:
+    """Counters and histograms for one worker, summed across workers on scrape."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.counters = {}
+        self.histograms = {}
+        self.last_flush = 0.0
+
+    def _check_fork(self):
+        # A forked worker must not re-report the parent's numbers under its pid.
+        if self.pid != os.getpid():
+            self._reset()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self._check_fork()
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self._check_fork()
+            h = self.histograms.get(key)
+            if h is None:
+                # one slot per bucket, one for +Inf, then sum and count
+                h = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    h[i] += 1
+                    break
+            else:
+                h[len(LATENCY_BUCKETS)] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        with self.lock:
+            self._check_fork()
+            if not force and now - self.last_flush < METRICS_FLUSH_INTERVAL:
+                return
+            self.last_flush = now
+            snapshot = {
+                'counters': [[n, list(l), v] for (n, l), v in self.counters.items()],
+                'histograms': [[n, list(l), list(h)] for (n, l), h in self.histograms.items()],
+            }
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{self.pid}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    def collect(self):
+        """Merge every worker's snapshot into (counters, histograms)."""
+        counters, histograms = {}, {}
+        for fname in os.listdir(self.directory):
+            if not fname.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, fname)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(p) for p in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                key = (name, tuple(tuple(p) for p in labels))
+                merged = histograms.setdefault(key, [0] * len(values))
+                for i, v in enumerate(values):
+                    merged[i] += v
+        return counters, histograms
+
+    def render(self):
+        """Prometheus text exposition format (0.0.4)."""
+        self.flush(force=True)
+        counters, histograms = self.collect()
+
+        hits, lookups = {}, {}
+        for (name, labels), value in counters.items():
+            if name != 'eaglehub_cache_requests_total':
+                continue
+            label_map = dict(labels)
+            cache_key = (('cache', label_map.get('cache', '')),)
+            lookups[cache_key] = lookups.get(cache_key, 0) + value
+            if label_map.get('result') == 'hit':
+                hits[cache_key] = hits.get(cache_key, 0) + value
+        gauges = {('eaglehub_cache_hit_ratio', k): hits.get(k, 0) / total
+                  for k, total in lookups.items() if total}
+
+        # of the routes that did not exist, how many the filter let through to the DB
+        unknown, passed = {}, {}
+        for (name, labels), value in counters.items():
+            label_map = dict(labels)
+            if name != 'eaglehub_route_filter_checks_total' or label_map.get('result') == 'present':
+                continue
+            loader_key = (('loader', label_map.get('loader', '')),)
+            unknown[loader_key] = unknown.get(loader_key, 0) + value
+            if label_map.get('result') == 'false_positive':
+                passed[loader_key] = passed.get(loader_key, 0) + value
+        gauges.update({('eaglehub_route_filter_false_positive_ratio', k): passed.get(k, 0) / total
+                       for k, total in unknown.items() if total})
+
+        by_name = {}
+        for (name, labels), value in list(counters.items()) + list(gauges.items()):
+            by_name.setdefault(name, []).append((labels, value))
+        for (name, labels), values in histograms.items():
+            by_name.setdefault(name, []).append((labels, values))
+
+        lines = []
+        for name in sorted(by_name):
+            kind, help_text = METRIC_HELP.get(name, ('untyped', ''))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(by_name[name]):
+                if kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels, [("le", str(bound))])} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {value[-2]}')
+                lines.append(f'{name}_count{_format_labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics(METRICS_DIR)
+
+def count_loader_outcome(loader, outcome):
+    metrics.inc('eaglehub_loader_outcomes_total', loader=loader, outcome=outcome)
+
+def count_cache_lookup(cache, hit):
+    metrics.inc('eaglehub_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _sql_timer_start(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _sql_timer_stop(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    if has_request_context():
+        g.sql_queries = g.get('sql_queries', 0) + 1
+        g.sql_seconds = g.get('sql_seconds', 0.0) + elapsed
+
+@app.before_request
+def _start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.sql_queries = 0
+    g.sql_seconds = 0.0
+
+@app.teardown_request
+def _record_request_metrics(exc):
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    endpoint = request.endpoint or 'unmatched'
+    metrics.observe('eaglehub_request_duration_seconds', time.perf_counter() - started, endpoint=endpoint)
+    metrics.inc('eaglehub_request_sql_queries_total', g.get('sql_queries', 0), endpoint=endpoint)
+    metrics.inc('eaglehub_request_sql_seconds_total', g.get('sql_seconds', 0.0), endpoint=endpoint)
+    metrics.flush()
+
+############################
+# Write Queue
+############################
+# On SQLite every write transaction takes the single database write lock.
+# Append-only rows that nobody reads back within the request (loader
+# execution events) are queued and inserted by one thread per process, many
+# rows per transaction, so request threads mostly contend for reads.
+WRITE_QUEUE_ENABLED = os.environ.get('WRITE_QUEUE', '1' if SQLITE_PROFILE else '0') == '1'
+WRITE_QUEUE_MAX_BATCH = 500
+WRITE_QUEUE_MAX_DELAY = 0.05  # seconds to wait for a batch to fill
+
+METRIC_HELP['eaglehub_write_queue_rows_total'] = ('counter', 'Rows written by the write queue, by table and result.')
+
+class WriteQueue:
+    """Batches INSERTs from one process into few transactions on a single writer thread."""
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self._pid = None
+        self._queue = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # once per process, so after fork too
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, name='write-queue', daemon=True).start()
+        return self._queue
+
+    def put(self, table, values, invalidates=None):
+        """Queue one row; invalidates=(entity, ident) is published once it is written."""
+        self._ensure_thread().put((table, values, invalidates))
+
+    def flush(self):
+        """Block until everything queued so far is written."""
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def _run(self):
+        pending = self._queue
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + WRITE_QUEUE_MAX_DELAY
+            while len(batch) < WRITE_QUEUE_MAX_BATCH:
+                try:
+                    batch.append(pending.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            by_table = {}
+            for table, values, invalidates in batch:
+                rows, stale = by_table.setdefault(table, ([], set()))
+                rows.append(values)
+                if invalidates:
+                    stale.add(invalidates)
+            for table, (rows, stale) in by_table.items():
+                try:
+                    with app.app_context(), db.engine.begin() as conn:
+                        conn.execute(table.insert(), rows)
+                        events = [(entity, invalidation_bus.bump(conn, entity, ident), ident) for entity, ident in stale]
+                    if events:
+                        invalidation_bus.committed(events)
+                    metrics.inc('eaglehub_write_queue_rows_total', len(rows), table=table.name, result='ok')
+                except Exception as e:
+                    print(f"[WRITE QUEUE] dropped {len(rows)} {table.name} rows: {e}")
+                    metrics.inc('eaglehub_write_queue_rows_total', len(rows), table=table.name, result='dropped')
+            for _ in batch:
+                pending.task_done()
+
+write_queue = WriteQueue(WRITE_QUEUE_ENABLED)
+
+############################
+# Query Budgets
+############################
+# Max SQL statements one request to each endpoint may issue (worst path).
+# Every routed endpoint needs an entry. Lower a number when a route gets
+# cheaper; raising one should be a deliberate review decision.
+QUERY_BUDGETS = {
+    'dashboard': 0,
+    'dashboard_stats_api': 6,
+    'dashboard_series_api': 1,
+    'blocked_ips_page': 1,
+    'heavy_hitters_page': 0,
+    'kill_switch_page': 1,
+    'toggle_kill_switch': 3,
+    'scripts_page': 1,
+    'projects_page': 1,
+    'metrics_page': 0,
+    'healthz': 1,
+    'admission_state': 0,
+    'profiler_control': 0,
+    'profiler_stacks': 0,
+    'memory_control': 0,
+    'keys_page': 2,
+    'edit_key': 3,
+    'delete_key': 3,
+    'bulk_keys': 2,
+    'verify_keys_api': 5,
+    'loader_admin': 7,
+    'loader_create': 2,
+    'loader_catch_all_single': 7,
+    'vm_loader_admin_advanced': 2,
+    'compile_job_status': 1,
+    'versions_page': 2,
+    'rollback_version': 5,
+    'vm_loader_create_advanced': 2,
+    'vm_advanced_loader': 7,
+    'edit_script': 3,
+}
+# Strict mode raises instead of logging; the test client surfaces the error.
+app.config['QUERY_BUDGET_STRICT'] = os.environ.get('QUERY_BUDGET_STRICT') == '1'
+
+METRIC_HELP['eaglehub_query_budget_exceeded_total'] = ('counter', 'Requests that issued more SQL statements than their budget.')
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+@app.after_request
+def _enforce_query_budget(response):
+    endpoint = request.endpoint
+    if endpoint is None or endpoint == 'static':
+        return response
+    used = g.get('sql_queries', 0)
+    budget = QUERY_BUDGETS.get(endpoint)
+    if budget is not None and used <= budget:
+        return response
+    if budget is None:
+        message = f"endpoint {endpoint} has no entry in QUERY_BUDGETS ({used} queries)"
+    else:
+        message = f"endpoint {endpoint} issued {used} queries, budget is {budget}"
+        metrics.inc('eaglehub_query_budget_exceeded_total', endpoint=endpoint)
+    if app.config['QUERY_BUDGET_STRICT'] or app.testing:
+        raise QueryBudgetExceeded(message)
+    print(f"[QUERY BUDGET] {message}")
+    return response
+
+############################
+# Admission Control
+############################
+# When the DB slows down, request threads pile up behind slow loader queries
+# and admin pages and health checks wait along with them. Every endpoint has
+# a concurrency limit; a request that gets no slot within
+# ADMISSION_QUEUE_TIMEOUT is answered 503 + Retry-After at once instead of
+# holding a worker thread. Limits adapt per endpoint: cut by a quarter when
+# the last interval's average latency is over the class target, raised by one
+# when the endpoint was saturated but fast. Operator routes skip the
+# per-endpoint limits and alone may use the last ADMISSION_RESERVED slots of
+# the worker-wide cap, so the kill switch stays reachable during overload.
+# A slot is held until the response body has been sent (send_file streams
+# loader payloads after the view returns), so slow downloads count against
+# the limit and their latency. Catch-all loader hits whose path cannot be a
+# live route (wrong shape, or absent from the route filter) are scanner
+# probes answered 404 without SQL; they share the small 'unmatched' pool,
+# so a junk flood sheds junk and leaves the loader slots to real clients.
+# Admission control is on by default; ADMISSION_CONTROL=0 turns it off.
+# All of this is per worker process: keep ADMISSION_MAX_INFLIGHT at or
+# below gunicorn's --threads, or requests queue in gunicorn where nobody
+# sheds them.
+ADMISSION_ENABLED = os.environ.get('ADMISSION_CONTROL', '1') == '1'
+ADMISSION_MAX_INFLIGHT = int(os.environ.get('ADMISSION_MAX_INFLIGHT', 32))
+ADMISSION_RESERVED = int(os.environ.get('ADMISSION_RESERVED', 4))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 0.1))  # seconds
+ADMISSION_RETRY_AFTER = 1  # seconds
+ADMISSION_ADJUST_INTERVAL = 1.0  # seconds of samples per limit adjustment
+
+# class -> (initial limit, min, max, latency target in seconds)
+ADMISSION_CLASSES = {
+    'loader': (16, 2, 32, 0.25),
+    'api': (4, 1, 8, 1.0),
+    'admin': (8, 1, 16, 0.5),
+    'unmatched': (8, 2, 16, 0.05),
+}
+ADMISSION_ENDPOINT_CLASSES = {
+    'loader_create': 'loader',
+    'loader_catch_all_single': 'loader',
+    'vm_loader_create_advanced': 'loader',
+    'vm_advanced_loader': 'loader',
+    'dashboard_stats_api': 'api',
+    'dashboard_series_api': 'api',
+    'verify_keys_api': 'api',
+    'compile_job_status': 'api',
+    'unmatched': 'unmatched',
+}  # everything else is 'admin'
+ADMISSION_OPERATOR_ENDPOINTS = frozenset({
+    'healthz',
+    'metrics_page',
+    'kill_switch_page',
+    'toggle_kill_switch',
+    'heavy_hitters_page',
+    'profiler_control',
+    'profiler_stacks',
+    'memory_control',
+    'admission_state',
+})
+
+METRIC_HELP['eaglehub_admission_rejected_total'] = ('counter', 'Requests shed with 503, by endpoint and reason.')
+METRIC_HELP['eaglehub_admission_limit_changes_total'] = ('counter', 'Adaptive concurrency limit adjustments, by endpoint and direction.')
+
+class ConcurrencyLimiter:
+    """In-flight limit for one endpoint, adjusted from observed latency (AIMD)."""
+
+    def __init__(self, name, limit, min_limit, max_limit, target):
+        self.name = name
+        self.limit = limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target = target
+        self.cond = threading.Condition()
+        self.inflight = 0
+        self._start_window(time.monotonic())
+
+    def _start_window(self, now):
+        self.window_started = now
+        self.window_count = 0
+        self.window_seconds = 0.0
+        self.window_peak = self.inflight
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.inflight >= self.limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+            self.inflight += 1
+            self.window_peak = max(self.window_peak, self.inflight)
+            return True
+
+    def release(self, elapsed):
+        with self.cond:
+            self.inflight -= 1
+            self.window_count += 1
+            self.window_seconds += elapsed
+            now = time.monotonic()
+            if now - self.window_started >= ADMISSION_ADJUST_INTERVAL:
+                self._adjust()
+                self._start_window(now)
+            self.cond.notify_all()
+
+    def _adjust(self):
+        average = self.window_seconds / self.window_count
+        if average > self.target and self.limit > self.min_limit:
+            self.limit = max(self.min_limit, self.limit * 3 // 4)
+            metrics.inc('eaglehub_admission_limit_changes_total', endpoint=self.name, direction='down')
+        elif average <= self.target and self.window_peak >= self.limit and self.limit < self.max_limit:
+            self.limit += 1
+            metrics.inc('eaglehub_admission_limit_changes_total', endpoint=self.name, direction='up')
+
+class AdmissionController:
+    """Worker-wide in-flight cap with reserved operator slots, plus one limiter per endpoint."""
+
+    def __init__(self, max_inflight, reserved):
+        self.max_inflight = max_inflight
+        self.shared = max(1, max_inflight - reserved)
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.limiters = {}
+
+    def limiter(self, endpoint):
+        lim = self.limiters.get(endpoint)
+        if lim is None:
+            limit, min_limit, max_limit, target = ADMISSION_CLASSES[ADMISSION_ENDPOINT_CLASSES.get(endpoint, 'admin')]
+            max_limit = min(max_limit, self.shared)
+            with self.lock:
+                lim = self.limiters.setdefault(endpoint, ConcurrencyLimiter(
+                    endpoint, min(limit, max_limit), min(min_limit, max_limit), max_limit, target))
+        return lim
+
+    def admit(self, endpoint):
+        """Return (ticket, None) when admitted, else (None, reason)."""
+        operator = endpoint in ADMISSION_OPERATOR_ENDPOINTS
+        with self.lock:
+            if self.inflight >= (self.max_inflight if operator else self.shared):
+                return None, 'worker_full'
+            self.inflight += 1
+        lim = None if operator else self.limiter(endpoint)
+        if lim is not None and not lim.acquire(ADMISSION_QUEUE_TIMEOUT):
+            with self.lock:
+                self.inflight -= 1
+            return None, 'queue_timeout'
+        return (lim, time.perf_counter()), None
+
+    def release(self, ticket):
+        lim, started = ticket
+        if lim is not None:
+            lim.release(time.perf_counter() - started)
+        with self.lock:
+            self.inflight -= 1
+
+    def snapshot(self):
+        with self.lock:
+            limiters = sorted(self.limiters.items())
+        return {
+            'inflight': self.inflight,
+            'max_inflight': self.max_inflight,
+            'shared': self.shared,
+            'endpoints': {name: {'limit': lim.limit, 'inflight': lim.inflight}
+                          for name, lim in limiters},
+        }
+
+admission = AdmissionController(ADMISSION_MAX_INFLIGHT, ADMISSION_RESERVED)
+
+def _admission_endpoint(endpoint):
+    """The limiter a request counts against; probes that cannot hit a live route share 'unmatched'."""
+    if endpoint == 'loader_catch_all_single':
+        route_filter = single_route_filter
+    elif endpoint == 'vm_advanced_loader':
+        route_filter = vm_route_filter
+    else:
+        return endpoint
+    route_name = next(iter(request.view_args.values()), '')
+    return endpoint if might_be_route(route_filter, route_name) else 'unmatched'
+
+@app.before_request
+def _admit_request():
+    endpoint = request.endpoint
+    if not ADMISSION_ENABLED or endpoint is None or endpoint == 'static':
+        return None
+    endpoint = _admission_endpoint(endpoint)
+    ticket, reason = admission.admit(endpoint)
+    if ticket is None:
+        metrics.inc('eaglehub_admission_rejected_total', endpoint=endpoint, reason=reason)
+        response = Response('Server busy, retry shortly.\n', status=503, mimetype='text/plain')
+        response.headers['Retry-After'] = str(ADMISSION_RETRY_AFTER)
+        return response
+    g.admission_ticket = ticket
+
+@app.after_request
+def _release_admission_after_body(response):
+    ticket = g.pop('admission_ticket', None)
+    if ticket is None:
+        return response
+    released = []
+    def release():
+        if not released:
+            released.append(True)
+            admission.release(ticket)
+    body = response.response
+    if response.direct_passthrough and hasattr(body, 'close'):
+        # send_file hands the server its file wrapper directly, so Response.close
+        # (and call_on_close) never runs; hook the wrapper's own close, which
+        # keeps it a file wrapper for sendfile
+        close_body = body.close
+        def close():
+            try:
+                close_body()
+            finally:
+                release()
+        body.close = close
+    else:
+        response.call_on_close(release)
+    return response
+
+@app.teardown_request
+def _release_admission(exc):
+    # only when no response took the ticket over (an after_request hook raised)
+    ticket = g.pop('admission_ticket', None)
+    if ticket is not None:
+        admission.release(ticket)
+
+############################
+# Caching
+############################
+_MISSING = object()
+
+class TTLCache:
+    """Small thread-safe per-worker cache; entries expire ttl seconds after they are set."""
+
+    def __init__(self, name, ttl, max_entries=1024):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self.entries[key]
+                entry = None
+        count_cache_lookup(self.name, entry is not None)
+        return entry[1] if entry is not None else default
+
+    def set(self, key, value):
+        with self.lock:
+            # entries stay in insertion order and share one ttl, so the first
+            # is the one closest to expiry
+            self.entries.pop(key, None)
+            if len(self.entries) >= self.max_entries:
+                del self.entries[next(iter(self.entries))]
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+
+    def drop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def get_or_set(self, key, producer):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = producer()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+############################
+# Invalidation Bus
+############################
+# Keys, bans, the kill switch and build pointers are cached in every worker
+# on every node. A write that changes one calls publish_invalidation(entity,
+# ident) before committing: that bumps the entity's cache_version row in the
+# same transaction and, once the commit succeeds, drops the local entry and
+# broadcasts (entity, version, ident). A receiver applies an event whose
+# version is one past the last it saw; a jump means it missed messages, so
+# it drops every entry of that entity (full resync). Each worker also
+# re-reads cache_version every INVALIDATION_RESYNC_SECONDS, which bounds
+# staleness even while the bus is down. Until the first read succeeds the
+# caches are bypassed.
+#
+# Backends (INVALIDATION_BUS): 'postgres' uses LISTEN/NOTIFY; the NOTIFY is
+# issued by the version bump itself, so it is only delivered on commit.
+# 'file' appends JSON lines to INVALIDATION_DIR/invalidations.log for
+# single-node installs and tests; every worker on the node tails it.
+INVALIDATION_ENTITIES = ('key', 'ban', 'killswitch', 'build')
+INVALIDATION_BACKEND = os.environ.get('INVALIDATION_BUS') or ('file' if SQLITE_PROFILE else 'postgres')
+INVALIDATION_CHANNEL = 'eaglehub_invalidation'
+INVALIDATION_DIR = os.environ.get('INVALIDATION_DIR') or os.path.join(tempfile.gettempdir(), 'eaglehub_invalidation')
+INVALIDATION_RESYNC_SECONDS = float(os.environ.get('INVALIDATION_RESYNC_SECONDS', '10'))
+INVALIDATION_POLL_SECONDS = 0.05  # file backend
+INVALIDATION_FILE_MAX = 1 << 20  # the log is truncated past this; readers resync
+
+METRIC_HELP['eaglehub_invalidations_total'] = ('counter', 'Cache invalidations applied by this worker, by entity and scope (entry, entity, resync).')
+
+class CacheVersion(db.Model):
+    __tablename__ = "cache_version"
+    entity = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class FileInvalidationBackend:
+    def __init__(self, directory):
+        self.path = os.path.join(directory, 'invalidations.log')
+
+    def bump_sql(self):
+        return text('UPDATE cache_version SET version = version + 1 WHERE entity = :entity RETURNING version')
+
+    def send(self, events):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        lines = ''.join(json.dumps({'entity': e, 'version': v, 'id': i}) + '\n' for e, v, i in events)
+        with open(self.path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if os.fstat(f.fileno()).st_size > INVALIDATION_FILE_MAX:
+                f.truncate(0)
+            f.write(lines)
+
+    def listen(self, bus):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        open(self.path, 'a').close()
+        offset = os.path.getsize(self.path)
+        bus.resync()
+        last_resync = time.monotonic()
+        while True:
+            time.sleep(INVALIDATION_POLL_SECONDS)
+            size = os.path.getsize(self.path)
+            if size < offset:
+                # truncated: whatever was appended before we looked is lost
+                offset = 0
+                bus.resync()
+                last_resync = time.monotonic()
+            if size > offset:
+                with open(self.path, 'rb') as f:
+                    f.seek(offset)
+                    data = f.read(size - offset)
+                data = data[:data.rfind(b'\n') + 1]  # leave a half-written line for next time
+                offset += len(data)
+                for line in data.splitlines():
+                    event = json.loads(line)
+                    bus.apply(event['entity'], event['version'], event['id'])
+            if time.monotonic() - last_resync >= INVALIDATION_RESYNC_SECONDS:
+                bus.resync()
+                last_resync = time.monotonic()
+
+class PostgresInvalidationBackend:
+    def bump_sql(self):
+        # version is the new value in RETURNING; pg_notify is transactional
+        return text(
+            "UPDATE cache_version SET version = version + 1 WHERE entity = :entity "
+            f"RETURNING version, pg_notify('{INVALIDATION_CHANNEL}', entity || ' ' || version || ' ' || :ident)"
+        )
+
+    def send(self, events):
+        pass  # already NOTIFYed by bump_sql
+
+    def listen(self, bus):
+        import select
+        raw = db.engine.raw_connection()
+        raw.detach()  # LISTEN state must not go back to the pool
+        try:
+            conn = raw.driver_connection  # psycopg2
+            conn.autocommit = True
+            conn.cursor().execute(f'LISTEN {INVALIDATION_CHANNEL}')
+            bus.resync()
+            last_resync = time.monotonic()
+            while True:
+                if select.select([conn], [], [], INVALIDATION_RESYNC_SECONDS)[0]:
+                    conn.poll()
+                    while conn.notifies:
+                        entity, version, ident = conn.notifies.pop(0).payload.split(' ', 2)
+                        bus.apply(entity, int(version), ident)
+                if time.monotonic() - last_resync >= INVALIDATION_RESYNC_SECONDS:
+                    bus.resync()
+                    last_resync = time.monotonic()
+        finally:
+            raw.close()
+
+class InvalidationBus:
+    """Per-process receiver: tracks the last version applied per entity and drops cache entries."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.caches = {}  # entity -> [InvalidatingCache]
+        self.versions = {}  # entity -> last applied version; empty until the first resync
+        self.generations = dict.fromkeys(INVALIDATION_ENTITIES, 0)
+        self.lock = threading.Lock()
+        self._pid = None
+
+    def register(self, cache):
+        self.caches.setdefault(cache.entity, []).append(cache)
+
+    def ready(self):
+        if self._pid != os.getpid():
+            with self.lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self.versions = {}  # a forked child has not heard anything yet
+                    threading.Thread(target=self._run, name='invalidation-bus', daemon=True).start()
+        return bool(self.versions)
+
+    def generation(self, entity):
+        return self.generations[entity]
+
+    def _drop(self, entity, ident, scope):
+        # caller holds self.lock
+        self.generations[entity] += 1
+        for cache in self.caches.get(entity, ()):
+            cache.clear() if ident is None else cache.drop(ident)
+        metrics.inc('eaglehub_invalidations_total', entity=entity, scope=scope)
+
+    def apply(self, entity, version, ident):
+        with self.lock:
+            known = self.versions.get(entity)
+            if known is None or (version is not None and version <= known):
+                return  # not synced yet, or already applied (our own commit, a resync)
+            gap = version is None or version != known + 1
+            if version is not None:
+                self.versions[entity] = version
+            if gap or ident == '*':
+                self._drop(entity, None, 'entity')
+            else:
+                self._drop(entity, ident, 'entry')
+
+    def resync(self):
+        with db.engine.connect() as conn:
+            stored = dict(conn.execute(db.select(CacheVersion.entity, CacheVersion.version)).all())
+        with self.lock:
+            for entity in INVALIDATION_ENTITIES:
+                version = stored.get(entity, 0)
+                if self.versions.get(entity) != version:
+                    if entity in self.versions:
+                        self._drop(entity, None, 'resync')
+                    self.versions[entity] = version
+
+    def committed(self, events):
+        """Apply and broadcast [(entity, version, ident)] whose transaction just committed."""
+        for entity, version, ident in events:
+            self.apply(entity, version, ident)
+        try:
+            self.backend.send(events)
+        except Exception as e:
+            # receivers catch up at their next resync
+            print(f"[INVALIDATION] broadcast failed: {e}")
+
+    def bump(self, conn, entity, ident):
+        """Increment entity's version on conn (a Session or Connection) inside its transaction."""
+        return conn.execute(self.backend.bump_sql(), {'entity': entity, 'ident': ident}).scalar()
+
+    def _run(self):
+        while True:
+            try:
+                with app.app_context():
+                    self.backend.listen(self)
+            except Exception as e:
+                print(f"[INVALIDATION] listener failed, reconnecting: {e}")
+            with self.lock:
+                self.versions = {}  # bypass caches until we are back in sync
+            time.sleep(1)
+
+invalidation_bus = InvalidationBus(
+    PostgresInvalidationBackend() if INVALIDATION_BACKEND == 'postgres' else FileInvalidationBackend(INVALIDATION_DIR)
+)
+
+def publish_invalidation(entity, ident='*'):
+    """Invalidate ident ('*' = everything) of entity on every node once db.session commits."""
+    ident = str(ident)
+    version = invalidation_bus.bump(db.session, entity, ident)
+    db.session.info.setdefault('invalidations', []).append((entity, version, ident))
+
+@event.listens_for(SASession, 'after_commit')
+def _broadcast_invalidations(session):
+    events = session.info.pop('invalidations', None)
+    if events:
+        invalidation_bus.committed(events)
+
+@event.listens_for(SASession, 'after_rollback')
+def _discard_invalidations(session):
+    session.info.pop('invalidations', None)
+
+class InvalidatingCache(TTLCache):
+    """TTLCache whose entries the bus drops; the ttl is only a backstop."""
+
+    def __init__(self, name, entity, ttl, max_entries):
+        super().__init__(name, ttl, max_entries)
+        self.entity = entity
+        invalidation_bus.register(self)
+
+    def get_or_set(self, key, producer):
+        if not invalidation_bus.ready():
+            return producer()
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            generation = invalidation_bus.generation(self.entity)
+            value = producer()
+            # an invalidation that landed while we read may describe a newer row
+            if invalidation_bus.generation(self.entity) == generation:
+                self.set(key, value)
+        return value
+
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', '300'))
+key_cache = InvalidatingCache('keys', 'key', AUTH_CACHE_TTL, 100000)  # value -> (id, hwid, expires_at) or None
+ban_cache = InvalidatingCache('bans', 'ban', AUTH_CACHE_TTL, 100000)  # ip -> banned until, or None
+kill_switch_cache = InvalidatingCache('kill_switch', 'killswitch', AUTH_CACHE_TTL, 1)
+build_cache = InvalidatingCache('builds', 'build', AUTH_CACHE_TTL, 1024)  # (kind, script id) -> build pointer
+
 ############################
 # Single Big HTML
 ############################
@@ -246,6 +1548,10 @@ big_html = r"""
           <i class="bi bi-code-slash"></i>
           <span>Scripts</span>
         </li>
+        <li onclick="window.location.href='/projects'">
+          <i class="bi bi-folder2-open"></i>
+          <span>Projects</span>
+        </li>
         <li onclick="window.location.href='/blocked_ips'">
           <i class="bi bi-shield-exclamation"></i>
           <span>Blocked IPs</span>
@@ -289,26 +1595,71 @@ big_html = r"""
 
     <div class="main-content">
       {% if page == 'dashboard' %}
-        <!-- Dashboard Stats Cards, charts, projects, etc. -->
-        {{ dashboard_content|safe }}
+        <!-- Static shell; numbers, charts and projects come from /api/dashboard/* -->
+        <div class="row mb-4">
+          {% for stat_id, label in [('total_executions', 'Total Exec'), ('total_users', 'Total Users'),
+                                    ('monthly_executions', 'Monthly Exec'), ('blocked_ips', 'Blocked IPs'),
+                                    ('kill_switch', 'Kill Switch'), ('monthly_revenue', 'Monthly Rev')] %}
+          <div class="col-md-2">
+            <div class="card">
+              <div class="card-body text-center">
+                <h6>{{ label }}</h6>
+                <h3 id="stat-{{ stat_id }}">&hellip;</h3>
+              </div>
+            </div>
+          </div>
+          {% endfor %}
+        </div>
+
+        <div class="chart-container p-3 mb-4">
+          <h5>Executions Over Time</h5>
+          <canvas id="execChart"></canvas>
+        </div>
+        <div class="chart-container p-3 mb-4">
+          <h5>Revenue Over Time</h5>
+          <canvas id="revenueChart"></canvas>
+        </div>
+        <p>Recent projects (<a href="/projects">view all</a>):</p>
+        <ul id="dashboard-projects"></ul>
 
       {% elif page == 'blocked_ips' %}
         <h3>Blocked IPs</h3>
         <table class="table table-dark table-striped">
           <thead>
-            <tr><th>IP Address</th><th>Reason</th><th>Created</th></tr>
+            <tr><th>IP Address</th><th>Reason</th><th>Created</th><th>Expires</th></tr>
           </thead>
           <tbody>
           {% for b in blocked_ips %}
-            <tr>
+            <tr{% if b.expires_at and b.expires_at < now %} class="text-muted"{% endif %}>
               <td>{{ b.ip_address }}</td>
               <td>{{ b.reason }}</td>
               <td>{{ b.created_at.strftime('%Y-%m-%d') }}</td>
+              <td>{{ b.expires_at.strftime('%Y-%m-%d %H:%M') if b.expires_at else 'never' }}</td>
             </tr>
           {% endfor %}
           </tbody>
         </table>
         <button class="btn btn-sm btn-success">+ Add Blocked IP</button>
+        <a href="{{ url_for('heavy_hitters_page') }}" class="btn btn-sm btn-secondary">Heavy hitters</a>
+
+      {% elif page == 'heavy_hitters' %}
+        <h3>Heavy Hitters <small class="text-muted">worker {{ pid }}, last {{ window }}s</small></h3>
+        <p>Top sources of suspicious loader requests (failed token, key, ban or environment checks).
+           IPs reaching {{ ip_threshold }} guaranteed events are blocked for {{ ban_minutes }} minutes{% if not autoban %} (auto-ban is off){% endif %}.</p>
+        {% for title, rows, threshold in [('IP address', ips, ip_threshold), ('Key', keys, key_threshold)] %}
+        <table class="table table-dark table-striped table-sm">
+          <thead><tr><th>{{ title }}</th><th>Events (est.)</th><th>Overcount bound</th></tr></thead>
+          <tbody>
+          {% for item, count, error in rows %}
+            <tr{% if count - error >= threshold %} class="table-danger"{% endif %}>
+              <td>{{ item }}</td><td>{{ count }}</td><td>&le; {{ error }}</td>
+            </tr>
+          {% else %}
+            <tr><td colspan="3" class="text-muted">Nothing suspicious in the window.</td></tr>
+          {% endfor %}
+          </tbody>
+        </table>
+        {% endfor %}
 
       {% elif page == 'killswitch' %}
         <h3>Kill Switch</h3>
@@ -324,6 +1675,31 @@ big_html = r"""
           </div>
         </div>
 
+      {% elif page == 'projects' %}
+        <h3>Projects</h3>
+        <table class="table table-dark table-striped">
+          <thead>
+            <tr><th>Name</th><th>Scripts</th><th>Last Script Update</th><th>Executions</th><th>Created</th></tr>
+          </thead>
+          <tbody>
+          {% for p in projects %}
+            <tr>
+              <td><a href="{{ url_for('scripts_page', project_id=p.id) }}">{{ p.name }}</a></td>
+              <td>{{ p.script_count }}</td>
+              <td>{{ p.last_update.strftime('%Y-%m-%d') if p.last_update else 'Never' }}</td>
+              <td>{{ p.executions }}</td>
+              <td>{{ p.created_at.strftime('%Y-%m-%d') }}</td>
+            </tr>
+          {% endfor %}
+          </tbody>
+        </table>
+        {% if page_number > 1 %}
+          <a href="{{ url_for('projects_page', page=page_number - 1) }}" class="btn btn-sm btn-secondary">&laquo; Prev</a>
+        {% endif %}
+        {% if has_next %}
+          <a href="{{ url_for('projects_page', page=page_number + 1) }}" class="btn btn-sm btn-secondary">Next &raquo;</a>
+        {% endif %}
+
       {% elif page == 'scripts' %}
         <h3>{{ project.name }} Scripts</h3>
         <table class="table table-dark table-striped">
@@ -337,7 +1713,7 @@ big_html = r"""
               <td>{{ s.version or 'N/A' }}</td>
               <td>{{ s.updated_at.strftime('%Y-%m-%d') }}</td>
               <td>
-                <a href="#" class="btn btn-sm btn-purple">Edit</a>
+                <a href="{{ url_for('edit_script', project_id=project.id, script_id=s.id) }}" class="btn btn-sm btn-purple">Edit</a>
                 <a href="#" class="btn btn-sm btn-danger">Delete</a>
               </td>
             </tr>
@@ -390,6 +1766,48 @@ big_html = r"""
           <button type="submit" class="btn btn-success btn-sm">Create Key</button>
         </form>
 
+        <!-- Bulk operations: one UPDATE/DELETE for every matching key -->
+        <h5 class="mt-4">Bulk Operations</h5>
+        <form method="POST" action="{{ url_for('bulk_keys') }}">
+          <div class="form-row">
+            <div class="form-group col-md-3">
+              <label>Operation</label>
+              <select name="operation" class="form-control">
+                <option value="extend">Extend expiry by N days</option>
+                <option value="revoke">Revoke (expire now)</option>
+                <option value="clear_hwid">Clear HWIDs</option>
+                <option value="delete_expired">Delete expired keys</option>
+              </select>
+            </div>
+            <div class="form-group col-md-2">
+              <label>Days</label>
+              <input type="number" name="days" class="form-control" value="0">
+            </div>
+            <div class="form-group col-md-2">
+              <label>Keys</label>
+              <select name="state" class="form-control">
+                <option value="active">Active</option>
+                <option value="expired">Expired</option>
+                <option value="all">All</option>
+              </select>
+            </div>
+            <div class="form-group col-md-2">
+              <label>Value prefix</label>
+              <input type="text" name="prefix" class="form-control">
+            </div>
+            <div class="form-group col-md-3">
+              <label>Created between (YYYY-MM-DD)</label>
+              <input type="text" name="created_from" class="form-control" placeholder="from">
+              <input type="text" name="created_to" class="form-control" placeholder="to (exclusive)">
+            </div>
+          </div>
+          <div class="form-check mb-2">
+            <input type="checkbox" name="dry_run" value="1" class="form-check-input" checked>
+            <label class="form-check-label">Dry run (only count matching keys)</label>
+          </div>
+          <button type="submit" class="btn btn-warning btn-sm">Run</button>
+        </form>
+
       {% elif page == 'edit_key' %}
         <h3>Edit Key #{{ key.id }}</h3>
         <form method="POST">
@@ -404,6 +1822,46 @@ big_html = r"""
           <button type="submit" class="btn btn-primary btn-sm">Save Changes</button>
           <a href="{{ url_for('keys_page') }}" class="btn btn-secondary btn-sm">Cancel</a>
         </form>
+        <hr/>
+        <h5>Usage (last {{ usage|length }} days with traffic)</h5>
+        {% if usage %}
+        <table class="table table-sm">
+          <thead><tr><th>Day (UTC)</th><th>Distinct IPs</th><th>Distinct HWIDs</th></tr></thead>
+          <tbody>
+          {% for day, ips, hwids in usage %}
+            <tr{% if ips > 5 or hwids > 1 %} class="table-warning"{% endif %}>
+              <td>{{ day }}</td><td>{{ ips }}</td><td>{{ hwids }}</td>
+            </tr>
+          {% endfor %}
+          </tbody>
+        </table>
+        <small class="text-muted">Estimates (about 3% error); several HWIDs or many IPs on one day suggest a shared key.</small>
+        {% else %}
+        <p class="text-muted">No loader use recorded.</p>
+        {% endif %}
+
+      {% elif page == 'edit_script' %}
+        <h3>{{ script.name }} <small class="text-muted">{{ project.name }}</small></h3>
+        <form method="POST">
+          <div class="form-group">
+            <label>Version</label>
+            <input type="text" name="version" class="form-control" value="{{ script.version or '' }}">
+          </div>
+          <div class="form-group">
+            <label>Lua Code</label>
+            <textarea name="code" rows="12" class="form-control">{{ script.code or '' }}</textarea>
+          </div>
+          <button type="submit" class="btn btn-success btn-sm">Publish</button>
+          <a href="{{ url_for('scripts_page', project_id=project.id) }}" class="btn btn-secondary btn-sm">Cancel</a>
+        </form>
+        {% if script.build_hash %}
+          <hr/>
+          <p>Published build <code>{{ script.build_hash[:12] }}</code>.
+             <a href="{{ url_for('loader_create', script_id=script.id) }}">Create loader route</a></p>
+        {% endif %}
+
+      {% elif content %}
+        {{ content|safe }}
 
       {% else %}
         <h3>404 Not Found</h3>
@@ -414,51 +1872,51 @@ big_html = r"""
     <script src="https://cdn.jsdelivr.net/npm/jquery@3.6.0/dist/jquery.min.js"></script>
     <script src="https://cdn.jsdelivr.net/npm/bootstrap@4.6.2/dist/js/bootstrap.bundle.min.js"></script>
 
-    <!-- RE-ADD Chart.js for the Dashboard -->
+    {% if page == 'dashboard' %}
     <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
     <script>
-      // If you want the old chart logic back, you can do it here:
-      // We'll look for a canvas with id="execChart" or "revenueChart" in your "dashboard_content".
-      // For example:
-      /*
-      const execData = [100,200,300,400];
-      const revData = [500,600,700,800];
-
-      window.onload = function() {
-        const execCtx = document.getElementById('execChart');
-        if (execCtx) {
-          new Chart(execCtx, {
-            type: 'line',
-            data: {
-              labels: ['Jan','Feb','Mar','Apr'],
-              datasets: [{
-                label: 'Executions',
-                data: execData,
-                borderColor: '#4e73df',
-                fill: false
-              }]
-            },
-            options: {}
+      function drawSeries(canvasId, series, type, label, color) {
+        fetch('/api/dashboard/series?series=' + series + '&granularity=month')
+          .then(function (r) { return r.json(); })
+          .then(function (data) {
+            new Chart(document.getElementById(canvasId), {
+              type: type,
+              data: {
+                labels: data.points.map(function (p) { return p.t.slice(0, 7); }),
+                datasets: [{
+                  label: label,
+                  data: data.points.map(function (p) { return p.v; }),
+                  borderColor: color,
+                  backgroundColor: color,
+                  fill: false
+                }]
+              },
+              options: { maintainAspectRatio: false }
+            });
           });
-        }
-        const revCtx = document.getElementById('revenueChart');
-        if (revCtx) {
-          new Chart(revCtx, {
-            type: 'bar',
-            data: {
-              labels: ['Jan','Feb','Mar','Apr'],
-              datasets: [{
-                label: 'Revenue',
-                data: revData,
-                backgroundColor: '#1cc88a'
-              }]
-            },
-            options: {}
+      }
+
+      window.onload = function () {
+        fetch('/api/dashboard/stats')
+          .then(function (r) { return r.json(); })
+          .then(function (stats) {
+            ['total_executions', 'total_users', 'monthly_executions', 'blocked_ips'].forEach(function (k) {
+              document.getElementById('stat-' + k).textContent = stats[k];
+            });
+            document.getElementById('stat-kill_switch').textContent = stats.kill_switch ? 'ON' : 'OFF';
+            document.getElementById('stat-monthly_revenue').textContent = '$' + stats.monthly_revenue;
+            var list = document.getElementById('dashboard-projects');
+            stats.projects.forEach(function (p) {
+              var li = document.createElement('li');
+              li.textContent = p.name + ' (Created: ' + p.created_at.slice(0, 10) + ')';
+              list.appendChild(li);
+            });
           });
-        }
+        drawSeries('execChart', 'executions', 'line', 'Executions', '#4e73df');
+        drawSeries('revenueChart', 'revenue', 'bar', 'Revenue', '#1cc88a');
       };
-      */
     </script>
+    {% endif %}
 </html>
 """
 
@@ -466,100 +1924,76 @@ big_html = r"""
 # Routes
 ############################
 
+DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', '10'))
+DASHBOARD_SHELL_MAX_AGE = 86400
+DASHBOARD_RECENT_PROJECTS = 10
+dashboard_cache = TTLCache('dashboard', DASHBOARD_CACHE_TTL)
+_dashboard_shell = {}
+
+def _json_response(payload, max_age):
+    response = jsonify(payload)
+    response.headers['Cache-Control'] = f'private, max-age={max_age}'
+    response.add_etag()
+    return response.make_conditional(request)
+
 @app.route('/')
 def dashboard():
-    """Show the main dashboard (stats, charts, projects)."""
-    total_executions = 6370
-    total_users = 1500
-    monthly_executions = 512
-    blocked_ips_count = BlockedIP.query.count()
-
+    """Serve the dashboard shell; its numbers and charts load from /api/dashboard/*."""
+    if 'body' not in _dashboard_shell:
+        _dashboard_shell['body'] = render_template_string(big_html, page='dashboard')
+    response = Response(_dashboard_shell['body'], mimetype='text/html')
+    response.headers['Cache-Control'] = f'public, max-age={DASHBOARD_SHELL_MAX_AGE}'
+    response.add_etag()
+    return response.make_conditional(request)
+
+def dashboard_stats():
+    """Stat cards and project list for the dashboard."""
+    ensure_rollup_thread()
+    month_start = bucket_start(datetime.utcnow(), 'month')
     ks = KillSwitch.query.first()
-    kill_switch_active = (ks.active if ks else False)
-
-    # Example exec chart data
-    exec_chart_data = [random.randint(100, 900) for _ in range(8)]
-    # Example revenue chart data
-    rev_rows = Revenue.query.all()
-    revenue_chart_data = [r.amount for r in rev_rows]
-    monthly_revenue = rev_rows[-1].amount if rev_rows else 0
-
-    projects = Project.query.all()
-
-    # We'll build the dashboard content, including placeholders for charts
-    dashboard_content = f"""
-    <div class="row mb-4">
-      <div class="col-md-2">
-        <div class="card">
-          <div class="card-body text-center">
-            <h6>Total Exec</h6>
-            <h3>{total_executions}</h3>
-          </div>
-        </div>
-      </div>
-      <div class="col-md-2">
-        <div class="card">
-          <div class="card-body text-center">
-            <h6>Total Users</h6>
-            <h3>{total_users}</h3>
-          </div>
-        </div>
-      </div>
-      <div class="col-md-2">
-        <div class="card">
-          <div class="card-body text-center">
-            <h6>Monthly Exec</h6>
-            <h3>{monthly_executions}</h3>
-          </div>
-        </div>
-      </div>
-      <div class="col-md-2">
-        <div class="card">
-          <div class="card-body text-center">
-            <h6>Blocked IPs</h6>
-            <h3>{blocked_ips_count}</h3>
-          </div>
-        </div>
-      </div>
-      <div class="col-md-2">
-        <div class="card">
-          <div class="card-body text-center">
-            <h6>Kill Switch</h6>
-            <h3>{'ON' if kill_switch_active else 'OFF'}</h3>
-          </div>
-        </div>
-      </div>
-      <div class="col-md-2">
-        <div class="card">
-          <div class="card-body text-center">
-            <h6>Monthly Rev</h6>
-            <h3>${monthly_revenue}</h3>
-          </div>
-        </div>
-      </div>
-    </div>
-
-    <!-- Example chart containers -->
-    <div class="chart-container p-3 mb-4">
-      <h5>Executions Over Time</h5>
-      <canvas id="execChart"></canvas>
-    </div>
-    <div class="chart-container p-3 mb-4">
-      <h5>Revenue Over Time</h5>
-      <canvas id="revenueChart"></canvas>
-    </div>
-    <p>Projects:</p>
-    <ul>
-    """
-    for p in projects:
-        dashboard_content += f"<li>{p.name} (Created: {p.created_at.strftime('%Y-%m-%d')})</li>"
-    dashboard_content += "</ul>"
+    return {
+        'total_executions': series_total('executions'),
+        'total_users': 1500,
+        'monthly_executions': series_points('executions', 'month', month_start, month_start)[0][1],
+        'blocked_ips': BlockedIP.query.count(),
+        'kill_switch': bool(ks and ks.active),
+        'monthly_revenue': series_points('revenue', 'month', month_start, month_start)[0][1],
+        'projects': [
+            {'name': p.name, 'created_at': p.created_at.isoformat()}
+            for p in Project.query.order_by(Project.id.desc()).limit(DASHBOARD_RECENT_PROJECTS).all()
+        ],
+    }
+
+@app.route('/api/dashboard/stats')
+def dashboard_stats_api():
+    """JSON stat cards, cached for DASHBOARD_CACHE_TTL seconds."""
+    return _json_response(dashboard_cache.get_or_set('stats', dashboard_stats), DASHBOARD_CACHE_TTL)
+
+@app.route('/api/dashboard/series')
+def dashboard_series_api():
+    """JSON chart series: ?series=executions|revenue&granularity=hour|day|month&start=&end= (ISO dates)."""
+    series = request.args.get('series', 'executions')
+    granularity = request.args.get('granularity', 'month')
+    if series not in ('executions', 'revenue') or granularity not in SERIES_GRANULARITIES:
+        return jsonify(error="unknown series or granularity"), 400
+    try:
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else datetime.utcnow()
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else months_back(8, end)
+    except ValueError:
+        return jsonify(error="start and end must be ISO dates"), 400
+
+    scope = request.args.get('scope', 0, type=int)
+    cache_key = ('series', series, granularity, scope, bucket_start(start, granularity), bucket_start(end, granularity))
+
+    def load():
+        points = series_points(series, granularity, start, end, scope=scope)
+        return {
+            'series': series,
+            'granularity': granularity,
+            'points': [{'t': ts.isoformat(), 'v': total} for ts, total in points],
+        }
 
-    return render_template_string(
-        big_html,
-        page='dashboard',
-        dashboard_content=dashboard_content
-    )
+    return _json_response(dashboard_cache.get_or_set(cache_key, load), DASHBOARD_CACHE_TTL)
 
 @app.route('/blocked_ips')
 def blocked_ips_page():
@@ -568,7 +2002,25 @@ def blocked_ips_page():
     return render_template_string(
         big_html,
         page='blocked_ips',
-        blocked_ips=blocked_ips
+        blocked_ips=blocked_ips,
+        now=datetime.utcnow()
+    )
+
+@app.route('/blocked_ips/heavy-hitters')
+def heavy_hitters_page():
+    """This worker's current top suspicious IPs and keys."""
+    ips, keys = abuse_tracker.top(ABUSE_TOP_SHOWN)
+    return render_template_string(
+        big_html,
+        page='heavy_hitters',
+        ips=ips,
+        keys=keys,
+        pid=os.getpid(),
+        window=ABUSE_WINDOW_SECONDS,
+        ip_threshold=ABUSE_IP_THRESHOLD,
+        key_threshold=ABUSE_KEY_THRESHOLD,
+        ban_minutes=ABUSE_BAN_SECONDS // 60,
+        autoban=ABUSE_AUTOBAN
     )
 
 @app.route('/killswitch')
@@ -589,22 +2041,29 @@ def toggle_kill_switch():
     if not ks:
         ks = KillSwitch(active=False)
         db.session.add(ks)
-        db.session.commit()
 
     if mode == 'on':
         ks.active = True
     elif mode == 'off':
         ks.active = False
 
+    active = ks.active  # read before commit expires it
+    publish_invalidation('killswitch')
     db.session.commit()
-    flash(f"Kill switch turned {'ON' if ks.active else 'OFF'}.", "info")
+    flash(f"Kill switch turned {'ON' if active else 'OFF'}.", "info")
     return redirect(url_for('kill_switch_page'))
 
 @app.route('/scripts/<int:project_id>')
 def scripts_page(project_id):
     """Show scripts for a given project."""
-    project = Project.query.get_or_404(project_id)
-    scripts = Script.query.filter_by(project_id=project_id).all()
+    # project and its scripts in one round trip
+    rows = db.session.query(Project, Script).outerjoin(
+        Script, Script.project_id == Project.id
+    ).filter(Project.id == project_id).order_by(Script.id).all()
+    if not rows:
+        abort(404)
+    project = rows[0][0]
+    scripts = [s for _, s in rows if s is not None]
     return render_template_string(
         big_html,
         page='scripts',
@@ -612,6 +2071,253 @@ def scripts_page(project_id):
         scripts=scripts
     )
 
+@app.route('/scripts/<int:project_id>/<int:script_id>/edit', methods=['GET','POST'])
+def edit_script(project_id, script_id):
+    """Edit a script's source and publish its loader payload."""
+    script = Script.query.filter_by(id=script_id, project_id=project_id).first_or_404()
+    if request.method == 'POST':
+        script.code = request.form.get('code', '')
+        script.version = request.form.get('version') or script.version
+        script.updated_at = datetime.utcnow()
+        build_payload(script)
+        publish_invalidation('build')
+        db.session.commit()
+        flash("Script published!", "success")
+        return redirect(url_for('scripts_page', project_id=project_id))
+
+    return render_template_string(
+        big_html,
+        page='edit_script',
+        project=db.session.get(Project, project_id),
+        script=script
+    )
+
+PROJECTS_PER_PAGE = 50
+PROJECT_OVERVIEW_TTL = 30
+project_overview_cache = TTLCache('project_overview', PROJECT_OVERVIEW_TTL)
+
+def project_overview(page, per_page):
+    """One page of projects with script count, latest script update and executions, in one query."""
+    script_stats = db.session.query(
+        Script.project_id.label('project_id'),
+        db.func.count(Script.id).label('script_count'),
+        db.func.max(Script.updated_at).label('last_update')
+    ).group_by(Script.project_id).subquery()
+    exec_stats = db.session.query(
+        SeriesRollup.scope.label('project_id'),
+        db.func.sum(SeriesRollup.total).label('executions')
+    ).filter(
+        SeriesRollup.series == 'executions',
+        SeriesRollup.granularity == 'month',
+        SeriesRollup.scope != 0
+    ).group_by(SeriesRollup.scope).subquery()
+    rows = db.session.query(
+        Project.id,
+        Project.name,
+        Project.created_at,
+        db.func.coalesce(script_stats.c.script_count, 0).label('script_count'),
+        script_stats.c.last_update,
+        db.func.coalesce(exec_stats.c.executions, 0).label('executions')
+    ).outerjoin(
+        script_stats, script_stats.c.project_id == Project.id
+    ).outerjoin(
+        exec_stats, exec_stats.c.project_id == Project.id
+    ).order_by(Project.id).offset((page - 1) * per_page).limit(per_page + 1).all()
+    # fetched one extra row to learn whether a next page exists without a COUNT
+    return rows[:per_page], len(rows) > per_page
+
+@app.route('/projects')
+def projects_page():
+    """Paginated project overview with per-project aggregates."""
+    page_number = max(request.args.get('page', 1, type=int), 1)
+    projects, has_next = project_overview_cache.get_or_set(
+        page_number, lambda: project_overview(page_number, PROJECTS_PER_PAGE)
+    )
+    return render_template_string(
+        big_html,
+        page='projects',
+        projects=projects,
+        page_number=page_number,
+        has_next=has_next
+    )
+
+def bearer_token_required(token):
+    """Allow the request only with 'Authorization: Bearer <token>' (or X-Admin-Token); 404 while token is unset."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not token:
+                abort(404)
+            auth = request.headers.get('Authorization', '')
+            supplied = auth[7:] if auth.startswith('Bearer ') else request.headers.get('X-Admin-Token', '')
+            if not secrets.compare_digest(supplied.encode(), token.encode()):
+                abort(403)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+admin_token_required = bearer_token_required(ADMIN_TOKEN)
+
+@app.route('/metrics')
+@bearer_token_required(METRICS_TOKEN)
+def metrics_page():
+    """Prometheus scrape endpoint (totals for every worker on this node)."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/healthz')
+def healthz():
+    """Liveness for load balancers; ?db=1 also round-trips the database. Says nothing else."""
+    if request.args.get('db') == '1':
+        try:
+            db.session.execute(text('SELECT 1'))
+        except OperationalError:
+            return jsonify(status='db_unavailable'), 503
+    return jsonify(status='ok')
+
+@app.route('/debug/admission')
+@admin_token_required
+def admission_state():
+    """This worker's in-flight counts and current adaptive limits."""
+    return jsonify(pid=os.getpid(), **admission.snapshot())
+
+############################
+# Live Diagnostics
+############################
+# Hooks for looking inside one running worker: a stack-sampling profiler and
+# tracemalloc snapshots. Both act on the process that serves the request, so
+# under gunicorn repeat calls until the reported pid is the worker you want.
+# Nothing is installed until started; stopped, they cost nothing.
+PROFILER_DEFAULT_INTERVAL = 0.005  # seconds between samples
+PROFILER_MAX_SECONDS = 600  # the sampler stops itself after this long
+MEMORY_TRACE_FRAMES = 10
+
+class StackSampler:
+    """Samples every thread's stack from a timer thread and counts collapsed stacks."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stacks = {}
+        self.samples = 0
+        self.started_at = None
+        self._stop = None
+
+    @property
+    def running(self):
+        return self._stop is not None and not self._stop.is_set()
+
+    def start(self, interval, seconds):
+        with self.lock:
+            if self.running:
+                return False
+            self.stacks, self.samples = {}, 0
+            self.started_at = time.time()
+            self._stop = threading.Event()
+            threading.Thread(target=self._run, args=(self._stop, interval, time.monotonic() + seconds),
+                             daemon=True, name='stack-sampler').start()
+            return True
+
+    def stop(self):
+        with self.lock:
+            if self._stop is not None:
+                self._stop.set()
+
+    def _run(self, stop, interval, deadline):
+        own = threading.get_ident()
+        while not stop.wait(interval) and time.monotonic() < deadline:
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    key = ';'.join(reversed(stack))
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+                self.samples += 1
+            del frames
+        stop.set()
+
+    def collapsed(self):
+        """Brendan Gregg's folded format: 'root;...;leaf count' per line, for flamegraph.pl/speedscope."""
+        with self.lock:
+            items = sorted(self.stacks.items(), key=lambda item: -item[1])
+        return ''.join(f"{stack} {count}\n" for stack, count in items)
+
+stack_sampler = StackSampler()
+_memory_baseline = {}
+
+def _diagnostics_header():
+    return f"# pid {os.getpid()}\n"
+
+@app.route('/debug/profile/<action>', methods=['POST'])
+@admin_token_required
+def profiler_control(action):
+    """start (?interval=seconds&seconds=N) or stop the stack sampler in this worker."""
+    if action == 'start':
+        interval = max(request.args.get('interval', PROFILER_DEFAULT_INTERVAL, type=float), 0.001)
+        seconds = min(request.args.get('seconds', PROFILER_MAX_SECONDS, type=float), PROFILER_MAX_SECONDS)
+        if not stack_sampler.start(interval, seconds):
+            return jsonify(error="profiler already running", pid=os.getpid()), 409
+    elif action == 'stop':
+        stack_sampler.stop()
+    else:
+        abort(404)
+    return jsonify(pid=os.getpid(), running=stack_sampler.running, samples=stack_sampler.samples)
+
+@app.route('/debug/profile')
+@admin_token_required
+def profiler_stacks():
+    """Download the collapsed stacks sampled so far (works while running or after stop)."""
+    header = _diagnostics_header() + f"# samples {stack_sampler.samples} running {int(stack_sampler.running)}\n"
+    return Response(header + stack_sampler.collapsed(), mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename=stacks-{os.getpid()}.folded'})
+
+@app.route('/debug/memory/<action>', methods=['GET', 'POST'])
+@admin_token_required
+def memory_control(action):
+    """start/stop tracemalloc, take a baseline snapshot, or diff against it.
+
+    snapshot and diff list the top ?limit= entries grouped by ?group=
+    (lineno, filename or traceback); diff shows what grew since the baseline.
+    """
+    group = request.args.get('group', 'lineno')
+    if group not in ('lineno', 'filename', 'traceback'):
+        return jsonify(error="group must be lineno, filename or traceback"), 400
+    limit = min(request.args.get('limit', 25, type=int), 500)
+    if action == 'start':
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_TRACE_FRAMES)
+        return jsonify(pid=os.getpid(), tracing=True)
+    if action == 'stop':
+        tracemalloc.stop()
+        _memory_baseline.clear()
+        return jsonify(pid=os.getpid(), tracing=False)
+    if action not in ('snapshot', 'diff'):
+        abort(404)
+    if not tracemalloc.is_tracing():
+        return jsonify(error="tracemalloc is not running; POST /debug/memory/start first", pid=os.getpid()), 409
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [_diagnostics_header().rstrip(), f"# traced {current} bytes, peak {peak} bytes"]
+    if action == 'snapshot':
+        _memory_baseline['snapshot'] = snapshot
+        stats = snapshot.statistics(group)
+    elif 'snapshot' not in _memory_baseline:
+        return jsonify(error="no baseline; POST /debug/memory/snapshot first", pid=os.getpid()), 409
+    else:
+        stats = [stat for stat in snapshot.compare_to(_memory_baseline['snapshot'], group) if stat.size_diff > 0]
+    for stat in stats[:limit]:
+        lines.append(str(stat))
+        if group == 'traceback':
+            lines.extend('    ' + line for line in stat.traceback.format())
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain')
+
 ######################
 # KEY MANAGER ROUTES
 ######################
@@ -630,6 +2336,7 @@ def keys_page():
             expires_at = None
         new_key = Key(value=key_value, hwid=hwid, expires_at=expires_date)
         db.session.add(new_key)
+        publish_invalidation('key', key_value)
         db.session.commit()
         flash("Key created!", "success")
         return redirect(url_for('keys_page'))
@@ -653,6 +2360,7 @@ def edit_key(key_id):
         else:
             key.expires_at = None
         key.hwid = hwid
+        publish_invalidation('key', key.value)
         db.session.commit()
         flash("Key updated!", "success")
         return redirect(url_for('keys_page'))
@@ -666,7 +2374,166 @@ def edit_key(key_id):
         big_html,
         page='edit_key',
         key=key,
-        days_left=days_left
+        days_left=days_left,
+        usage=key_usage_summary(key.id)
+    )
+
+# Bulk key maintenance runs as one set-based UPDATE or DELETE, so extending
+# every active key after an outage is a single statement however many keys
+# exist. Each operation also filters out rows it would not change, which
+# makes the dry-run count equal to the rows a real run affects.
+KEY_BULK_OPERATIONS = ('extend', 'revoke', 'clear_hwid', 'delete_expired')
+
+def key_bulk_conditions(operation, now, prefix=None, created_from=None, created_to=None, state='active'):
+    active = db.or_(Key.expires_at.is_(None), Key.expires_at > now)
+    conditions = []
+    if prefix:
+        conditions.append(Key.value.startswith(prefix, autoescape=True))
+    if created_from:
+        conditions.append(Key.created_at >= created_from)
+    if created_to:
+        conditions.append(Key.created_at < created_to)
+    if state == 'active':
+        conditions.append(active)
+    elif state == 'expired':
+        conditions.append(Key.expires_at <= now)
+    if operation == 'extend':
+        conditions.append(Key.expires_at.isnot(None))
+    elif operation == 'revoke':
+        conditions.append(active)
+    elif operation == 'clear_hwid':
+        conditions.append(Key.hwid.isnot(None))
+    elif operation == 'delete_expired':
+        conditions.append(Key.expires_at <= now)
+    return conditions
+
+def shift_datetime(column, days):
+    """SQL for column + days; SQLite has no interval arithmetic."""
+    if db.engine.dialect.name == 'sqlite':
+        # SQLite's %f is seconds with milliseconds; pad it back to the
+        # microsecond layout SQLAlchemy stores so comparisons stay textual
+        return db.func.strftime('%Y-%m-%d %H:%M:%f000', column, f'{days:+d} days')
+    return column + timedelta(days=days)
+
+def bulk_key_operation(operation, days=0, dry_run=False, **filters):
+    """Apply operation to every key matching filters; returns the affected (or, dry run, matching) count."""
+    if operation not in KEY_BULK_OPERATIONS:
+        raise ValueError(f"unknown bulk operation {operation!r}")
+    if operation == 'extend' and not days:
+        raise ValueError("extend needs a non-zero number of days")
+    now = datetime.utcnow()
+    conditions = key_bulk_conditions(operation, now, **filters)
+    if dry_run:
+        return db.session.query(db.func.count(Key.id)).filter(*conditions).scalar()
+    query = Key.query.filter(*conditions)
+    if operation == 'extend':
+        affected = query.update({Key.expires_at: shift_datetime(Key.expires_at, days)}, synchronize_session=False)
+    elif operation == 'revoke':
+        affected = query.update({Key.expires_at: now}, synchronize_session=False)
+    elif operation == 'clear_hwid':
+        affected = query.update({Key.hwid: None}, synchronize_session=False)
+    else:
+        affected = query.delete(synchronize_session=False)
+    if affected:
+        publish_invalidation('key')
+    db.session.commit()
+    return affected
+
+def _parse_day(value):
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+@app.route('/keys/bulk', methods=['POST'])
+def bulk_keys():
+    """Run one bulk key operation from the Key Manager form."""
+    operation = request.form.get('operation', '')
+    dry_run = request.form.get('dry_run') == '1'
+    try:
+        affected = bulk_key_operation(
+            operation,
+            days=int(request.form.get('days') or 0),
+            dry_run=dry_run,
+            prefix=request.form.get('prefix') or None,
+            created_from=_parse_day(request.form.get('created_from')),
+            created_to=_parse_day(request.form.get('created_to')),
+            state=request.form.get('state', 'active'),
+        )
+    except ValueError as e:
+        flash(f"Bulk operation rejected: {e}", "danger")
+        return redirect(url_for('keys_page'))
+    if dry_run:
+        flash(f"Dry run: {operation} would affect {affected} keys.", "info")
+    else:
+        flash(f"{operation}: {affected} keys affected.", "success")
+    return redirect(url_for('keys_page'))
+
+# Bots and reseller dashboards re-check whole key lists. One call resolves up
+# to KEY_VERIFY_MAX keys with a handful of set-based IN queries (only the
+# three columns needed) instead of one loader round trip per key.
+KEY_VERIFY_MAX = 5000
+KEY_VERIFY_CHUNK = 1000  # bound parameters per IN query
+METRIC_HELP['eaglehub_key_verifications_total'] = ('counter', 'Keys checked through /api/keys/verify, by status.')
+
+def verify_keys(items, now=None):
+    """[(key, hwid or None)] -> [(key, status, expires_at)], status valid/expired/hwid_mismatch/unknown.
+
+    A HWID is only compared when one is supplied and the key is bound; an
+    unbound key is valid for any HWID, as in the loader.
+    """
+    now = now or datetime.utcnow()
+    wanted = list(dict.fromkeys(key for key, _ in items))
+    found = {}
+    for start in range(0, len(wanted), KEY_VERIFY_CHUNK):
+        chunk = wanted[start:start + KEY_VERIFY_CHUNK]
+        for value, hwid, expires_at in db.session.query(Key.value, Key.hwid, Key.expires_at).filter(Key.value.in_(chunk)):
+            found[value] = (hwid, expires_at)
+    results = []
+    for key, hwid in items:
+        if key not in found:
+            results.append((key, 'unknown', None))
+            continue
+        bound_hwid, expires_at = found[key]
+        if expires_at and now > expires_at:
+            status = 'expired'
+        elif hwid and bound_hwid and hwid != bound_hwid:
+            status = 'hwid_mismatch'
+        else:
+            status = 'valid'
+        results.append((key, status, expires_at))
+    return results
+
+@app.route('/api/keys/verify', methods=['POST'])
+@admin_token_required
+def verify_keys_api():
+    """Verify a batch of keys.
+
+    Body: {"keys": ["KEY", {"key": "KEY", "hwid": "HWID"}, ...]}. Results keep
+    the request order: {"results": [{"key", "status", "expires_at"}], "counts"}.
+    """
+    body = request.get_json(silent=True)
+    entries = body.get('keys') if isinstance(body, dict) else None
+    if not isinstance(entries, list):
+        return jsonify(error='expected a JSON object with a "keys" list'), 400
+    if len(entries) > KEY_VERIFY_MAX:
+        return jsonify(error=f"at most {KEY_VERIFY_MAX} keys per request"), 413
+    items = []
+    for entry in entries:
+        if isinstance(entry, str):
+            items.append((entry, None))
+        elif isinstance(entry, dict) and isinstance(entry.get('key'), str):
+            hwid = entry.get('hwid')
+            items.append((entry['key'], hwid if isinstance(hwid, str) and hwid else None))
+        else:
+            return jsonify(error='each entry must be a key string or {"key": ..., "hwid": ...}'), 400
+    results = verify_keys(items)
+    counts = {}
+    for _, status, _ in results:
+        counts[status] = counts.get(status, 0) + 1
+    for status, n in counts.items():
+        metrics.inc('eaglehub_key_verifications_total', n, status=status)
+    return jsonify(
+        results=[{'key': key, 'status': status, 'expires_at': expires_at.isoformat() + 'Z' if expires_at else None}
+                 for key, status, expires_at in results],
+        counts=counts,
     )
 
 @app.route('/keys/<int:key_id>/delete')
@@ -674,27 +2541,592 @@ def delete_key(key_id):
     """Delete a key."""
     key = Key.query.get_or_404(key_id)
     db.session.delete(key)
+    publish_invalidation('key', key.value)
     db.session.commit()
     flash("Key deleted!", "warning")
     return redirect(url_for('keys_page'))
 
+###################################################
+# KEY USAGE ANALYTICS
+###################################################
+# Distinct IPs and HWIDs per key per day, the main key-sharing signal. Each
+# loader hit updates in-memory HyperLogLog sketches; a per-process thread
+# merges them into one key_usage_day row per (key, day) every
+# KEY_USAGE_FLUSH_INTERVAL seconds, or sooner once the pending registers
+# reach KEY_USAGE_PENDING_BYTES (every pending key-day holds two dense
+# 1 KiB sketches). If flushes keep failing, hits for new key-days are
+# dropped once pending reaches twice that budget. Registers are stored
+# zlib-compressed: a key seen from a handful of addresses costs a few dozen
+# bytes, a saturated sketch about 1 KiB.
+HLL_PRECISION = 10  # 2**10 registers, ~3.3% standard error
+HLL_REGISTERS = 1 << HLL_PRECISION
+KEY_USAGE_FLUSH_INTERVAL = float(os.environ.get('KEY_USAGE_FLUSH_INTERVAL', '30'))
+KEY_USAGE_PENDING_BYTES = int(os.environ.get('KEY_USAGE_PENDING_BYTES', 4 << 20))
+KEY_USAGE_MAX_PENDING = max(1, KEY_USAGE_PENDING_BYTES // (2 * HLL_REGISTERS))  # key-days
+KEY_USAGE_RETENTION_DAYS = int(os.environ.get('KEY_USAGE_RETENTION_DAYS', '90'))
+KEY_USAGE_SHOWN_DAYS = 14
+
+METRIC_HELP['eaglehub_key_usage_flushed_total'] = ('counter', 'Key-day usage sketches written, by result.')
+METRIC_HELP['eaglehub_key_usage_dropped_total'] = ('counter', 'Loader hits not recorded because pending sketches were over budget.')
+
+class HyperLogLog:
+    """Cardinality sketch over HLL_REGISTERS one-byte registers. Merging is a register-wise max."""
+
+    __slots__ = ('registers',)
+
+    def __init__(self, data=None):
+        self.registers = bytearray(zlib.decompress(data)) if data else bytearray(HLL_REGISTERS)
+
+    def add(self, value):
+        h = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+        index = h >> (64 - HLL_PRECISION)
+        rest = h & ((1 << (64 - HLL_PRECISION)) - 1)
+        rank = 64 - HLL_PRECISION - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = HLL_REGISTERS
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # linear counting for small sets
+        return round(estimate)
+
+    def to_bytes(self):
+        return zlib.compress(bytes(self.registers), 9)
+
+class KeyUsageDay(db.Model):
+    __tablename__ = "key_usage_day"
+    __table_args__ = (db.UniqueConstraint('key_id', 'day'),)
+    id = db.Column(db.Integer, primary_key=True)
+    key_id = db.Column(db.Integer, nullable=False)
+    day = db.Column(db.Date, nullable=False, index=True)
+    ip_sketch = db.Column(db.LargeBinary, nullable=False)
+    hwid_sketch = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class KeyUsageTracker:
+    """Per-process pending sketches, keyed by (key_id, day) -> [ip sketch, hwid sketch]."""
+
+    def __init__(self):
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self.pending = {}
+
+    def record(self, key_id, ip, hwid):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self.pending = {}  # a forked child must not re-flush its parent's sketches
+                    threading.Thread(target=self._run, name='key-usage', daemon=True).start()
+        slot = (key_id, datetime.utcnow().date())
+        with self._lock:
+            sketches = self.pending.get(slot)
+            if sketches is None:
+                if len(self.pending) >= 2 * KEY_USAGE_MAX_PENDING:
+                    self._wake.set()
+                    metrics.inc('eaglehub_key_usage_dropped_total')
+                    return
+                sketches = self.pending[slot] = [HyperLogLog(), HyperLogLog()]
+            if ip:
+                sketches[0].add(ip)
+            if hwid:
+                sketches[1].add(hwid)
+            if len(self.pending) >= KEY_USAGE_MAX_PENDING:
+                self._wake.set()
+
+    def peek(self, key_id):
+        """Copies of this process's unflushed sketches for key_id, by day."""
+        with self._lock:
+            return {day: [HyperLogLog().merge(ips), HyperLogLog().merge(hwids)]
+                    for (kid, day), (ips, hwids) in self.pending.items() if kid == key_id}
+
+    def _run(self):
+        while True:
+            self._wake.wait(KEY_USAGE_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception as e:
+                print(f"[KEY USAGE] flush failed: {e}")
+
+    def flush(self):
+        """Merge pending sketches into key_usage_day. On failure they go back to pending for the next try."""
+        with self._lock:
+            batch, self.pending = self.pending, {}
+        if not batch:
+            return 0
+        try:
+            for attempt in range(3):
+                try:
+                    _merge_key_usage(batch)
+                    break
+                except (IntegrityError, OperationalError):
+                    # another worker inserted the same key-day first, or the DB was busy
+                    if attempt == 2:
+                        raise
+        except Exception:
+            metrics.inc('eaglehub_key_usage_flushed_total', len(batch), result='retry')
+            with self._lock:
+                for slot, sketches in batch.items():
+                    mine = self.pending.setdefault(slot, [HyperLogLog(), HyperLogLog()])
+                    mine[0].merge(sketches[0])
+                    mine[1].merge(sketches[1])
+            raise
+        metrics.inc('eaglehub_key_usage_flushed_total', len(batch), result='ok')
+        return len(batch)
+
+def _merge_key_usage(batch):
+    table = KeyUsageDay.__table__
+    now = datetime.utcnow()
+    by_day = {}
+    for key_id, day in batch:
+        by_day.setdefault(day, []).append(key_id)
+    with db.engine.begin() as conn:
+        for day, key_ids in by_day.items():
+            for start in range(0, len(key_ids), KEY_VERIFY_CHUNK):
+                chunk = key_ids[start:start + KEY_VERIFY_CHUNK]
+                where = db.and_(table.c.day == day, table.c.key_id.in_(chunk))
+                # Write first: the UPDATE takes SQLite's write lock (row locks on
+                # PostgreSQL), so no other worker can merge these rows between
+                # our read and our write.
+                conn.execute(table.update().where(where).values(updated_at=now))
+                stored = {row.key_id: row for row in conn.execute(
+                    db.select(table.c.id, table.c.key_id, table.c.ip_sketch, table.c.hwid_sketch).where(where))}
+                updates, inserts = [], []
+                for key_id in chunk:
+                    ips, hwids = batch[(key_id, day)]
+                    row = stored.get(key_id)
+                    if row:
+                        ips = HyperLogLog(row.ip_sketch).merge(ips)
+                        hwids = HyperLogLog(row.hwid_sketch).merge(hwids)
+                        updates.append({'row_id': row.id, 'ip_sketch': ips.to_bytes(), 'hwid_sketch': hwids.to_bytes()})
+                    else:
+                        inserts.append({'key_id': key_id, 'day': day, 'ip_sketch': ips.to_bytes(),
+                                        'hwid_sketch': hwids.to_bytes(), 'updated_at': now})
+                if updates:
+                    conn.execute(table.update().where(table.c.id == db.bindparam('row_id')).values(
+                        ip_sketch=db.bindparam('ip_sketch'), hwid_sketch=db.bindparam('hwid_sketch')), updates)
+                if inserts:
+                    conn.execute(table.insert(), inserts)
+        conn.execute(table.delete().where(table.c.day < now.date() - timedelta(days=KEY_USAGE_RETENTION_DAYS)))
+
+key_usage = KeyUsageTracker()
+
+def key_usage_summary(key_id, days=KEY_USAGE_SHOWN_DAYS):
+    """[(day, distinct IPs, distinct HWIDs)], newest first, including this worker's unflushed hits."""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    merged = {day: sketches for day, sketches in key_usage.peek(key_id).items() if day >= since}
+    rows = db.session.query(KeyUsageDay.day, KeyUsageDay.ip_sketch, KeyUsageDay.hwid_sketch).filter(
+        KeyUsageDay.key_id == key_id, KeyUsageDay.day >= since)
+    for day, ip_sketch, hwid_sketch in rows:
+        ips, hwids = merged.setdefault(day, [HyperLogLog(), HyperLogLog()])
+        ips.merge(HyperLogLog(ip_sketch))
+        hwids.merge(HyperLogLog(hwid_sketch))
+    return [(day, ips.count(), hwids.count()) for day, (ips, hwids) in sorted(merged.items(), reverse=True)]
+
+###################################################
+# PAYLOAD STORE
+###################################################
+# Published loader payloads are written once to PAYLOAD_DIR as immutable
+# files named by their sha256, and the script rows only keep that digest in
+# build_hash. Loaders answer with send_file(), which goes through
+# wsgi.file_wrapper (sendfile under gunicorn), so every worker shares the OS
+# page cache instead of holding its own copy of multi-MB strings. Builds are
+# deterministic, so a node that lacks a file rebuilds the same digest from
+# the DB row on first use.
+#
+# Uploads go through the same store: the request body is copied to a blob
+# in STREAM_BLOCK_SIZE pieces, compiled and encoded as generators, and the
+# build is streamed back into the store, so worker memory stays bounded by
+# the block size rather than the script size. Source and bytecode up to
+# INLINE_CONTENT_LIMIT are also kept in the DB row; anything larger only
+# lives in the store (source_hash / bytecode_hash), so nodes serving such
+# builds need a shared PAYLOAD_DIR.
+PAYLOAD_DIR = os.environ.get('PAYLOAD_DIR') or os.path.join(app.instance_path, 'payloads')
+STREAM_BLOCK_SIZE = 1 << 20
+INLINE_CONTENT_LIMIT = int(os.environ.get('INLINE_CONTENT_LIMIT', 1 << 20))
+
+def iter_blocks(fileobj, block_size=STREAM_BLOCK_SIZE):
+    while True:
+        block = fileobj.read(block_size)
+        if not block:
+            return
+        yield block
+
+class PayloadStore:
+    """Content-addressed directory of immutable payload files."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def has(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def size(self, digest):
+        return os.path.getsize(self.path(digest))
+
+    def iter_file(self, digest, block_size=STREAM_BLOCK_SIZE):
+        with open(self.path(digest), 'rb') as f:
+            yield from iter_blocks(f, block_size)
+
+    def read(self, digest):
+        with open(self.path(digest), 'rb') as f:
+            return f.read()
+
+    def read_inline(self, digest):
+        """The blob as text if it fits INLINE_CONTENT_LIMIT, else ''."""
+        if self.size(digest) > INLINE_CONTENT_LIMIT:
+            return ''
+        with open(self.path(digest), 'rb') as f:
+            return f.read().decode('utf-8', errors='replace')
+
+    def write_chunks(self, chunks):
+        """Stream byte chunks into the store and return their sha256 hex digest."""
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.incoming-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            final_path = self.path(digest.hexdigest())
+            if os.path.exists(final_path):
+                # identical bytes already published; keep the cached inode
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(tmp_path, final_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return digest.hexdigest()
+
+payload_store = PayloadStore(PAYLOAD_DIR)
+
+def ingest_upload(field='code'):
+    """Copy the uploaded script into the store and return its digest (None if nothing was sent).
+
+    Accepts a multipart file in `field` (werkzeug spools it to disk), a raw
+    text/plain or octet-stream body (chunked transfer works), or the plain
+    form textarea for small pastes.
+    """
+    if request.mimetype in ('text/plain', 'application/octet-stream'):
+        return payload_store.write_chunks(iter_blocks(request.stream))
+    upload = request.files.get(field)
+    if upload and upload.filename:
+        return payload_store.write_chunks(iter_blocks(upload.stream))
+    code = request.form.get(field)
+    if code is None:
+        return None
+    return payload_store.write_chunks([code.encode()])
+
+def stored_content(inline, digest):
+    """(byte chunks, sha256 hex) of content kept inline in a row or as a store blob."""
+    if inline or not digest:
+        data = (inline or '').encode()
+        return [data], hashlib.sha256(data).hexdigest()
+    if not payload_store.has(digest):
+        return None, None
+    return payload_store.iter_file(digest), digest
+
+def build_illusions(seed):
+    """Decoy strings for the payload, derived from the content's sha256 so rebuilds are byte-identical."""
+    digest = bytes.fromhex(seed)
+    return (base64.urlsafe_b64encode(digest[:8]).decode().rstrip('='),
+            base64.urlsafe_b64encode(digest[8:16]).decode().rstrip('='))
+
+def iter_b64(chunks):
+    """base64 of the concatenated byte chunks, emitted incrementally (input cut on 3-byte boundaries)."""
+    carry = b''
+    for chunk in chunks:
+        data = carry + chunk
+        cut = len(data) - len(data) % 3
+        if cut:
+            yield base64.b64encode(data[:cut])
+        carry = data[cut:]
+    if carry:
+        yield base64.b64encode(carry)
+
+def render_build(template, chunks, seed):
+    """Stream template with {step3} filled by the triple base64 of chunks."""
+    illusionsA, illusionsB = build_illusions(seed)
+    head, tail = template.split('{step3}')
+    yield head.format(illusionsA=illusionsA, illusionsB=illusionsB).encode()
+    yield from iter_b64(iter_b64(iter_b64(chunks)))
+    yield tail.format(illusionsA=illusionsA, illusionsB=illusionsB).encode()
+
+def build_payload(obj):
+    """Write obj's loader payload to the store and point obj.build_hash at it (caller commits)."""
+    if isinstance(obj, VirtualScript):
+        chunks, seed = stored_content(obj.bytecode, obj.bytecode_hash)
+        render = render_vm_build
+    elif isinstance(obj, MainScript):
+        chunks, seed = stored_content(obj.code, obj.source_hash)
+        render = render_single_build
+    elif obj.code is None:
+        return None
+    else:
+        chunks, seed = stored_content(obj.code, None)
+        render = render_single_build
+    if chunks is None:
+        # only the blob knew the content and it is not on this node
+        return None
+    obj.build_hash = payload_store.write_chunks(render(chunks, seed))
+    return obj.build_hash
+
+def ensure_build(model, row_id, digest):
+    """Return a digest whose file exists on this node, rebuilding it from the row if needed."""
+    if digest and payload_store.has(digest):
+        return digest
+    obj = db.session.get(model, row_id)
+    digest = build_payload(obj)
+    if digest:
+        publish_invalidation('build')
+        db.session.commit()
+    return digest
+
+def payload_response(digest):
+    # conditional=True answers Range/If-Range with 206 from the immutable file;
+    # the digest ETag keeps resumed ranges from splicing two different builds
+    return send_file(payload_store.path(digest), mimetype='text/plain', etag=digest, conditional=True)
+
+# A build's digest is its ETag and changes with every publish. Clients that
+# kept the last payload send it back as If-None-Match or ?have=<digest>; once
+# every access check has passed they get a few bytes instead of the script.
+def client_has_build(digest):
+    return request.args.get('have') == digest or request.if_none_match.contains(digest)
+
+def unchanged_response(digest):
+    if request.if_none_match.contains(digest):
+        response = Response(status=304)
+    else:
+        # executors that cannot see status codes look for this line instead
+        response = Response(f'-- unchanged {digest}\n', mimetype='text/plain')
+    response.set_etag(digest)
+    return response
+
+###################################################
+# ROUTE FILTER
+###################################################
+# Scanners hit the catch-all loader routes with thousands of made-up paths.
+# A counting Bloom filter over each route table's names answers "definitely
+# not a route" without touching the DB. The counters live in an mmap'd file
+# so every worker on the host shares them: names are added after a route is
+# committed and removed when a route is purged, with writers
+# serialised by flock. The file is per host and a route created on another
+# host would look absent, so the filter is opt-in: set ROUTE_FILTER=1 only
+# on a single app host (or when a client's create and fetch always land on
+# the same host). A new or half-built file is rebuilt from the route tables.
+ROUTE_FILTER_ENABLED = os.environ.get('ROUTE_FILTER', '0') == '1'
+ROUTE_FILTER_DIR = os.environ.get('ROUTE_FILTER_DIR') or app.instance_path
+ROUTE_FILTER_COUNTERS = 1 << 20  # ~0.1% false positives at 50k live routes
+ROUTE_FILTER_HASHES = 4
+ROUTE_PURGE_AFTER = 3600  # seconds; longer than any expires_in handed out
+_ROUTE_FILTER_MAGIC = b'RTBLOOM1'
+
+METRIC_HELP['eaglehub_route_filter_checks_total'] = ('counter', 'Route filter answers by loader: absent, present, or false_positive.')
+METRIC_HELP['eaglehub_route_filter_false_positive_ratio'] = ('gauge', 'False positives / unknown routes per loader, derived at scrape time.')
+
+class RouteFilter:
+    """Counting Bloom filter over one route table's names, shared by the host's workers."""
+
+    def __init__(self, name, model):
+        self.name = name
+        self.model = model
+        self.path = os.path.join(ROUTE_FILTER_DIR, f'routes-{name}.bloom')
+        self._pid = None
+        self._file = None
+        self._map = None
+
+    def _positions(self, route_name):
+        digest = hashlib.blake2b(route_name.encode(), digest_size=4 * ROUTE_FILTER_HASHES).digest()
+        return [len(_ROUTE_FILTER_MAGIC) + int.from_bytes(digest[i:i + 4], 'little') % ROUTE_FILTER_COUNTERS
+                for i in range(0, len(digest), 4)]
+
+    def _open(self):
+        # per process: a forked worker maps the file again rather than share the parent's handle
+        if self._pid == os.getpid():
+            return self._map
+        os.makedirs(ROUTE_FILTER_DIR, exist_ok=True)
+        f = open(self.path, 'a+b')
+        size = len(_ROUTE_FILTER_MAGIC) + ROUTE_FILTER_COUNTERS
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            if os.fstat(f.fileno()).st_size != size:
+                f.truncate(0)
+                f.truncate(size)
+            mapped = mmap.mmap(f.fileno(), size)
+            if mapped[:len(_ROUTE_FILTER_MAGIC)] != _ROUTE_FILTER_MAGIC:
+                # new (or half-built) file: load every route, then mark it ready
+                mapped[:] = bytes(size)
+                for (route_name,) in db.session.query(self.model.route_name).yield_per(1000):
+                    self._bump(mapped, route_name, 1)
+                mapped[:len(_ROUTE_FILTER_MAGIC)] = _ROUTE_FILTER_MAGIC
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+        self._pid, self._file, self._map = os.getpid(), f, mapped
+        return mapped
+
+    def _bump(self, mapped, route_name, step):
+        for pos in self._positions(route_name):
+            count = mapped[pos]
+            # a saturated counter is never decremented again
+            if count < 255 and count + step >= 0:
+                mapped[pos] = count + step
+
+    def _update(self, route_names, step):
+        if not ROUTE_FILTER_ENABLED or not route_names:
+            return
+        mapped = self._open()
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            for route_name in route_names:
+                self._bump(mapped, route_name, step)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def add(self, *route_names):
+        """Call after the route rows are committed."""
+        self._update(route_names, 1)
+
+    def remove(self, *route_names):
+        """Call only for rows this request actually deleted, so each name is removed once."""
+        self._update(route_names, -1)
+
+    def warm(self):
+        """Map (and on a new host, fill) the filter now rather than inside the first request."""
+        if ROUTE_FILTER_ENABLED:
+            self._open()
+
+    def might_contain(self, route_name):
+        if not ROUTE_FILTER_ENABLED:
+            return True
+        mapped = self._open()
+        return all(mapped[pos] for pos in self._positions(route_name))
+
+def new_route_name():
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=8))
+
+ROUTE_NAME_PATTERN = re.compile(r'[A-Za-z0-9]{8}')  # what new_route_name() hands out
+
+def might_be_route(route_filter, route_name):
+    """False when route_name certainly is no live route (wrong shape or absent from the filter); no SQL."""
+    return bool(ROUTE_NAME_PATTERN.fullmatch(route_name)) and route_filter.might_contain(route_name)
+
+def check_route_filter(route_filter, loader, route_name):
+    """False when the route certainly does not exist; counts the filter's answer."""
+    if not ROUTE_NAME_PATTERN.fullmatch(route_name):
+        return False
+    if route_filter.might_contain(route_name):
+        return True
+    count_route_filter_check(loader, 'absent')
+    return False
+
+def count_route_filter_check(loader, result):
+    """Count how a route the filter let through turned out; nothing to count while it is off."""
+    if ROUTE_FILTER_ENABLED:
+        metrics.inc('eaglehub_route_filter_checks_total', loader=loader, result=result)
+
+def route_consumer():
+    """Who is fetching: only the same key from the same address may resume a consumed route."""
+    return hashlib.sha256(f"{request.args.get('key', '')}|{request.remote_addr}".encode()).hexdigest()
+
+def consume_route(model, route_name, token, consumer, *columns, resumable=False):
+    """Check a route's token and expiry and, if it is single-use, mark it consumed in the same statement.
+
+    Returns (row, state): row carries id plus the extra columns; state is
+    'consumed', 'reusable' (multi-use route), 'resumed', or a failure:
+    'not_found', 'used_up' (an existing route already consumed), 'expired',
+    'invalid_token'. Consumed routes stay until
+    purge_expired_routes() so that, within the TTL, the consumer can resume
+    an interrupted download (resumable=True, i.e. a Range request) without
+    it counting as another use. Only when the UPDATE matches nothing does a
+    follow-up SELECT work out why.
+    """
+    now = datetime.utcnow()
+    row = db.session.execute(
+        db.update(model).where(
+            model.route_name == route_name, model.token == token, model.single_use.is_(True),
+            model.consumed_at.is_(None), model.expires_at > now
+        ).values(consumed_at=now, consumed_by=consumer).returning(model.id, *columns)
+    ).first()
+    if row:
+        return row, 'consumed'
+    row = db.session.query(model.id, model.token, model.expires_at, model.single_use,
+                           model.consumed_at, model.consumed_by, *columns) \
+        .filter_by(route_name=route_name).first()
+    if not row:
+        return None, 'not_found'
+    if row.expires_at is None or row.expires_at <= now:
+        return None, 'expired'
+    if row.token != token:
+        return None, 'invalid_token'
+    if not row.single_use:
+        return row, 'reusable'
+    if resumable and row.consumed_by == consumer:
+        return row, 'resumed'
+    # used up (possibly by a concurrent request a moment ago)
+    return None, 'used_up'
+
+def purge_expired_routes():
+    """Delete routes older than ROUTE_PURGE_AFTER and drop their names from the filters.
+
+    Consumed single-use routes are only removed here, once they can no longer be resumed.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=ROUTE_PURGE_AFTER)
+    purged = 0
+    for route_filter in (single_route_filter, vm_route_filter):
+        model = route_filter.model
+        # RETURNING hands each name to exactly one worker even when several purge at once
+        names = db.session.execute(
+            db.delete(model).where(model.created_at < cutoff).returning(model.route_name)
+        ).scalars().all()
+        db.session.commit()
+        route_filter.remove(*names)
+        purged += len(names)
+    return purged
+
 ###################################################
 # SINGLE-CHUNK LOADER
 ###################################################
 class MainScript(db.Model):
     __tablename__ = "main_script_single"
     id = db.Column(db.Integer, primary_key=True)
-    code = db.Column(db.Text, nullable=False)
+    code = db.Column(db.Text, nullable=False)  # '' when only the source blob holds it
     updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    build_hash = db.Column(db.String(64), nullable=True)
+    source_hash = db.Column(db.String(64), nullable=True)
 
 class EphemeralRoute(db.Model):
     __tablename__ = "ephemeral_route_single"
     id = db.Column(db.Integer, primary_key=True)
     route_name = db.Column(db.String(50), unique=True, nullable=False)
     token = db.Column(db.String(64), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     expires_in = db.Column(db.Integer, default=120)
     single_use = db.Column(db.Boolean, default=True)
+    script_id = db.Column(db.Integer, nullable=True)  # None serves MainScript
+    expires_at = db.Column(db.DateTime, nullable=True)  # created_at + expires_in
+    consumed_at = db.Column(db.DateTime, nullable=True)
+    consumed_by = db.Column(db.String(64), nullable=True)  # route_consumer() of the first fetch
+
+single_route_filter = RouteFilter('single', EphemeralRoute)
 
 def environment_check():
     suspicious_names = ["hookfunction", "debug.setupvalue", "hookmetamethod"]
@@ -703,62 +3135,296 @@ def environment_check():
             return True
     return False
 
+def _banned_until(ip):
+    expiries = [e for (e,) in db.session.query(BlockedIP.expires_at).filter(
+        BlockedIP.ip_address == ip,
+        db.or_(BlockedIP.expires_at.is_(None), BlockedIP.expires_at > datetime.utcnow())
+    )]
+    if not expiries:
+        return None
+    return datetime.max if None in expiries else max(expiries)
+
+_CIDR_BANS = ('cidr',)  # ban_cache key of the CIDR table; never collides with an address
+
+def _active_cidr_bans():
+    """{(ip version, prefix length): {network as int: banned until}} over every active CIDR ban."""
+    networks = {}
+    for address, expires_at in db.session.query(BlockedIP.ip_address, BlockedIP.expires_at).filter(
+        BlockedIP.ip_address.contains('/'),
+        db.or_(BlockedIP.expires_at.is_(None), BlockedIP.expires_at > datetime.utcnow())
+    ):
+        try:
+            network = ipaddress.ip_network(address, strict=False)
+        except ValueError:
+            continue
+        until = datetime.max if expires_at is None else expires_at
+        by_network = networks.setdefault((network.version, network.prefixlen), {})
+        key = int(network.network_address)
+        by_network[key] = max(by_network.get(key, until), until)
+    return networks
+
+def _cidr_banned_until(ip):
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    networks = ban_cache.get_or_set(_CIDR_BANS, _active_cidr_bans)
+    value, bits = int(address), address.max_prefixlen
+    # one dict probe per distinct prefix length in use, however many ranges are banned
+    matches = [by_network.get(value >> (bits - prefix) << (bits - prefix))
+               for (version, prefix), by_network in networks.items() if version == address.version]
+    return max(filter(None, matches), default=None)
+
 def is_banned(ip, hwid=None):
-    b = BlockedIP.query.filter_by(ip_address=ip).first()
-    if b:
+    """True while ip is banned by an exact BlockedIP row or falls inside a banned CIDR range."""
+    now = datetime.utcnow()
+    until = ban_cache.get_or_set(ip, lambda: _banned_until(ip))
+    if until is not None and until > now:
         return True
-    return False
+    until = _cidr_banned_until(ip)
+    return until is not None and until > now
+
+def lookup_key(value):
+    """(id, hwid, expires_at) of the key with this value, or None."""
+    return key_cache.get_or_set(value, lambda: db.session.query(Key.id, Key.hwid, Key.expires_at)
+                                .filter_by(value=value).first())
+
+def kill_switch_active():
+    return kill_switch_cache.get_or_set('active', lambda: bool(
+        db.session.query(KillSwitch.active).order_by(KillSwitch.id).limit(1).scalar()))
+
+def build_pointer(kind, script_id=None):
+    """(model, row id, build hash, project id) of what a loader serves, or None."""
+    def load():
+        if script_id:
+            row = db.session.query(Script.id, Script.build_hash, Script.project_id).filter_by(id=script_id).first()
+            return (Script, row.id, row.build_hash, row.project_id) if row else None
+        model = MainScript if kind == 'single' else VirtualScript
+        row = db.session.query(model.id, model.build_hash).order_by(model.id).first()
+        return (model, row.id, row.build_hash, None) if row else None
+    return build_cache.get_or_set((kind, script_id), load)
+
+# Suspicious loader events are counted per IP and per key with Space-Saving
+# summaries (at most ABUSE_CAPACITY entries each) over a sliding window made
+# of ABUSE_WINDOW_SLICES sub-windows. Counts are per worker. An IP whose
+# guaranteed count (estimate minus overcount bound) reaches
+# ABUSE_IP_THRESHOLD gets an expiring BlockedIP row through the write queue,
+# so the request that trips it issues no extra SQL. Auto-ban is opt-in
+# (ABUSE_AUTOBAN=1): behind a proxy set TRUSTED_PROXY_HOPS first, or the
+# first heavy hitter bans the proxy and with it every client.
+ABUSE_WINDOW_SECONDS = int(os.environ.get('ABUSE_WINDOW_SECONDS', '300'))
+ABUSE_WINDOW_SLICES = 5
+ABUSE_CAPACITY = 256
+ABUSE_IP_THRESHOLD = int(os.environ.get('ABUSE_IP_THRESHOLD', '60'))
+ABUSE_KEY_THRESHOLD = int(os.environ.get('ABUSE_KEY_THRESHOLD', '100'))  # flagged in the view only
+ABUSE_BAN_SECONDS = int(os.environ.get('ABUSE_BAN_SECONDS', '3600'))
+ABUSE_AUTOBAN = os.environ.get('ABUSE_AUTOBAN', '0') == '1'
+ABUSE_IGNORE_IPS = set(filter(None, os.environ.get('ABUSE_IGNORE_IPS', '127.0.0.1,::1').split(',')))
+ABUSE_TOP_SHOWN = 25
+
+METRIC_HELP['eaglehub_abuse_autobans_total'] = ('counter', 'IPs blocked automatically by the heavy-hitter tracker.')
+
+class SpaceSaving:
+    """Top-k counter in bounded memory: a new item evicts the smallest and inherits its count as error."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}  # item -> [count, error]
+
+    def add(self, item):
+        entry = self.counts.get(item)
+        if entry:
+            entry[0] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = [1, 0]
+        else:
+            victim = min(self.counts, key=lambda k: self.counts[k][0])
+            floor = self.counts.pop(victim)[0]
+            self.counts[item] = [floor + 1, floor]
+
+class SlidingHeavyHitters:
+    """Space-Saving summaries for the last `window` seconds, one per slice; caller locks."""
+
+    def __init__(self, window, slices, capacity):
+        self.slice_seconds = window / slices
+        self.slices = slices
+        self.capacity = capacity
+        self.ring = deque()  # (slice number, SpaceSaving), oldest first
+
+    def _current(self, now):
+        number = int(now // self.slice_seconds)
+        while self.ring and self.ring[0][0] <= number - self.slices:
+            self.ring.popleft()
+        if not self.ring or self.ring[-1][0] != number:
+            self.ring.append((number, SpaceSaving(self.capacity)))
+        return self.ring[-1][1]
+
+    def add(self, item, now):
+        self._current(now).add(item)
+
+    def _floors(self):
+        # an item missing from a full summary may still have had up to its minimum count
+        return [min(c for c, _ in summary.counts.values()) if len(summary.counts) >= summary.capacity else 0
+                for _, summary in self.ring]
+
+    def estimate(self, item, now, floors=None):
+        """(count, overcount bound) of item over the window."""
+        self._current(now)
+        count = error = 0
+        for (_, summary), floor in zip(self.ring, floors or self._floors()):
+            entry = summary.counts.get(item)
+            if entry:
+                count, error = count + entry[0], error + entry[1]
+            else:
+                count, error = count + floor, error + floor
+        return count, error
+
+    def top(self, n, now):
+        self._current(now)
+        floors = self._floors()
+        candidates = {item for _, summary in self.ring for item in summary.counts}
+        ranked = sorted(((item, *self.estimate(item, now, floors)) for item in candidates), key=lambda r: -r[1])
+        return ranked[:n]
+
+class AbuseTracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ips = SlidingHeavyHitters(ABUSE_WINDOW_SECONDS, ABUSE_WINDOW_SLICES, ABUSE_CAPACITY)
+        self.keys = SlidingHeavyHitters(ABUSE_WINDOW_SECONDS, ABUSE_WINDOW_SLICES, ABUSE_CAPACITY)
+        self.banned = {}  # ip -> ban expiry, so one worker bans an IP once
+
+    def observe(self, ip, key=None):
+        now = time.time()
+        with self.lock:
+            if key:
+                self.keys.add(key, now)
+            if not ip or ip in ABUSE_IGNORE_IPS:
+                return
+            self.ips.add(ip, now)
+            if not ABUSE_AUTOBAN or self.banned.get(ip, 0) > now:
+                return
+            count, error = self.ips.estimate(ip, now)
+            if count - error < ABUSE_IP_THRESHOLD:
+                return
+            self.banned = {banned_ip: until for banned_ip, until in self.banned.items() if until > now}
+            self.banned[ip] = now + ABUSE_BAN_SECONDS
+        created = datetime.utcnow()
+        write_queue.put(BlockedIP.__table__, {
+            'ip_address': ip,
+            'reason': f"auto: {count - error}+ suspicious loader requests in {ABUSE_WINDOW_SECONDS}s",
+            'created_at': created,
+            'expires_at': created + timedelta(seconds=ABUSE_BAN_SECONDS),
+        }, invalidates=('ban', ip))
+        metrics.inc('eaglehub_abuse_autobans_total')
+        print(f"[ABUSE] blocking {ip} for {ABUSE_BAN_SECONDS}s ({count - error}+ suspicious requests)")
+
+    def top(self, n):
+        now = time.time()
+        with self.lock:
+            return self.ips.top(n, now), self.keys.top(n, now)
+
+abuse_tracker = AbuseTracker()
+
+def log_usage(route_name, ip, suspicious=False, outcome=None, loader='single', key=None):
+    print(f"[LOADER USAGE] loader={loader}, route={route_name}, ip={ip}, suspicious={suspicious}, outcome={outcome}")
+    if outcome:
+        count_loader_outcome(loader, outcome)
+    if suspicious:
+        abuse_tracker.observe(ip, key)
+
+SINGLE_BUILD_TEMPLATE = """
+-- environment check in-lua
+if hookfunction or debug.setupvalue or hookmetamethod then
+    return print("Suspicious environment, aborting script.")
+end
+
+local step3 = "{step3}"
+local s2 = game:GetService("HttpService"):Base64Decode(step3)
+local s1 = game:GetService("HttpService"):Base64Decode(s2)
+local final = game:GetService("HttpService"):Base64Decode(s1)
+
+-- illusions
+local illusionsA = "{illusionsA}"
+local illusionsB = "{illusionsB}"
+
+loadstring(final)()
+"""
 
-def log_usage(route_name, ip, suspicious=False):
-    print(f"[LOADER USAGE] route={route_name}, ip={ip}, suspicious={suspicious}")
+def render_single_build(source_chunks, seed):
+    """Single-chunk payload: triple base64 of the source plus the in-lua environment check."""
+    return render_build(SINGLE_BUILD_TEMPLATE, source_chunks, seed)
 
 @app.route('/loader_admin', methods=['GET','POST'])
 def loader_admin():
     ms = MainScript.query.first()
     if request.method == 'POST':
-        code = request.form.get('code', '')
+        source_hash = ingest_upload()
+        if source_hash is None:
+            flash("No script uploaded.", "warning")
+            return redirect(url_for('loader_admin'))
+        code = payload_store.read_inline(source_hash)
         if ms:
             ms.code = code
             ms.updated_at = datetime.utcnow()
         else:
             ms = MainScript(code=code, updated_at=datetime.utcnow())
             db.session.add(ms)
+        ms.source_hash = source_hash
+        build_payload(ms)
+        record_script_version('single', source_hash, ms.build_hash)
+        publish_invalidation('build')
         db.session.commit()
         flash("Loader script updated!", "success")
         return redirect(url_for('loader_admin'))
 
     existing_code = ms.code if ms else ""
+    size_note = ""
+    if ms and not ms.code and ms.source_hash and payload_store.has(ms.source_hash):
+        size_note = f"<p>Current script is {payload_store.size(ms.source_hash)} bytes, too large to edit here; upload a file to replace it.</p>"
     page_content = f"""
 <h3>Single-Chunk Loader Admin</h3>
 <p>Manage the single script code. You can externally obfuscate if you want.</p>
-<form method="POST">
+{size_note}
+<form method="POST" enctype="multipart/form-data">
   <textarea name="code" rows="10" cols="60">{existing_code}</textarea>
   <br/>
+  <label>or upload a file</label> <input type="file" name="code"/>
+  <br/>
   <button type="submit" class="btn btn-success">Save Script</button>
 </form>
+<p><a href="{url_for('versions_page', kind='single')}">Version history</a></p>
 """
     return render_template_string(big_html, content=page_content)
 
 @app.route('/loader_create')
 def loader_create():
-    ms = MainScript.query.first()
-    if not ms:
+    # ?script_id=N serves that Script's published build instead of MainScript
+    script_id = request.args.get('script_id', type=int)
+    if script_id:
+        if not db.session.query(Script.id).filter(Script.id == script_id, Script.build_hash.isnot(None)).first():
+            return "Script not found or not published.", 404
+    elif not db.session.query(MainScript.id).first():
         return "No main script found. Add some in /loader_admin."
 
     if environment_check():
         return "Suspicious environment. Aborting ephemeral route creation.", 403
+    ensure_rollup_thread()  # purges the routes created here once they expire
 
-    route_name = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
+    route_name = new_route_name()
     token_str = secrets.token_hex(16)
+    now = datetime.utcnow()
     er = EphemeralRoute(
         route_name=route_name,
         token=token_str,
-        created_at=datetime.utcnow(),
+        created_at=now,
         expires_in=120,
-        single_use=True
+        expires_at=now + timedelta(seconds=120),
+        single_use=True,
+        script_id=script_id
     )
     db.session.add(er)
     db.session.commit()
+    single_route_filter.add(route_name)
 
     page_content = f"""
 <h3>Single-Chunk Ephemeral Loader Route Created</h3>
@@ -766,283 +3432,278 @@ def loader_create():
   <li>/{route_name}?key=YOUR_KEY&hwid=YOUR_HWID&token={token_str}</li>
 </ul>
 <p>Expires in 120 seconds, single-use. Call once with the correct key, hwid, and token.</p>
+<p>Add &amp;have=&lt;ETag of your last payload&gt; to get a short "-- unchanged" reply when the script has not changed.</p>
 """
     return render_template_string(big_html, content=page_content)
 
 @app.route('/<path:loader_route>')
 def loader_catch_all_single(loader_route):
-    er = EphemeralRoute.query.filter_by(route_name=loader_route).first()
-    if not er:
+    if not check_route_filter(single_route_filter, 'single', loader_route):
+        count_loader_outcome('single', 'not_found')
         return "404 Not Found", 404
-
     if environment_check():
-        log_usage(er.route_name, request.remote_addr, suspicious=True)
+        log_usage(loader_route, request.remote_addr, suspicious=True, outcome='suspicious_env')
         return "Suspicious environment. Aborting route usage.", 403
 
+    # Bans, keys and the kill switch come from caches, so they are checked
+    # first and a rejected request never touches the route. Only then is the
+    # route validated and consumed in one statement, committed at once so the
+    # write (a database-wide lock on SQLite) is not held while the rest of
+    # the request runs. Concurrent requests for one single-use route cannot
+    # both get the script. The consumer may come back with Range requests
+    # until the route expires to finish a download.
     user_hwid = request.args.get('hwid', '')
     if is_banned(request.remote_addr, user_hwid):
-        log_usage(er.route_name, request.remote_addr, suspicious=True)
+        log_usage(loader_route, request.remote_addr, suspicious=True, outcome='banned')
         return "You are banned from using this service.", 403
 
-    delta = (datetime.utcnow() - er.created_at).total_seconds()
-    if delta > er.expires_in:
-        log_usage(er.route_name, request.remote_addr, suspicious=True)
-        return "Ephemeral route expired", 403
-
-    user_token = request.args.get('token', '')
-    if user_token != er.token:
-        log_usage(er.route_name, request.remote_addr, suspicious=True)
-        return "Invalid token", 403
-
     user_key = request.args.get('key', '')
     if not user_key:
-        log_usage(er.route_name, request.remote_addr, suspicious=True)
+        log_usage(loader_route, request.remote_addr, suspicious=True, outcome='missing_key')
         return "Missing key param", 400
 
-    kobj = Key.query.filter_by(value=user_key).first()
+    kobj = lookup_key(user_key)
     if not kobj:
-        log_usage(er.route_name, request.remote_addr, suspicious=True)
+        log_usage(loader_route, request.remote_addr, suspicious=True, outcome='invalid_key', key=user_key)
         return "Invalid key", 403
     if kobj.expires_at and datetime.utcnow() > kobj.expires_at:
-        log_usage(er.route_name, request.remote_addr, suspicious=True)
+        log_usage(loader_route, request.remote_addr, suspicious=True, outcome='key_expired', key=user_key)
         return "Key expired", 403
 
-    ks = KillSwitch.query.first()
-    if ks and ks.active:
+    if kill_switch_active():
+        log_usage(loader_route, request.remote_addr, outcome='kill_switch')
         return "Kill Switch is active. Scripts disabled.", 403
 
-    ms = MainScript.query.first()
-    if not ms:
-        log_usage(er.route_name, request.remote_addr, suspicious=True)
+    route, state = consume_route(EphemeralRoute, loader_route, request.args.get('token', ''), route_consumer(),
+                                 EphemeralRoute.script_id, resumable=request.range is not None)
+    db.session.commit()
+    if state == 'not_found':
+        count_route_filter_check('single', 'false_positive')
+        count_loader_outcome('single', 'not_found')
+        return "404 Not Found", 404
+    count_route_filter_check('single', 'present')
+    if state == 'used_up':
+        # the route exists, so the filter was right; replays look like unknown routes
+        count_loader_outcome('single', 'used_up')
+        return "404 Not Found", 404
+    if state == 'expired':
+        log_usage(loader_route, request.remote_addr, suspicious=True, outcome='expired')
+        return "Ephemeral route expired", 403
+    if state == 'invalid_token':
+        log_usage(loader_route, request.remote_addr, suspicious=True, outcome='invalid_token')
+        return "Invalid token", 403
+    key_usage.record(kobj.id, request.remote_addr, user_hwid)
+
+    # only the build pointer is read; the payload itself never enters Python
+    pointer = build_pointer('single', route.script_id)
+    project_id = pointer[3] if pointer else None
+    digest = ensure_build(*pointer[:3]) if pointer else None
+    if not digest:
+        log_usage(loader_route, request.remote_addr, suspicious=True, outcome='no_script')
         return "No main script found", 500
 
-    import base64
-    step1 = base64.b64encode(ms.code.encode()).decode()
-    step2 = base64.b64encode(step1.encode()).decode()
-    step3 = base64.b64encode(step2.encode()).decode()
+    if state != 'resumed':
+        record_series_event('executions', project_id=project_id, deferred=True)
+        db.session.commit()
 
-    illusionsA = secrets.token_urlsafe(8)
-    illusionsB = secrets.token_urlsafe(8)
+    if client_has_build(digest):
+        log_usage(loader_route, request.remote_addr, outcome='unchanged')
+        return unchanged_response(digest)
+    log_usage(loader_route, request.remote_addr, suspicious=False, outcome='resumed' if state == 'resumed' else 'ok')
+    return payload_response(digest)
 
-    final_lua = f"""
--- environment check in-lua
-if hookfunction or debug.setupvalue or hookmetamethod then
-    return print("Suspicious environment, aborting script.")
-end
-
-local step3 = "{step3}"
-local s2 = game:GetService("HttpService"):Base64Decode(step3)
-local s1 = game:GetService("HttpService"):Base64Decode(s2)
-local final = game:GetService("HttpService"):Base64Decode(s1)
-
--- illusions
-local illusionsA = "{illusionsA}"
-local illusionsB = "{illusionsB}"
-
-loadstring(final)()
-"""
-
-    if er.single_use:
-        db.session.delete(er)
-        db.session.commit()
-
-    log_usage(er.route_name, request.remote_addr, suspicious=False)
-    return Response(final_lua, mimetype='text/plain')
-
-###################################################
-# ADVANCED VIRTUALIZATION (LUARMOR-LEVEL) SINGLE-CHUNK LOADER
-###################################################
-# (Same as your advanced VM approach, see the next code snippet)
-# ...
-# We keep the entire advanced VM logic:
-# vm_loader_admin_advanced, vm_loader_create_advanced,
-# ephemeral route, etc.
-
-# For brevity, we re-paste your advanced VM code here exactly as is:
+###############################################################################
+# ADVANCED VM LOADER ADD-ON (Luarmor-like)
+# Paste this at the bottom of your existing app.py
+###############################################################################
 
+# 1) Models for advanced VM
 class VirtualScript(db.Model):
     __tablename__ = "virtual_script_advanced"
     id = db.Column(db.Integer, primary_key=True)
-    bytecode = db.Column(db.Text, nullable=False)
+    bytecode = db.Column(db.Text, nullable=False)  # '' when only the bytecode blob holds it
     updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    build_hash = db.Column(db.String(64), nullable=True)
+    bytecode_hash = db.Column(db.String(64), nullable=True)
 
 class EphemeralRouteVM(db.Model):
     __tablename__ = "ephemeral_route_vm_advanced2"
     id = db.Column(db.Integer, primary_key=True)
     route_name = db.Column(db.String(50), unique=True, nullable=False)
     token = db.Column(db.String(64), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     expires_in = db.Column(db.Integer, default=120)
     single_use = db.Column(db.Boolean, default=True)
+    expires_at = db.Column(db.DateTime, nullable=True)  # created_at + expires_in
+    consumed_at = db.Column(db.DateTime, nullable=True)
+    consumed_by = db.Column(db.String(64), nullable=True)
 
-import re
+vm_route_filter = RouteFilter('vm', EphemeralRouteVM)
 
-TOKENS = [
-    (r"[A-Za-z_]\w*", "IDENT"),
-    (r"==|~=|<=|>=|<|>", "COMP"),
-    (r"\+|\-|\*|\/|\%|\^", "ARITH"),
-    (r"\.\.\.", "VARARG"),
-    (r"\.\.", "CONCAT"),
-    (r"\=", "ASSIGN"),
-    (r"\(", "LPAREN"),
-    (r"\)", "RPAREN"),
-    (r"\{", "LBRACE"),
-    (r"\}", "RBRACE"),
-    (r"\[", "LBRACKET"),
-    (r"\]", "RBRACKET"),
-    (r";", "SEMICOLON"),
-    (r":", "COLON"),
-    (r"\.", "DOT"),
-    (r",", "COMMA"),
-    (r"\"(?:\\.|[^\"])*\"", "STRING_DQ"),
-    (r"\'(?:\\.|[^\'])*\'", "STRING_SQ"),
-    (r"\d+(\.\d+)?", "NUMBER"),
-    (r"if|then|else|elseif|end|while|do|for|in|repeat|until|function|local|return|break|true|false|nil|not|and|or", "KEYWORD"),
-]
-token_regex = re.compile("|".join(f"(?P<{name}>{pattern})" for pattern, name in TOKENS)+r"|(?P<WHITESPACE>\s+)|(?P<UNKNOWN>.)")
-
-def advanced_tokenize(lua_source):
-    tokens = []
-    for m in token_regex.finditer(lua_source):
-        kind = m.lastgroup
-        text = m.group(kind)
-        if kind == "WHITESPACE":
-            continue
-        elif kind == "UNKNOWN":
-            tokens.append(("UNKNOWN", text))
-        else:
-            tokens.append((kind, text))
-    return tokens
+# 2) Tokenizer: TOKENS, token_regex, advanced_tokenize() and compile_segment()
+# live in vm_compile.py so compile pool processes can import them alone.
 
 def advanced_compile(lua_source):
-    tokens = advanced_tokenize(lua_source)
+    """
+    Parse the tokens into a "VM instruction set" covering
+    arithmetic, function calls, loops, etc.
+    We store them as "KIND:base64(token)" joined by '|'.
+    """
     instructions = []
     import base64
-    for (kind, text) in tokens:
+    for (kind, text) in advanced_tokenize(lua_source):
         data_enc = base64.b64encode(text.encode()).decode()
         instructions.append(f"{kind}:{data_enc}")
     return "|".join(instructions)
 
-@app.route('/vm_loader_admin_advanced', methods=['GET','POST'])
-def vm_loader_admin_advanced():
-    vs = VirtualScript.query.first()
-    if request.method == 'POST':
-        lua_source = request.form.get('code', '')
-        compiled_bc = advanced_compile(lua_source)
-        if vs:
-            vs.bytecode = compiled_bc
-            vs.updated_at = datetime.utcnow()
-        else:
-            vs = VirtualScript(bytecode=compiled_bc, updated_at=datetime.utcnow())
-            db.session.add(vs)
-        db.session.commit()
-        flash("Advanced VM Script updated!", "success")
-        return redirect(url_for('vm_loader_admin_advanced'))
-
-    existing_bc = vs.bytecode if vs else ""
-    page_content = f"""
-<h3>Advanced VM Loader Admin</h3>
-<p>Paste normal Lua code, compile to advanced VM bytecode covering loops, if, etc.</p>
-<form method="POST">
-  <label>Lua Code</label><br/>
-  <textarea name="code" rows="10" cols="60"></textarea>
-  <br/><br/>
-  <button type="submit" class="btn btn-success">Compile to VM Bytecode</button>
-</form>
-<hr/>
-<h4>Current Bytecode</h4>
-<pre>{existing_bc}</pre>
-"""
-    return render_template_string(big_html, content=page_content)
-
-@app.route('/vm_loader_create_advanced')
-def vm_loader_create_advanced():
-    vs = VirtualScript.query.first()
-    if not vs:
-        return "No advanced VM script compiled. Use /vm_loader_admin_advanced"
-
-    if environment_check():
-        return "Suspicious environment. Aborting ephemeral route creation.", 403
-
-    route_name = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
-    token_str = secrets.token_hex(16)
-    er = EphemeralRouteVM(
-        route_name=route_name,
-        token=token_str,
-        created_at=datetime.utcnow(),
-        expires_in=120,
-        single_use=True
-    )
-    db.session.add(er)
-    db.session.commit()
-
-    page_content = f"""
-<h3>Advanced VM Ephemeral Route Created</h3>
-<ul>
-  <li>/{route_name}?key=YOUR_KEY&hwid=YOUR_HWID&token={token_str}</li>
-</ul>
-<p>Expires in 120 seconds, single-use. 
-We do environment hooking checks, ban checks, kill switch checks, triple base64, illusions, 
-and interpret your script under a custom VM in-lua with no standard Lua instructions left.</p>
-"""
-    return render_template_string(big_html, content=page_content)
-
-@app.route('/<path:vm_advanced_route>')
-def vm_advanced_loader(vm_advanced_route):
-    er = EphemeralRouteVM.query.filter_by(route_name=vm_advanced_route).first()
-    if not er:
-        return "404 Not Found", 404
-
-    if environment_check():
-        print("[VM ADVANCED USAGE] Suspicious hooking detected.")
-        return "Suspicious environment. Aborting route usage.", 403
-
-    user_hwid = request.args.get('hwid', '')
-    if is_banned(request.remote_addr, user_hwid):
-        print("[VM ADVANCED USAGE] IP banned.")
-        return "You are banned from using this service.", 403
-
-    delta = (datetime.utcnow() - er.created_at).total_seconds()
-    if delta > er.expires_in:
-        print("[VM ADVANCED USAGE] Route expired.")
-        return "Ephemeral route expired", 403
-
-    user_token = request.args.get('token', '')
-    if user_token != er.token:
-        print("[VM ADVANCED USAGE] Invalid token.")
-        return "Invalid token", 403
-
-    user_key = request.args.get('key', '')
-    if not user_key:
-        print("[VM ADVANCED USAGE] Missing key.")
-        return "Missing key param", 400
-
-    kobj = Key.query.filter_by(value=user_key).first()
-    if not kobj:
-        print("[VM ADVANCED USAGE] Invalid key.")
-        return "Invalid key", 403
-    if kobj.expires_at and datetime.utcnow() > kobj.expires_at:
-        print("[VM ADVANCED USAGE] Key expired.")
-        return "Key expired", 403
-
-    ks = KillSwitch.query.first()
-    if ks and ks.active:
-        return "Kill Switch active. Scripts disabled.", 403
+# Streaming compile. A newline outside a string literal is a safe place to
+# cut the source: tokenizing the pieces separately yields the same tokens as
+# tokenizing the whole. _BOUNDARY_SCAN consumes quotes exactly like
+# token_regex so both agree on what is inside a string.
+SEGMENT_SIZE = 64 * 1024
+_TOKEN_PATTERNS = {name: pattern for pattern, name in TOKENS}
+_BOUNDARY_SCAN = re.compile(
+    f"(?P<STRING>{_TOKEN_PATTERNS['STRING_DQ']}|{_TOKEN_PATTERNS['STRING_SQ']})"
+    r"|(?P<NEWLINE>\n)|(?P<QUOTE>[\"'])"
+)
 
-    vs = VirtualScript.query.first()
-    if not vs:
-        print("[VM ADVANCED USAGE] No advanced VM script found.")
-        return "No advanced VM script found", 500
+def last_safe_cut(text):
+    """Offset just past the last newline in text that stays outside strings however text continues (0 if none)."""
+    cut = 0
+    for m in _BOUNDARY_SCAN.finditer(text):
+        if m.lastgroup == 'NEWLINE':
+            cut = m.end()
+        elif m.lastgroup == 'QUOTE':
+            # unterminated so far; it may close in a later chunk
+            break
+        else:
+            # an odd run of backslashes before the closing quote means the
+            # regex backtracked past an escaped quote because the text ran
+            # out, so more text could still extend this string
+            closing = m.end() - 1
+            run = 0
+            while text[closing - 1 - run] == '\\':
+                run += 1
+            if run % 2:
+                break
+    return cut
+
+def iter_source_segments(text_chunks, min_size=SEGMENT_SIZE):
+    """Regroup streamed source text into pieces that end on safe newlines."""
+    buffer = ''
+    for chunk in text_chunks:
+        buffer += chunk
+        if len(buffer) < min_size:
+            continue
+        cut = last_safe_cut(buffer)
+        if cut:
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+    if buffer:
+        yield buffer
+
+def iter_text(byte_chunks):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for chunk in byte_chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+# Segments compile independently, so sources are compiled on a process pool
+# (the tokenizer is pure Python and holds the GIL, so compiling on a thread
+# of a serving worker would stall its requests); workers=0 compiles in the
+# calling thread instead, for tests and benchmarks. Results are consumed in
+# submission order and joined exactly like the serial path, so the bytecode
+# is byte-identical whatever the worker count. At most 2 * workers segments
+# are in flight per compile, which keeps memory bounded.
+#
+# Each serving process keeps one long-lived pool of COMPILE_WORKERS
+# processes, started on first use. Forking a worker that already runs the
+# rollup, write-queue and compile job threads is unsafe (a child can inherit
+# a lock held mid-operation), so children come from a forkserver (spawn where
+# there is none) and only import vm_compile, never this module's DB setup.
+COMPILE_WORKERS = int(os.environ.get('COMPILE_WORKERS', 1))
+PARALLEL_SEGMENT_SIZE = 1 << 20
+COMPILE_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+def new_compile_pool(workers):
+    context = multiprocessing.get_context(COMPILE_START_METHOD)
+    if COMPILE_START_METHOD == 'forkserver':
+        context.set_forkserver_preload(['vm_compile'])
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+_compile_pool = {'pid': None, 'pool': None}
+_compile_pool_lock = threading.Lock()
+
+def compile_pool():
+    """This process's shared compile pool (created once per process, so after fork too)."""
+    with _compile_pool_lock:
+        if _compile_pool['pid'] != os.getpid():
+            _compile_pool['pid'] = os.getpid()
+            _compile_pool['pool'] = new_compile_pool(COMPILE_WORKERS)
+        return _compile_pool['pool']
+
+def _discard_compile_pool(pool):
+    with _compile_pool_lock:
+        if _compile_pool['pool'] is pool:
+            _compile_pool['pid'] = _compile_pool['pool'] = None
+
+def _iter_parallel_pieces(segments, pool, workers):
+    pending = deque()
+    try:
+        for segment in segments:
+            pending.append(pool.submit(compile_segment, segment))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    except BrokenProcessPool:
+        _discard_compile_pool(pool)  # a child died; the next compile starts a fresh pool
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+def iter_compile(segments, workers=0, pool=None):
+    """advanced_compile() over source segments, yielding the bytecode as bytes piece by piece.
+
+    With workers, segments run on pool (this process's shared compile pool by default).
+    """
+    if workers:
+        pieces = _iter_parallel_pieces(segments, pool or compile_pool(), workers)
+    else:
+        pieces = map(compile_segment, segments)
+    first = True
+    for piece in pieces:
+        if not piece:
+            continue
+        yield piece if first else b"|" + piece
+        first = False
 
-    import base64
-    step1 = base64.b64encode(vs.bytecode.encode()).decode()
-    step2 = base64.b64encode(step1.encode()).decode()
-    step3 = base64.b64encode(step2.encode()).decode()
+def _report_progress(blocks, progress):
+    done = 0
+    for block in blocks:
+        yield block
+        done += len(block)
+        progress(done)
 
-    illusionsA = secrets.token_urlsafe(8)
-    illusionsB = secrets.token_urlsafe(8)
+def compile_blob(source_hash, workers=None, progress=None):
+    """Compile a source blob into a bytecode blob and return the bytecode digest.
 
-    final_lua = f"""
+    progress, if given, is called with the number of source bytes read so far.
+    """
+    workers = COMPILE_WORKERS if workers is None else workers
+    segment_size = PARALLEL_SEGMENT_SIZE if workers else SEGMENT_SIZE
+    blocks = payload_store.iter_file(source_hash)
+    if progress:
+        blocks = _report_progress(blocks, progress)
+    segments = iter_source_segments(iter_text(blocks), segment_size)
+    return payload_store.write_chunks(iter_compile(segments, workers))
+
+VM_BUILD_TEMPLATE = """
 -- environment hooking check in-lua
 if hookfunction or debug.setupvalue or hookmetamethod then
     return print("Suspicious environment, aborting advanced VM.")
@@ -1144,139 +3805,210 @@ end
 advanced_vm_run(finalBytecode)
 """
 
-    if er.single_use:
-        db.session.delete(er)
-        db.session.commit()
-
-    print(f"[VM ADVANCED USAGE] route={er.route_name} used successfully.")
-    return Response(final_lua, mimetype='text/plain')
-
-############################
-# MAIN
-############################
-with app.app_context():
-    db.create_all()
-    seed_data()
+def render_vm_build(bytecode_chunks, seed):
+    """VM payload: triple base64 of the bytecode plus the in-lua stack VM that runs it."""
+    return render_build(VM_BUILD_TEMPLATE, bytecode_chunks, seed)
 
-if __name__ == '__main__':
-    app.run(host="0.0.0.0", debug=True, port=5000)
 ###############################################################################
-# ADVANCED VM LOADER ADD-ON (Luarmor-like)
-# Paste this at the bottom of your existing app.py
+# VM Loader Admin
+# Paste normal Lua, compile to advanced VM bytecode
 ###############################################################################
-
-import re
-
-# 1) Models for advanced VM
-class VirtualScript(db.Model):
-    __tablename__ = "virtual_script_advanced"
+BYTECODE_PREVIEW_CHARS = 4096
+
+# Uploads are compiled off the request path: the POST only spools the source
+# into the store and records a CompileJob, and a small per-process thread
+# pool runs compile_blob() (on the process's compile pool, so the GIL stays
+# free for requests) and renders the build. Publishing
+# updates VirtualScript and the job in one transaction, so loaders see the
+# old build or the new one and never a mix. Jobs live in the DB so any
+# worker can answer the status endpoint.
+COMPILE_JOB_THREADS = int(os.environ.get('COMPILE_JOB_THREADS', 1))
+COMPILE_JOB_QUEUE_LIMIT = int(os.environ.get('COMPILE_JOB_QUEUE_LIMIT', 4))
+# queued/running jobs older than this belonged to a worker that died
+COMPILE_JOB_TIMEOUT = int(os.environ.get('COMPILE_JOB_TIMEOUT', 3600))  # seconds
+COMPILE_PROGRESS_INTERVAL = 1.0
+
+METRIC_HELP['eaglehub_compile_jobs_total'] = ('counter', 'Finished background compile jobs by final status.')
+
+class CompileJob(db.Model):
+    __tablename__ = "compile_job"
     id = db.Column(db.Integer, primary_key=True)
-    bytecode = db.Column(db.Text, nullable=False)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class EphemeralRouteVM(db.Model):
-    __tablename__ = "ephemeral_route_vm_advanced2"
-    id = db.Column(db.Integer, primary_key=True)
-    route_name = db.Column(db.String(50), unique=True, nullable=False)
-    token = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, done, failed, superseded
+    source_hash = db.Column(db.String(64), nullable=False)
+    bytecode_hash = db.Column(db.String(64), nullable=True)
+    progress = db.Column(db.BigInteger, default=0)  # source bytes read
+    total = db.Column(db.BigInteger, default=0)
+    error = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    expires_in = db.Column(db.Integer, default=120)
-    single_use = db.Column(db.Boolean, default=True)
-
-# 2) Regex token definitions for advanced Lua parsing
-TOKENS = [
-    (r"[A-Za-z_]\w*", "IDENT"),
-    (r"==|~=|<=|>=|<|>", "COMP"),
-    (r"\+|\-|\*|\/|\%|\^", "ARITH"),
-    (r"\.\.\.", "VARARG"),
-    (r"\.\.", "CONCAT"),
-    (r"\=", "ASSIGN"),
-    (r"\(", "LPAREN"),
-    (r"\)", "RPAREN"),
-    (r"\{", "LBRACE"),
-    (r"\}", "RBRACE"),
-    (r"\[", "LBRACKET"),
-    (r"\]", "RBRACKET"),
-    (r";", "SEMICOLON"),
-    (r":", "COLON"),
-    (r"\.", "DOT"),
-    (r",", "COMMA"),
-    (r"\"(?:\\.|[^\"])*\"", "STRING_DQ"),
-    (r"\'(?:\\.|[^\'])*\'", "STRING_SQ"),
-    (r"\d+(\.\d+)?", "NUMBER"),
-    (r"if|then|else|elseif|end|while|do|for|in|repeat|until|function|local|return|break|true|false|nil|not|and|or", "KEYWORD"),
-]
-
-# Combine into one pattern
-token_regex = re.compile(
-    "|".join(f"(?P<{name}>{pattern})" for pattern, name in TOKENS)
-    + r"|(?P<WHITESPACE>\s+)|(?P<UNKNOWN>.)"
-)
-
-def advanced_tokenize(lua_source):
-    """Tokenize Lua code into (kind, text) pairs for advanced VM."""
-    tokens = []
-    for m in token_regex.finditer(lua_source):
-        kind = m.lastgroup
-        text = m.group(kind)
-        if kind == "WHITESPACE":
-            continue
-        elif kind == "UNKNOWN":
-            tokens.append(("UNKNOWN", text))
-        else:
-            tokens.append((kind, text))
-    return tokens
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+_compile_jobs = {'pid': None, 'executor': None, 'pending': 0}
+_compile_jobs_lock = threading.Lock()
+
+def submit_compile_job(job_id):
+    """Queue a job on this worker's compile pool; False if COMPILE_JOB_QUEUE_LIMIT is reached."""
+    with _compile_jobs_lock:
+        if _compile_jobs['pid'] != os.getpid():
+            # a forked worker inherits the dict but not the pool threads
+            _compile_jobs.update(pid=os.getpid(), pending=0, executor=ThreadPoolExecutor(
+                max_workers=COMPILE_JOB_THREADS, thread_name_prefix='compile-job'))
+        if _compile_jobs['pending'] >= COMPILE_JOB_QUEUE_LIMIT:
+            return False
+        _compile_jobs['pending'] += 1
+        _compile_jobs['executor'].submit(_run_compile_job, job_id)
+    return True
+
+def _run_compile_job(job_id):
+    try:
+        with app.app_context():
+            try:
+                status = _compile_and_publish(job_id)
+            except Exception as e:
+                app.logger.exception("compile job #%s failed", job_id)
+                db.session.rollback()
+                _finish_unfinished_compile_jobs([job_id], str(e))
+                status = 'failed'
+        metrics.inc('eaglehub_compile_jobs_total', status=status)
+    except Exception:
+        app.logger.exception("compile job #%s could not be marked failed", job_id)
+    finally:
+        with _compile_jobs_lock:
+            _compile_jobs['pending'] -= 1
+
+def _finish_unfinished_compile_jobs(job_ids, error):
+    # a job another path already finished keeps its status
+    failed = CompileJob.query.filter(CompileJob.id.in_(job_ids), CompileJob.status.in_(('queued', 'running'))) \
+        .update({'status': 'failed', 'error': error[:1000], 'finished_at': datetime.utcnow()},
+                synchronize_session=False)
+    db.session.commit()
+    return failed
+
+def fail_stale_compile_jobs():
+    """Fail jobs left queued or running by a worker that died; runs at boot and with the rollups."""
+    cutoff = datetime.utcnow() - timedelta(seconds=COMPILE_JOB_TIMEOUT)
+    stale = [job_id for (job_id,) in db.session.query(CompileJob.id).filter(
+        CompileJob.status.in_(('queued', 'running')), CompileJob.created_at < cutoff)]
+    if not stale:
+        return 0
+    failed = _finish_unfinished_compile_jobs(stale, f"abandoned: not finished within {COMPILE_JOB_TIMEOUT}s")
+    app.logger.warning("failed %d abandoned compile jobs", failed)
+    return failed
+
+def _compile_and_publish(job_id):
+    job = db.session.get(CompileJob, job_id)
+    job.status = 'running'
+    source_hash = job.source_hash
+    db.session.commit()
 
-def advanced_compile(lua_source):
-    """
-    Parse the tokens into a "VM instruction set" covering
-    arithmetic, function calls, loops, etc.
-    We store them as "KIND:base64(token)" joined by '|'.
-    """
-    instructions = []
-    import base64
-    for (kind, text) in advanced_tokenize(lua_source):
-        data_enc = base64.b64encode(text.encode()).decode()
-        instructions.append(f"{kind}:{data_enc}")
-    return "|".join(instructions)
+    last_report = [time.monotonic()]
+    def report(done):
+        if time.monotonic() - last_report[0] >= COMPILE_PROGRESS_INTERVAL:
+            last_report[0] = time.monotonic()
+            CompileJob.query.filter_by(id=job_id).update({'progress': done})
+            db.session.commit()
+
+    # any exception, here or while publishing, fails the job in _run_compile_job
+    bytecode_hash = compile_blob(source_hash, progress=report)
+    compiled_bc = payload_store.read_inline(bytecode_hash)
+    chunks, seed = stored_content(compiled_bc, bytecode_hash)
+    build_hash = payload_store.write_chunks(render_vm_build(chunks, seed))
+
+    # lock the published row so two finishing jobs publish one after the other
+    vs = VirtualScript.query.with_for_update().first()
+    job = db.session.get(CompileJob, job_id)
+    newer = db.session.query(CompileJob.id).filter(CompileJob.id > job_id, CompileJob.status == 'done').first()
+    if newer:
+        # a later upload already went live; never roll it back
+        job.status = 'superseded'
+    else:
+        if not vs:
+            vs = VirtualScript(bytecode=compiled_bc)
+            db.session.add(vs)
+        vs.bytecode = compiled_bc
+        vs.bytecode_hash = bytecode_hash
+        vs.build_hash = build_hash
+        vs.updated_at = datetime.utcnow()
+        record_script_version('vm', bytecode_hash, build_hash)
+        publish_invalidation('build')
+        job.status = 'done'
+    job.bytecode_hash = bytecode_hash
+    job.progress = job.total
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return job.status
+
+@app.route('/vm_loader_admin_advanced/jobs/<int:job_id>')
+def compile_job_status(job_id):
+    job = db.session.get(CompileJob, job_id)
+    if not job:
+        abort(404)
+    response = jsonify({
+        'id': job.id,
+        'status': job.status,
+        'progress': job.progress,
+        'total': job.total,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    })
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
-###############################################################################
-# VM Loader Admin
-# Paste normal Lua, compile to advanced VM bytecode
-###############################################################################
 @app.route('/vm_loader_admin_advanced', methods=['GET','POST'])
 def vm_loader_admin_advanced():
     """
     Admin page to store advanced VM bytecode. 
     Paste normal Lua -> compile -> store in VirtualScript.
     """
-    vs = VirtualScript.query.first()
     if request.method == 'POST':
-        lua_source = request.form.get('code', '')
-        compiled_bc = advanced_compile(lua_source)
-        if vs:
-            vs.bytecode = compiled_bc
-            vs.updated_at = datetime.utcnow()
-        else:
-            vs = VirtualScript(bytecode=compiled_bc, updated_at=datetime.utcnow())
-            db.session.add(vs)
+        source_hash = ingest_upload()
+        if source_hash is None:
+            flash("No script uploaded.", "warning")
+            return redirect(url_for('vm_loader_admin_advanced'))
+        job = CompileJob(source_hash=source_hash, total=payload_store.size(source_hash))
+        db.session.add(job)
         db.session.commit()
-        flash("Advanced VM Script updated!", "success")
+        if submit_compile_job(job.id):
+            flash(f"Compile job #{job.id} queued.", "success")
+        else:
+            CompileJob.query.filter_by(id=job.id).update(
+                {'status': 'failed', 'error': 'compile queue full', 'finished_at': datetime.utcnow()})
+            db.session.commit()
+            flash("Compile queue is full, try again shortly.", "danger")
         return redirect(url_for('vm_loader_admin_advanced'))
 
-    existing_bc = vs.bytecode if vs else ""
+    vs = VirtualScript.query.first()
+    jobs = CompileJob.query.order_by(CompileJob.id.desc()).limit(5).all()
+    job_rows = "".join(
+        f"<tr><td><a href='{url_for('compile_job_status', job_id=j.id)}'>#{j.id}</a></td><td>{j.status}</td>"
+        f"<td>{j.progress}/{j.total}</td><td>{j.error or ''}</td></tr>"
+        for j in jobs
+    )
+    existing_bc = ""
+    if vs and vs.bytecode:
+        existing_bc = vs.bytecode[:BYTECODE_PREVIEW_CHARS]
+    elif vs and vs.bytecode_hash and payload_store.has(vs.bytecode_hash):
+        existing_bc = next(payload_store.iter_file(vs.bytecode_hash, BYTECODE_PREVIEW_CHARS), b'').decode(errors='replace')
     page_content = f"""
 <h3>Advanced VM Loader Admin</h3>
 <p>Paste normal Lua code, and we'll compile it to a custom VM bytecode 
 covering arithmetic, loops, if statements, etc.</p>
-<form method="POST">
+<form method="POST" enctype="multipart/form-data">
   <label>Lua Code</label><br/>
   <textarea name="code" rows="10" cols="60"></textarea>
+  <br/>
+  <label>or upload a file</label> <input type="file" name="code"/>
   <br/><br/>
   <button type="submit" class="btn btn-success">Compile to VM Bytecode</button>
 </form>
+<p><a href="{url_for('versions_page', kind='vm')}">Version history</a></p>
 <hr/>
-<h4>Current Bytecode</h4>
+<h4>Recent Compile Jobs</h4>
+<table class="table table-sm">
+  <tr><th>Job</th><th>Status</th><th>Bytes read</th><th>Error</th></tr>
+  {job_rows}
+</table>
+<h4>Current Bytecode (first {BYTECODE_PREVIEW_CHARS} chars)</h4>
 <pre>{existing_bc}</pre>
 """
     return render_template_string(big_html, content=page_content)
@@ -1290,26 +4022,29 @@ def vm_loader_create_advanced():
     Generate ephemeral route for the advanced VM code. 
     We'll place them under /avm/<path> so it doesn't overshadow everything else.
     """
-    vs = VirtualScript.query.first()
-    if not vs:
+    if not db.session.query(VirtualScript.id).first():
         return "No advanced VM script compiled. Use /vm_loader_admin_advanced"
 
     # If environment_check is not defined in your code, define it above
     if environment_check():
         return "Suspicious environment. Aborting ephemeral route creation.", 403
+    ensure_rollup_thread()
 
-    route_name = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
+    route_name = new_route_name()
     token_str = secrets.token_hex(16)
 
+    now = datetime.utcnow()
     er = EphemeralRouteVM(
         route_name=route_name,
         token=token_str,
-        created_at=datetime.utcnow(),
+        created_at=now,
         expires_in=120,
+        expires_at=now + timedelta(seconds=120),
         single_use=True
     )
     db.session.add(er)
     db.session.commit()
+    vm_route_filter.add(route_name)
 
     page_content = f"""
 <h3>Advanced VM Ephemeral Route Created</h3>
@@ -1319,6 +4054,7 @@ def vm_loader_create_advanced():
 <p>Expires in 120 seconds, single-use. 
 We do environment hooking checks, ban checks, kill switch checks, triple base64, illusions, 
 and interpret your script under a custom VM in-lua with no standard Lua instructions left.</p>
+<p>Add &amp;have=&lt;ETag of your last payload&gt; to get a short "-- unchanged" reply when the script has not changed.</p>
 """
     return render_template_string(big_html, content=page_content)
 
@@ -1331,155 +4067,1071 @@ def vm_advanced_loader(vm_advanced_route):
     If route_name matches, we triple-base64 + illusions, hooking checks, kill switch, ban, etc.
     Then build a stack-based VM in-lua for full virtualization.
     """
-    er = EphemeralRouteVM.query.filter_by(route_name=vm_advanced_route).first()
-    if not er:
+    if not check_route_filter(vm_route_filter, 'vm', vm_advanced_route):
+        count_loader_outcome('vm', 'not_found')
         return "404 Not Found", 404
-
     if environment_check():
+        log_usage(vm_advanced_route, request.remote_addr, suspicious=True, outcome='suspicious_env', loader='vm')
         return "Suspicious environment. Aborting route usage.", 403
 
+    # cached checks first, then a one-statement consume committed at once,
+    # as in loader_catch_all_single
     user_hwid = request.args.get('hwid', '')
     if is_banned(request.remote_addr, user_hwid):
+        log_usage(vm_advanced_route, request.remote_addr, suspicious=True, outcome='banned', loader='vm')
         return "You are banned from using this service.", 403
 
-    delta = (datetime.utcnow() - er.created_at).total_seconds()
-    if delta > er.expires_in:
-        return "Ephemeral route expired", 403
-
-    user_token = request.args.get('token', '')
-    if user_token != er.token:
-        return "Invalid token", 403
-
     user_key = request.args.get('key', '')
     if not user_key:
+        log_usage(vm_advanced_route, request.remote_addr, suspicious=True, outcome='missing_key', loader='vm')
         return "Missing key param", 400
 
-    kobj = Key.query.filter_by(value=user_key).first()
+    kobj = lookup_key(user_key)
     if not kobj:
+        log_usage(vm_advanced_route, request.remote_addr, suspicious=True, outcome='invalid_key', loader='vm', key=user_key)
         return "Invalid key", 403
     if kobj.expires_at and datetime.utcnow() > kobj.expires_at:
+        log_usage(vm_advanced_route, request.remote_addr, suspicious=True, outcome='key_expired', loader='vm', key=user_key)
         return "Key expired", 403
 
-    ks = KillSwitch.query.first()
-    if ks and ks.active:
+    if kill_switch_active():
+        log_usage(vm_advanced_route, request.remote_addr, outcome='kill_switch', loader='vm')
         return "Kill Switch active. Scripts disabled.", 403
 
-    vs = VirtualScript.query.first()
-    if not vs:
-        return "No advanced VM script found", 500
-
-    import base64
-    step1 = base64.b64encode(vs.bytecode.encode()).decode()
-    step2 = base64.b64encode(step1.encode()).decode()
-    step3 = base64.b64encode(step2.encode()).decode()
-
-    illusionsA = secrets.token_urlsafe(8)
-    illusionsB = secrets.token_urlsafe(8)
-
-    final_lua = f"""
--- environment hooking check in-lua
-if hookfunction or debug.setupvalue or hookmetamethod then
-    return print("Suspicious environment, aborting advanced VM.")
-end
-
-local illusionsA = "{illusionsA}"
-local illusionsB = "{illusionsB}"
-
-local step3 = "{step3}"
-local s2 = game:GetService("HttpService"):Base64Decode(step3)
-local s1 = game:GetService("HttpService"):Base64Decode(s2)
-local finalBytecode = game:GetService("HttpService"):Base64Decode(s1)
-
-local function decodeBase64(b64)
-    return syn.crypt.base64.decode(b64)
-end
-
-local function splitBytecode(bytecode)
-    local instructions = {{}}
-    for part in string.gmatch(bytecode, '([^|]+)') do
-        table.insert(instructions, part)
-    end
-    return instructions
-end
+    route, state = consume_route(EphemeralRouteVM, vm_advanced_route, request.args.get('token', ''), route_consumer(),
+                                 resumable=request.range is not None)
+    db.session.commit()
+    if state == 'not_found':
+        count_route_filter_check('vm', 'false_positive')
+        count_loader_outcome('vm', 'not_found')
+        return "404 Not Found", 404
+    count_route_filter_check('vm', 'present')
+    if state == 'used_up':
+        # the route exists, so the filter was right; replays look like unknown routes
+        count_loader_outcome('vm', 'used_up')
+        return "404 Not Found", 404
+    if state == 'expired':
+        log_usage(vm_advanced_route, request.remote_addr, suspicious=True, outcome='expired', loader='vm')
+        return "Ephemeral route expired", 403
+    if state == 'invalid_token':
+        log_usage(vm_advanced_route, request.remote_addr, suspicious=True, outcome='invalid_token', loader='vm')
+        return "Invalid token", 403
+    key_usage.record(kobj.id, request.remote_addr, user_hwid)
 
-local function advanced_vm_run(bytecode)
-    local instructions = splitBytecode(bytecode)
-    local stack = {{}}
-    local env = {{}}
-    local pc = 1
-    local function push(val) stack[#stack+1] = val end
-    local function pop() local v=stack[#stack]; stack[#stack]=nil; return v end
+    pointer = build_pointer('vm')
+    digest = ensure_build(*pointer[:3]) if pointer else None
+    if not digest:
+        log_usage(vm_advanced_route, request.remote_addr, suspicious=True, outcome='no_script', loader='vm')
+        return "No advanced VM script found", 500
 
-    local function do_arith(op)
-        local b = pop()
-        local a = pop()
-        if op == "+" then push(a + b)
-        elseif op == "-" then push(a - b)
-        elseif op == "*" then push(a * b)
-        elseif op == "/" then push(a / b)
-        elseif op == "%" then push(a % b)
-        end
-    end
+    if state != 'resumed':
+        record_series_event('executions', deferred=True)
+        db.session.commit()
 
-    local function do_comp(op)
-        local b = pop()
-        local a = pop()
-        if op == "==" then push(a == b)
-        elseif op == "~=" then push(a ~= b)
-        elseif op == "<" then push(a < b)
-        elseif op == ">" then push(a > b)
-        elseif op == "<=" then push(a <= b)
-        elseif op == ">=" then push(a >= b)
-        end
-    end
+    if client_has_build(digest):
+        log_usage(vm_advanced_route, request.remote_addr, outcome='unchanged', loader='vm')
+        return unchanged_response(digest)
+    log_usage(vm_advanced_route, request.remote_addr, outcome='resumed' if state == 'resumed' else 'ok', loader='vm')
+    return payload_response(digest)
 
-    local function do_assign()
-        local val = pop()
-        local var = pop()
-        env[var] = val
-    end
+###############################################################################
+# Script version history
+###############################################################################
+# Every publish of the single-chunk source or the VM bytecode appends a
+# ScriptVersion. Most versions hold a zlib-compressed delta against the
+# previous version (copy/insert ops over lines, or over '|'-separated
+# instructions for bytecode); every VERSION_SNAPSHOT_INTERVAL-th version, and
+# any version whose delta would not be smaller, holds the full content, so
+# reconstructing a version applies fewer than that many deltas. The delta
+# is computed inside the publishing request, and difflib's matcher is
+# superlinear, so contents over VERSION_DIFF_LIMIT are diffed by chunk
+# hashes instead: parts are grouped into chunks whose boundaries depend only
+# on their content (so an edit shifts no boundaries beyond its own chunk),
+# and new chunks found among the old ones become copies. That is linear
+# and resends at most a chunk or two around each edit. Versions also keep their content and build digests, so a rollback normally just
+# points the live row back at files already in the payload store.
+VERSION_SNAPSHOT_INTERVAL = 10
+VERSION_DIFF_LIMIT = 256 << 10  # larger contents get chunked deltas
+VERSION_CHUNK_MASK = 31  # a part ends a chunk when crc32(part) & mask == 0: ~32 parts per chunk
+VERSION_CHUNK_MAX_PARTS = 256
+VERSION_SEPARATORS = {'single': b'\n', 'vm': b'|'}
+# kind -> (model, inline content column, content blob column)
+VERSIONED_SCRIPTS = {
+    'single': (MainScript, 'code', 'source_hash'),
+    'vm': (VirtualScript, 'bytecode', 'bytecode_hash'),
+}
+
+class ScriptVersion(db.Model):
+    __tablename__ = "script_version"
+    __table_args__ = (db.UniqueConstraint('kind', 'version', name='uq_script_version'),)
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    snapshot = db.Column(db.Boolean, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False)
+    build_hash = db.Column(db.String(64), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    while pc <= #instructions do
-        local instr = instructions[pc]
-        pc = pc + 1
-        local parts = {{}}
-        for sub in string.gmatch(instr, "([^:]+)") do
-            table.insert(parts, sub)
-        end
-        local kind = parts[1]
-        local dataEnc = parts[2] or ""
-        local data = decodeBase64(dataEnc)
+def make_delta(old, new, sep):
+    a, b = old.split(sep), new.split(sep)
+    # edits are usually local: trim the common ends before the (superlinear) matcher
+    lo, shortest = 0, min(len(a), len(b))
+    while lo < shortest and a[lo] == b[lo]:
+        lo += 1
+    hi = 0
+    while hi < shortest - lo and a[-1 - hi] == b[-1 - hi]:
+        hi += 1
+    ops = [['c', 0, lo]] if lo else []
+    matcher = difflib.SequenceMatcher(None, a[lo:len(a) - hi], b[lo:len(b) - hi])
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(['c', lo + i1, lo + i2])
+        elif j2 > j1:
+            ops.append(['i', [part.decode('latin-1') for part in b[lo + j1:lo + j2]]])
+    if hi:
+        ops.append(['c', len(a) - hi, len(a)])
+    return zlib.compress(json.dumps(ops, separators=(',', ':')).encode())
+
+def _iter_chunks(parts):
+    """(start, end) part ranges with content-defined boundaries."""
+    start = 0
+    for i, part in enumerate(parts):
+        if zlib.crc32(part) & VERSION_CHUNK_MASK == 0 or i + 1 - start >= VERSION_CHUNK_MAX_PARTS:
+            yield start, i + 1
+            start = i + 1
+    if start < len(parts):
+        yield start, len(parts)
+
+def make_chunked_delta(old, new, sep):
+    """make_delta() in linear time for large contents, at chunk rather than part granularity."""
+    a, b = old.split(sep), new.split(sep)
+    index = {}
+    for start, end in _iter_chunks(a):
+        index.setdefault(hashlib.sha1(sep.join(a[start:end])).digest(), (start, end))
+    ops = []
+    for start, end in _iter_chunks(b):
+        found = index.get(hashlib.sha1(sep.join(b[start:end])).digest())
+        if found and a[found[0]:found[1]] == b[start:end]:
+            if ops and ops[-1][0] == 'c' and ops[-1][2] == found[0]:
+                ops[-1][2] = found[1]
+            else:
+                ops.append(['c', found[0], found[1]])
+        elif ops and ops[-1][0] == 'i':
+            ops[-1][1].extend(part.decode('latin-1') for part in b[start:end])
+        else:
+            ops.append(['i', [part.decode('latin-1') for part in b[start:end]]])
+    return zlib.compress(json.dumps(ops, separators=(',', ':')).encode())
+
+def apply_delta(old, data, sep):
+    a = old.split(sep)
+    out = []
+    for op in json.loads(zlib.decompress(data)):
+        if op[0] == 'c':
+            out.extend(a[op[1]:op[2]])
+        else:
+            out.extend(part.encode('latin-1') for part in op[1])
+    return sep.join(out)
+
+def load_version_content(kind, version):
+    """Rebuild a version's bytes from the nearest snapshot and the deltas after it."""
+    # the nearest snapshot and the deltas after it, in one round trip
+    start = db.session.query(db.func.max(ScriptVersion.version)).filter(
+        ScriptVersion.kind == kind, ScriptVersion.version <= version, ScriptVersion.snapshot.is_(True)
+    ).scalar_subquery()
+    rows = ScriptVersion.query.filter(
+        ScriptVersion.kind == kind, ScriptVersion.version >= start, ScriptVersion.version <= version
+    ).order_by(ScriptVersion.version).all()
+    snap, deltas = rows[0], rows[1:]
+    content = zlib.decompress(snap.data)
+    target = snap
+    for row in deltas:
+        content = apply_delta(content, row.data, VERSION_SEPARATORS[kind])
+        target = row
+    if hashlib.sha256(content).hexdigest() != target.content_hash:
+        raise ValueError(f"{kind} version {version} does not match its content hash")
+    return content
+
+def record_script_version(kind, content_hash, build_hash):
+    """Append the just-published content (a store blob) to kind's history; caller commits."""
+    latest = ScriptVersion.query.filter_by(kind=kind).order_by(ScriptVersion.version.desc()).first()
+    if latest and latest.content_hash == content_hash:
+        return latest
+    number = latest.version + 1 if latest else 1
+    size = payload_store.size(content_hash)
+    compressor = zlib.compressobj()
+    data = b''.join([compressor.compress(block) for block in payload_store.iter_file(content_hash)]
+                    + [compressor.flush()])
+    snapshot = True
+    if latest and number % VERSION_SNAPSHOT_INTERVAL != 1:
+        previous = (payload_store.read(latest.content_hash) if payload_store.has(latest.content_hash)
+                    else load_version_content(kind, latest.version))
+        diff = make_delta if max(size, latest.size) <= VERSION_DIFF_LIMIT else make_chunked_delta
+        delta = diff(previous, payload_store.read(content_hash), VERSION_SEPARATORS[kind])
+        if len(delta) < len(data):
+            data, snapshot = delta, False
+    row = ScriptVersion(kind=kind, version=number, snapshot=snapshot, data=data, size=size,
+                        content_hash=content_hash, build_hash=build_hash)
+    db.session.add(row)
+    return row
+
+@app.route('/versions/<kind>')
+def versions_page(kind):
+    if kind not in VERSIONED_SCRIPTS:
+        abort(404)
+    model = VERSIONED_SCRIPTS[kind][0]
+    live_build = db.session.query(model.build_hash).order_by(model.id).limit(1).scalar()
+    rows = db.session.query(
+        ScriptVersion.version, ScriptVersion.snapshot, ScriptVersion.size,
+        db.func.length(ScriptVersion.data).label('stored'), ScriptVersion.created_at, ScriptVersion.build_hash
+    ).filter_by(kind=kind).order_by(ScriptVersion.version.desc()).limit(50).all()
+    body = "".join(
+        f"<tr><td>{r.version}{' (live)' if r.build_hash == live_build else ''}</td>"
+        f"<td>{'snapshot' if r.snapshot else 'delta'}</td><td>{r.size}</td><td>{r.stored}</td><td>{r.created_at}</td>"
+        f"<td><form method='POST' action='{url_for('rollback_version', kind=kind, version=r.version)}'>"
+        f"<button type='submit' class='btn btn-sm btn-warning'>Roll back</button></form></td></tr>"
+        for r in rows
+    )
+    page_content = f"""
+<h3>Version History ({kind})</h3>
+<table class="table table-sm">
+  <tr><th>Version</th><th>Stored as</th><th>Bytes</th><th>Stored bytes</th><th>Published</th><th></th></tr>
+  {body}
+</table>
+"""
+    return render_template_string(big_html, content=page_content)
 
-        if kind == "WHITESPACE" or kind == "UNKNOWN" then
-            -- skip
-        elseif kind == "IDENT" then
-            push(data)
-        elseif kind == "NUMBER" then
-            push(tonumber(data))
-        elseif kind == "STRING_DQ" or kind == "STRING_SQ" then
-            local strVal = data
-            if (strVal:sub(1,1) == '"' and strVal:sub(-1) == '"')
-               or (strVal:sub(1,1) == "'" and strVal:sub(-1) == "'") then
-                strVal = strVal:sub(2,-2)
-            end
-            push(strVal)
-        elseif kind == "ARITH" then
-            do_arith(data)
-        elseif kind == "COMP" then
-            do_comp(data)
-        elseif kind == "ASSIGN" then
-            do_assign()
-        elseif kind == "KEYWORD" then
-            -- partial
-        end
-    end
-end
+@app.route('/versions/<kind>/<int:version>/rollback', methods=['POST'])
+def rollback_version(kind, version):
+    """Republish an earlier version: reuse its build file, else re-render it (never recompile)."""
+    if kind not in VERSIONED_SCRIPTS:
+        abort(404)
+    model, inline_attr, blob_attr = VERSIONED_SCRIPTS[kind]
+    row = ScriptVersion.query.filter_by(kind=kind, version=version).first()
+    if not row:
+        abort(404)
+    if not payload_store.has(row.content_hash):
+        payload_store.write_chunks([load_version_content(kind, version)])
+    live = model.query.first()
+    if not live:
+        live = model()
+        db.session.add(live)
+    setattr(live, inline_attr, payload_store.read_inline(row.content_hash))
+    setattr(live, blob_attr, row.content_hash)
+    live.updated_at = datetime.utcnow()
+    if row.build_hash and payload_store.has(row.build_hash):
+        live.build_hash = row.build_hash
+    else:
+        build_payload(live)
+    publish_invalidation('build')
+    db.session.commit()
+    flash(f"Rolled back to version {version}.", "success")
+    return redirect(url_for('versions_page', kind=kind))
 
-advanced_vm_run(finalBytecode)
-"""
+############################
+# CLI
+############################
+BUDGET_CHECK_FIXTURE_SCRIPT = 'local budget_check = 1\nprint(budget_check + 1)\n'
+
+@app.cli.command('check-query-budgets')
+def check_query_budgets():
+    """Drive the read pages and the loader flow through the test client and compare SQL counts to QUERY_BUDGETS.
+
+    This writes to the DB it runs against: it creates loader routes and
+    consumes them, calls /killswitch/toggle without a mode (the state is
+    kept, but the kill switch cache version is bumped), and on a DB with
+    nothing published (or no active key) publishes a small fixture script
+    and adds a fixture key, since the loader budgets are the ones that
+    matter. Use a staging copy rather than production. Write endpoints are
+    only covered by tests/test_query_budgets.py, which drives every entry
+    on a scratch DB. Exits non-zero when a route is over budget, has no
+    budget declared, or a loader could not be driven to a 200.
+    """
+    client = app.test_client()
+    strict = app.config['QUERY_BUDGET_STRICT']
+    app.config['QUERY_BUDGET_STRICT'] = False
+    used_by_endpoint = {}
+
+    loaded = set()  # loader endpoints that served a script, not just a 404 probe
+
+    def hit(path, method='GET', **kwargs):
+        with client:
+            response = client.open(path, method=method, buffered=True, **kwargs)
+            endpoint = request.endpoint
+            used = g.get('sql_queries', 0)
+        print(f"  {response.status_code} {used:3d} queries  {path}")
+        used_by_endpoint[endpoint] = max(used, used_by_endpoint.get(endpoint, 0))
+        return response.status_code, endpoint
+
+    with app.app_context():
+        project = Project.query.first()
+        key = Key.query.filter(db.or_(Key.expires_at.is_(None), Key.expires_at > datetime.utcnow())).first()
+        if not key:
+            key = Key(value=f'BUDGETCHECK{secrets.token_hex(8)}', hwid=None, expires_at=None)
+            db.session.add(key)
+            db.session.commit()
+            publish_invalidation('key', key.value)
+        key_id, key_value, key_hwid = key.id, key.value, key.hwid or ''
+        project_id = project.id if project else None
+        publish_single = not db.session.query(MainScript.id).first()
+        publish_vm = not db.session.query(VirtualScript.id).first()
+
+    if publish_single:
+        hit('/loader_admin', 'POST', data={'code': BUDGET_CHECK_FIXTURE_SCRIPT})
+    if publish_vm:
+        hit('/vm_loader_admin_advanced', 'POST', data={'code': BUDGET_CHECK_FIXTURE_SCRIPT})
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            with app.app_context():
+                if not CompileJob.query.filter(CompileJob.status.in_(('queued', 'running'))).first():
+                    break
+            time.sleep(0.2)
+
+    hit('/')
+    hit('/api/dashboard/stats')
+    hit('/api/dashboard/series')
+    hit('/blocked_ips')
+    hit('/blocked_ips/heavy-hitters')
+    hit('/killswitch')
+    hit('/killswitch/toggle')
+    hit('/keys')
+    hit('/loader_admin')
+    hit('/vm_loader_admin_advanced')
+    if METRICS_TOKEN:
+        hit('/metrics', headers={'Authorization': f'Bearer {METRICS_TOKEN}'})
+    hit('/healthz?db=1')
+    hit('/wp-login.php')
+    hit('/avm/wp-login.php')
+    hit('/projects')
+    hit('/versions/single')
+    hit('/versions/vm')
+    if project_id:
+        hit(f'/scripts/{project_id}')
+    if key_id:
+        hit(f'/keys/{key_id}/edit')
+    if ADMIN_TOKEN:
+        hit('/debug/admission', headers={'Authorization': f'Bearer {ADMIN_TOKEN}'})
+        # worst case: a full batch, mostly unknown keys
+        batch = [key_value or 'missing'] + [f'missing-{i}' for i in range(KEY_VERIFY_MAX - 1)]
+        hit('/api/keys/verify', 'POST', json={'keys': batch}, headers={'Authorization': f'Bearer {ADMIN_TOKEN}'})
+
+    for create_path, route_model, prefix in (
+        ('/loader_create', EphemeralRoute, '/'),
+        ('/vm_loader_create_advanced', EphemeralRouteVM, '/avm/'),
+    ):
+        hit(create_path)
+        with app.app_context():
+            er = route_model.query.order_by(route_model.id.desc()).first()
+            route = (er.route_name, er.token) if er else None
+        if route:
+            status, endpoint = hit(f'{prefix}{route[0]}?key={key_value}&token={route[1]}&hwid={key_hwid}')
+            if status == 200:
+                loaded.add(endpoint)
+
+    app.config['QUERY_BUDGET_STRICT'] = strict
+    failed = False
+    for rule in app.url_map.iter_rules():
+        endpoint = rule.endpoint
+        if endpoint == 'static':
+            continue
+        budget = QUERY_BUDGETS.get(endpoint)
+        used = used_by_endpoint.get(endpoint)
+        if budget is None:
+            status = 'NO BUDGET'
+            failed = True
+        elif endpoint in ('loader_catch_all_single', 'vm_advanced_loader') and endpoint not in loaded:
+            status = 'not exercised (no script served)'
+            failed = True
+        elif used is None:
+            status = 'not exercised'
+        elif used > budget:
+            status = 'OVER'
+            failed = True
+        else:
+            status = 'ok'
+        print(f"{endpoint:28s} used={used if used is not None else '-'} budget={budget} {status}")
+    if failed:
+        raise SystemExit(1)
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations."""
+    done = run_migrations()
+    if not done:
+        print("Schema is up to date.")
+
+@app.cli.command('rollup-series')
+def rollup_series_command():
+    """Fold new raw events into the rollups, apply retention and purge expired loader routes (run from cron)."""
+    processed = rollup_events()
+    raw_deleted, hourly_deleted = apply_series_retention()
+    routes_purged = purge_expired_routes()
+    print(f"Rolled up {processed} events; pruned {raw_deleted} raw events and {hourly_deleted} hourly buckets; "
+          f"purged {routes_purged} expired loader routes.")
+
+@app.cli.command('bench-compile')
+@click.option('--size-mb', default=16, help='Size of the synthetic Lua source.')
+@click.option('--workers', 'worker_counts', default='1,2,4,8', help='Comma-separated worker counts to time.')
+def bench_compile(size_mb, worker_counts):
+    """Time serial vs pooled VM compilation and check the bytecode is byte-identical."""
+    unit = 'local msg_{n} = "line {n}: it\'s \\"quoted\\"\\n" .. tostring({n} * 3 + 1)\nif msg_{n} ~= nil then print(msg_{n}) end\n'
+    parts, size, n = [], 0, 0
+    while size < size_mb << 20:
+        part = unit.format(n=n)
+        parts.append(part)
+        size += len(part)
+        n += 1
+    source = ''.join(parts)
+    blocks = [source[i:i + STREAM_BLOCK_SIZE] for i in range(0, len(source), STREAM_BLOCK_SIZE)]
+    print(f"source: {len(source) / 1e6:.1f} MB, cpu_count={os.cpu_count()}")
+
+    started = time.perf_counter()
+    reference = hashlib.sha256()
+    for piece in iter_compile(iter_source_segments(blocks, SEGMENT_SIZE)):
+        reference.update(piece)
+    serial = time.perf_counter() - started
+    print(f"{'serial':>10s} {serial:7.2f}s  1.00x")
+
+    for workers in (int(w) for w in worker_counts.split(',')):
+        if workers < 1:
+            continue
+        with new_compile_pool(workers) as pool:
+            started = time.perf_counter()
+            digest = hashlib.sha256()
+            for piece in iter_compile(iter_source_segments(blocks, PARALLEL_SEGMENT_SIZE), workers, pool):
+                digest.update(piece)
+            elapsed = time.perf_counter() - started
+        same = 'identical' if digest.digest() == reference.digest() else 'MISMATCH'
+        print(f"{workers:>7d} wk {elapsed:7.2f}s {serial / elapsed:5.2f}x  {same}")
+        if same != 'identical':
+            raise SystemExit(1)
+
+@app.cli.command('bulk-keys')
+@click.argument('operation', type=click.Choice(KEY_BULK_OPERATIONS))
+@click.option('--days', default=0, help='Days to add (extend only; negative shortens).')
+@click.option('--state', type=click.Choice(['active', 'expired', 'all']), default='active')
+@click.option('--prefix', default=None, help='Only keys whose value starts with this.')
+@click.option('--created-from', default=None, help='YYYY-MM-DD, inclusive.')
+@click.option('--created-to', default=None, help='YYYY-MM-DD, exclusive.')
+@click.option('--dry-run', is_flag=True, help='Only count the keys that would change.')
+def bulk_keys_command(operation, days, state, prefix, created_from, created_to, dry_run):
+    """Extend, revoke, clear HWIDs of, or delete expired keys in one statement."""
+    try:
+        affected = bulk_key_operation(operation, days=days, dry_run=dry_run, prefix=prefix, state=state,
+                                      created_from=_parse_day(created_from), created_to=_parse_day(created_to))
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    print(f"{operation}: {affected} keys {'would be ' if dry_run else ''}affected.")
+
+@app.cli.command('check-version-history')
+def check_version_history():
+    """Record edited versions at, just over and far over VERSION_DIFF_LIMIT; the edits should be stored as deltas.
+
+    The rows are rolled back afterwards (the content blobs stay in the store).
+    """
+    line = b'print("version history check")\n'
+    base = (line * (VERSION_DIFF_LIMIT // len(line) + 1))[:VERSION_DIFF_LIMIT - 1] + b'\n'
+    at_limit = b'-- edited\n' + base[len(b'-- edited\n'):]
+    over_limit = at_limit + b'\n'
+    large = b''.join(b'print(%d)\n' % n for n in range(1 << 18))
+    large_edited = large.replace(b'print(131072)\n', b'print("edited")\nprint(131072)\n')
+    failed = False
+    try:
+        for label, content in (('base', base), ('at limit', at_limit), ('over limit', over_limit),
+                               ('large', large), ('large edit', large_edited)):
+            digest = payload_store.write_chunks([content])
+            started = time.perf_counter()
+            row = record_script_version('single', digest, None)
+            elapsed = time.perf_counter() - started
+            db.session.flush()
+            diffable = row.version % VERSION_SNAPSHOT_INTERVAL != 1 and label not in ('base', 'large')
+            wrong = diffable and row.snapshot
+            intact = load_version_content('single', row.version) == content
+            failed = failed or wrong or not intact
+            print(f"{label:10s} {len(content):8d} bytes  v{row.version} "
+                  f"{'snapshot' if row.snapshot else 'delta':8s} {len(row.data):8d} stored  {elapsed:5.2f}s"
+                  f"{'  UNEXPECTED' if wrong else ''}{'' if intact else '  CORRUPT'}")
+    finally:
+        db.session.rollback()
+    if failed:
+        raise SystemExit(1)
+
+@app.cli.command('check-client-ip')
+@click.option('--proxy-ip', default='10.0.0.2', help='Address the proxy connects from.')
+@click.option('--client-ip', default='203.0.113.7', help='Client address the proxy forwards.')
+def check_client_ip(proxy_ip, client_ip):
+    """Send a request as a proxy would and show which address bans and auto-bans would key on.
+
+    Fails when auto-ban is on but the proxy's address, shared by every
+    client, is what the app sees.
+    """
+    client = app.test_client()
+    with client:
+        client.get('/healthz', headers={'X-Forwarded-For': client_ip}, environ_base={'REMOTE_ADDR': proxy_ip},
+                   buffered=True)
+        seen = request.remote_addr
+    print(f"TRUSTED_PROXY_HOPS={TRUSTED_PROXY_HOPS} ABUSE_AUTOBAN={int(ABUSE_AUTOBAN)}: "
+          f"request from {client_ip} via {proxy_ip} is seen as {seen}")
+    if seen == client_ip:
+        return
+    if TRUSTED_PROXY_HOPS:
+        print("X-Forwarded-For was not applied.")
+        raise SystemExit(1)
+    if ABUSE_AUTOBAN:
+        print("Auto-ban would block the proxy itself; set TRUSTED_PROXY_HOPS or ABUSE_AUTOBAN=0.")
+        raise SystemExit(1)
+
+@app.cli.command('check-route-consume')
+@click.option('--parallel', default=16, help='Concurrent requests to fire at the route.')
+@click.option('--loader', type=click.Choice(['single', 'vm']), default='single')
+def check_route_consume(parallel, loader):
+    """Fire parallel requests at one fresh single-use route; exactly one may get the script.
+
+    The losers and a later replay must 404 without counting as route filter
+    false positives: the route exists, it is only used up.
+    """
+    model, prefix, route_filter = {
+        'single': (EphemeralRoute, '/', single_route_filter),
+        'vm': (EphemeralRouteVM, '/avm/', vm_route_filter),
+    }[loader]
+    now = datetime.utcnow()
+    key = Key.query.filter(db.or_(Key.expires_at.is_(None), Key.expires_at > now)).first()
+    script_model = MainScript if loader == 'single' else VirtualScript
+    if not key or not db.session.query(script_model.id).first():
+        raise click.ClickException("Needs an active key and a published script.")
+    route_name = new_route_name()
+    token = secrets.token_hex(16)
+    db.session.add(model(route_name=route_name, token=token, created_at=now, expires_in=120,
+                         expires_at=now + timedelta(seconds=120), single_use=True))
+    db.session.commit()
+    route_filter.add(route_name)
+    url = f'{prefix}{route_name}?key={key.value}&token={token}'
+    false_positives = ('eaglehub_route_filter_checks_total', _label_key({'loader': loader, 'result': 'false_positive'}))
+    false_positives_before = metrics.counters.get(false_positives, 0)
+
+    barrier = threading.Barrier(parallel)
+    statuses = []
+    def fire():
+        client = app.test_client()
+        barrier.wait()
+        statuses.append(client.get(url, buffered=True).status_code)
+    threads = [threading.Thread(target=fire) for _ in range(parallel)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    counts = {status: statuses.count(status) for status in sorted(set(statuses))}
+    print(f"{parallel} parallel requests to {prefix}{route_name}: {counts}")
+    replay = app.test_client().get(url, buffered=True).status_code
+    counted = metrics.counters.get(false_positives, 0) - false_positives_before
+    print(f"replay: {replay}, counted as filter false positives: {counted}")
+    if counts.get(200) != 1 or replay != 404 or counted:
+        raise SystemExit(1)
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+@app.cli.command('sqlite-load-test')
+@click.option('--threads', default=16, help='Concurrent client threads.')
+@click.option('--seconds', default=10.0, help='How long to run.')
+def sqlite_load_test(threads, seconds):
+    """Mixed read/write traffic from many threads; reports throughput, latency and server errors.
+
+    Each thread loops over: create + fetch a loader route (two writes), read
+    pages, and edit a key. Any 5xx (e.g. "database is locked") is an error.
+    """
+    now = datetime.utcnow()
+    key = Key.query.filter(db.or_(Key.expires_at.is_(None), Key.expires_at > now)).first()
+    if not key or not db.session.query(MainScript.id).first():
+        raise click.ClickException("Needs an active key and a published single-chunk script.")
+    key_id, key_value = key.id, key.value
+    route_pattern = re.compile(r'/(\w{8})\?key=YOUR_KEY&hwid=YOUR_HWID&token=(\w+)')
+    latencies, statuses = {}, {}
+    record_lock = threading.Lock()
+    stop_at = time.monotonic() + seconds
+
+    def timed(client, op, method, path, **kwargs):
+        started = time.perf_counter()
+        response = client.open(path, method=method, buffered=True, **kwargs)
+        elapsed = time.perf_counter() - started
+        with record_lock:
+            latencies.setdefault(op, []).append(elapsed)
+            statuses.setdefault(op, {}).setdefault(response.status_code, 0)
+            statuses[op][response.status_code] += 1
+        return response
+
+    def worker(seed):
+        rnd = random.Random(seed)
+        client = app.test_client()
+        while time.monotonic() < stop_at:
+            roll = rnd.random()
+            if roll < 0.5:
+                page = timed(client, 'loader_create', 'GET', '/loader_create').get_data(as_text=True)
+                match = route_pattern.search(page)
+                if match:
+                    timed(client, 'loader_fetch', 'GET', f'/{match.group(1)}?key={key_value}&token={match.group(2)}')
+            elif roll < 0.85:
+                timed(client, 'read_key', 'GET', f'/keys/{key_id}/edit')
+                timed(client, 'read_series', 'GET', '/api/dashboard/series?series=executions&granularity=hour')
+            else:
+                timed(client, 'edit_key', 'POST', f'/keys/{key_id}/edit', data={'hwid': f'LOAD-{seed}', 'days': '0'})
+
+    started = time.monotonic()
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.monotonic() - started
+    write_queue.flush()
+
+    total = sum(len(v) for v in latencies.values())
+    errors = sum(n for by_status in statuses.values() for code, n in by_status.items() if code >= 500)
+    print(f"{db.engine.dialect.name}, {threads} threads, {elapsed:.1f}s: {total} requests, "
+          f"{total / elapsed:.0f} req/s, {errors} server errors")
+    for op in sorted(latencies):
+        values = sorted(latencies[op])
+        print(f"  {op:14s} n={len(values):6d} p50={_percentile(values, 0.5) * 1000:7.1f}ms "
+              f"p95={_percentile(values, 0.95) * 1000:7.1f}ms p99={_percentile(values, 0.99) * 1000:7.1f}ms "
+              f"status={statuses[op]}")
+    if errors:
+        raise SystemExit(1)
+
+# Load-test harness. Traffic is replayed either through the WSGI app
+# in-process (the default) or over HTTP against --base-url. Responses are
+# bucketed by operation and an outcome derived from status and body, so the
+# same report works for both modes.
+LOAD_TEST_KEY_PREFIX = 'LT'
+LOAD_TEST_SCANNER_PATHS = ('/wp-login.php', '/.env', '/xmlrpc.php', '/favicon.ico', '/admin/config.php',
+                           '/phpmyadmin/index.php', '/.git/config', '/wp-content/plugins/x.php')
+LOAD_TEST_MIX = (  # (operation, weight)
+    ('loader', 0.64),
+    ('scanner', 0.20),
+    ('read', 0.10),
+    ('admin_edit_key', 0.04),
+    ('banned_loader', 0.015),
+    ('publish_script', 0.005),
+)
 
-    if er.single_use:
-        db.session.delete(er)
+def seed_load_test_data(keys, blocked_ips, expired_share=0.1):
+    """Bulk-insert LT-prefixed keys and benchmark-range blocked IPs; returns (key values, blocked IPs)."""
+    existing = db.session.query(db.func.count(Key.id)).filter(Key.value.startswith(LOAD_TEST_KEY_PREFIX)).scalar()
+    now = datetime.utcnow()
+    rows = [{'value': f'{LOAD_TEST_KEY_PREFIX}{i:010d}', 'hwid': None, 'created_at': now,
+             'expires_at': now - timedelta(days=1) if (i + 1) % int(1 / expired_share) == 0 else now + timedelta(days=30)}
+            for i in range(existing, keys)]
+    for start in range(0, len(rows), 5000):
+        db.session.execute(db.insert(Key), rows[start:start + 5000])
+    ips = [f'198.18.{i // 256}.{i % 256}' for i in range(blocked_ips)]
+    have_ips = {ip for (ip,) in db.session.query(BlockedIP.ip_address).filter(BlockedIP.ip_address.startswith('198.18.'))}
+    ban_rows = [{'ip_address': ip, 'reason': 'load test', 'created_at': now} for ip in ips if ip not in have_ips]
+    for start in range(0, len(ban_rows), 5000):
+        db.session.execute(db.insert(BlockedIP), ban_rows[start:start + 5000])
+    if not db.session.query(MainScript.id).first():
+        ms = MainScript(code='print("load test")', updated_at=now)
+        db.session.add(ms)
+        build_payload(ms)
+        publish_invalidation('build')
+    # servers may have cached these keys and IPs as unknown
+    publish_invalidation('key')
+    publish_invalidation('ban')
+    db.session.commit()
+    return [f'{LOAD_TEST_KEY_PREFIX}{i:010d}' for i in range(keys)], ips
+
+def clear_load_test_data(key_ids):
+    """Delete what seed_load_test_data added (LT keys, their usage rows, load-test bans)."""
+    for start in range(0, len(key_ids), 5000):
+        db.session.execute(db.delete(KeyUsageDay).where(KeyUsageDay.key_id.in_(key_ids[start:start + 5000])))
+    keys = db.session.execute(db.delete(Key).where(Key.value.startswith(LOAD_TEST_KEY_PREFIX))).rowcount
+    bans = db.session.execute(db.delete(BlockedIP).where(
+        BlockedIP.reason == 'load test', BlockedIP.ip_address.startswith('198.18.'))).rowcount
+    publish_invalidation('key')
+    publish_invalidation('ban')
+    db.session.commit()
+    return keys, bans
+
+class _LoadTestClient:
+    """GET/POST against the in-process app or a running server; returns (status, body text)."""
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.client = None if base_url else app.test_client()
+
+    def request(self, method, path, data=None, remote_addr=None):
+        if self.client:
+            environ = {'REMOTE_ADDR': remote_addr} if remote_addr else {}
+            # buffered, so the response is closed (and its admission slot freed) here
+            response = self.client.open(path, method=method, data=data, environ_base=environ, buffered=True)
+            return response.status_code, response.get_data(as_text=True)
+        body = urllib.parse.urlencode(data).encode() if data else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=30) as response:
+                return response.status, response.read().decode(errors='replace')
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode(errors='replace')
+
+def _load_test_outcome(status, body):
+    if status < 300 or status in (301, 302, 304):
+        return str(status)
+    # loader errors are short plain-text messages; keep the first few words
+    return f"{status} {' '.join(body.split()[:4])[:40]}"
+
+@app.cli.command('load-test')
+@click.option('--base-url', default=None, help='Drive a running server instead of the in-process app.')
+@click.option('--threads', default=16, help='Concurrent client threads.')
+@click.option('--seconds', default=30.0, help='How long to run.')
+@click.option('--keys', default=10000, help='Keys to seed and draw from.')
+@click.option('--blocked-ips', default=1000, help='Blocked IPs to seed.')
+@click.option('--zipf', default=1.1, help='Zipf exponent of key popularity.')
+@click.option('--invalid-key-share', default=0.1, help='Share of loader fetches using a key that does not exist.')
+@click.option('--killswitch-every', default=0.0, help='Seconds between kill-switch flips (0, the default, disables).')
+@click.option('--allow-killswitch', is_flag=True, help='Required to flip the kill switch of a --base-url server.')
+@click.option('--keep-data', is_flag=True, help='Leave the seeded keys and bans in place afterwards.')
+@click.option('--seed', 'rng_seed', default=1, help='Random seed for the traffic mix.')
+def load_test(base_url, threads, seconds, keys, blocked_ips, zipf, invalid_key_share, killswitch_every,
+              allow_killswitch, keep_data, rng_seed):
+    """Seed keys/bans, replay a production-like traffic mix, report throughput and p50/p95/p99.
+
+    Mix: loader create+fetch with Zipf-popular keys (some invalid, some from
+    banned IPs), scanner 404s, dashboard/key reads, key edits, script
+    publishes, and optionally kill-switch flips. Banned-IP traffic needs the
+    in-process mode, since over HTTP the client address cannot be chosen.
+    The seeded keys and bans are deleted afterwards, and the main script and
+    kill switch are put back as they were, unless --keep-data is given.
+    """
+    if base_url and killswitch_every > 0 and not allow_killswitch:
+        raise click.BadParameter('flipping the kill switch of a live server needs --allow-killswitch',
+                                 param_hint='--killswitch-every')
+    ms = MainScript.query.first()
+    live_script = (ms.code, ms.source_hash, ms.build_hash) if ms else None
+    ks = KillSwitch.query.first()
+    kill_switch_was = bool(ks and ks.active)
+    key_values, ips = seed_load_test_data(keys, blocked_ips)
+    key_ids = [key_id for (key_id,) in db.session.query(Key.id).filter(Key.value.startswith(LOAD_TEST_KEY_PREFIX))]
+    db.session.remove()
+    try:
+        _run_load_test(base_url, threads, seconds, key_values, key_ids, ips, zipf, invalid_key_share,
+                       killswitch_every, rng_seed)
+    finally:
+        if not keep_data:
+            db.session.rollback()
+            ms = MainScript.query.first()
+            if live_script and ms and ms.build_hash != live_script[2]:
+                ms.code, ms.source_hash, ms.build_hash = live_script
+                ms.updated_at = datetime.utcnow()
+                publish_invalidation('build')
+            ks = KillSwitch.query.first()
+            if ks and ks.active != kill_switch_was:
+                ks.active = kill_switch_was
+                publish_invalidation('killswitch')
+            db.session.commit()
+            key_usage.flush()  # or the LT keys' usage rows land after the delete
+            deleted_keys, deleted_bans = clear_load_test_data(key_ids)
+            print(f"Removed {deleted_keys} load-test keys and {deleted_bans} load-test bans.")
+
+def _run_load_test(base_url, threads, seconds, key_values, key_ids, ips, zipf, invalid_key_share,
+                   killswitch_every, rng_seed):
+    cum_weights = list(itertools.accumulate(1 / rank ** zipf for rank in range(1, len(key_values) + 1)))
+    operations = [op for op, _ in LOAD_TEST_MIX]
+    op_weights = [w for _, w in LOAD_TEST_MIX]
+    route_pattern = re.compile(r'/(\w{8})\?key=YOUR_KEY&hwid=YOUR_HWID&token=(\w+)')
+    latencies = {}
+    record_lock = threading.Lock()
+    stop_at = time.monotonic() + seconds
+
+    def timed(client, op, method, path, data=None, remote_addr=None):
+        started = time.perf_counter()
+        status, body = client.request(method, path, data, remote_addr)
+        elapsed = time.perf_counter() - started
+        with record_lock:
+            latencies.setdefault((op, _load_test_outcome(status, body)), []).append(elapsed)
+        return status, body
+
+    def loader_hit(client, rnd, remote_addr=None):
+        _, page = timed(client, 'loader_create', 'GET', '/loader_create', remote_addr=remote_addr)
+        match = route_pattern.search(page)
+        if not match:
+            return
+        if rnd.random() < invalid_key_share:
+            key = f'NOPE{rnd.getrandbits(48):012x}'
+        else:
+            key = rnd.choices(key_values, cum_weights=cum_weights)[0]
+        timed(client, 'loader_fetch', 'GET', f'/{match.group(1)}?key={key}&token={match.group(2)}',
+              remote_addr=remote_addr)
+
+    def worker(seed):
+        rnd = random.Random(seed)
+        client = _LoadTestClient(base_url)
+        while time.monotonic() < stop_at:
+            op = rnd.choices(operations, weights=op_weights)[0]
+            if op == 'loader':
+                loader_hit(client, rnd)
+            elif op == 'banned_loader':
+                if not base_url and ips:
+                    loader_hit(client, rnd, remote_addr=rnd.choice(ips))
+            elif op == 'scanner':
+                path = rnd.choice(LOAD_TEST_SCANNER_PATHS)
+                if rnd.random() < 0.5:
+                    path = f'/{rnd.getrandbits(40):010x}'
+                timed(client, 'scanner', 'GET', path)
+            elif op == 'read':
+                if rnd.random() < 0.5:
+                    timed(client, 'read_stats', 'GET', '/api/dashboard/stats')
+                else:
+                    timed(client, 'read_key', 'GET', f'/keys/{rnd.choice(key_ids)}/edit')
+            elif op == 'admin_edit_key':
+                timed(client, 'admin_edit_key', 'POST', f'/keys/{rnd.choice(key_ids)}/edit',
+                      data={'hwid': f'HWID-{rnd.getrandbits(32):08x}', 'days': '30'})
+            elif op == 'publish_script':
+                timed(client, 'publish_script', 'POST', '/loader_admin',
+                      data={'code': f'print("load test {rnd.getrandbits(32)}")'})
+
+    def flipper():
+        client = _LoadTestClient(base_url)
+        while time.monotonic() + killswitch_every < stop_at:
+            time.sleep(killswitch_every)
+            timed(client, 'killswitch_toggle', 'GET', '/killswitch/toggle?mode=on')
+            time.sleep(min(1.0, killswitch_every / 4))
+            timed(client, 'killswitch_toggle', 'GET', '/killswitch/toggle?mode=off')
+
+    started = time.monotonic()
+    pool = [threading.Thread(target=worker, args=(rng_seed * 1000 + i,)) for i in range(threads)]
+    if killswitch_every > 0:
+        pool.append(threading.Thread(target=flipper))
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.monotonic() - started
+    write_queue.flush()
+
+    total = sum(len(v) for v in latencies.values())
+    print(f"{'http ' + base_url if base_url else 'in-process'}, {threads} threads, {elapsed:.1f}s: "
+          f"{total} requests, {total / elapsed:.0f} req/s")
+    print(f"  {'operation':18s} {'outcome':44s} {'n':>7s} {'req/s':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s}")
+    for (op, outcome) in sorted(latencies):
+        values = sorted(latencies[(op, outcome)])
+        print(f"  {op:18s} {outcome:44s} {len(values):7d} {len(values) / elapsed:7.1f} "
+              f"{_percentile(values, 0.5) * 1000:8.1f} {_percentile(values, 0.95) * 1000:8.1f} "
+              f"{_percentile(values, 0.99) * 1000:8.1f}")
+
+# Synthetic capacity-test data. Every generated row is recognisable (GEN key
+# prefix, 'generated' ban reason, gen- project names) so --reset can remove
+# exactly what an earlier run added. Same seed and --as-of date, same rows.
+GENERATED_KEY_PREFIX = 'GEN'
+GENERATED_BAN_REASON = 'generated'
+GENERATED_PROJECT_PREFIX = 'gen-'
+GENERATED_KEY_PLANS = (1, 7, 30, 30, 30, 30, 90, 90, 365)  # days, weighted toward monthly keys
+GENERATED_BAN_REASONS = ('Excessive requests', 'Suspicious environment', 'Scanner', 'Chargeback', 'Key sharing')
+
+def synthetic_lua(rnd, size):
+    """Plausible Lua (functions, tables, strings with escapes, comments) of roughly `size` characters."""
+    parts, total, n = [], 0, 0
+    while total < size:
+        n += 1
+        kind = rnd.randrange(5)
+        if kind == 0:
+            part = (f"local function handler_{n}(player, amount)\n"
+                    f"    for i = 1, {rnd.randint(2, 64)} do\n"
+                    f"        amount = amount * {rnd.randint(2, 9)} % {rnd.randint(1000, 99999)}\n"
+                    f"    end\n    return player.Name .. \":\" .. tostring(amount)\nend\n")
+        elif kind == 1:
+            fields = ', '.join(f'{name} = {rnd.randint(0, 10000)}'
+                               for name in rnd.sample(('speed', 'jump', 'range', 'delay', 'price', 'slot', 'tier'), 4))
+            part = f"local config_{n} = {{ {fields}, enabled = {rnd.choice(('true', 'false'))} }}\n"
+        elif kind == 2:
+            part = f"local msg_{n} = \"stage {n}: it's \\\"ready\\\"\\n\" .. string.rep(\"-\", {rnd.randint(1, 40)})\n"
+        elif kind == 3:
+            part = f"-- step {n}: {''.join(rnd.choices(string.ascii_lowercase + ' ', k=rnd.randint(10, 70)))}\n"
+        else:
+            part = (f"if game:GetService(\"Players\").LocalPlayer.UserId % {rnd.randint(2, 97)} == 0 then\n"
+                    f"    task.spawn(handler_{max(n - 1, 1)}, game.Players.LocalPlayer, {rnd.randint(1, 500)})\nend\n")
+        parts.append(part)
+        total += len(part)
+    return ''.join(parts)
+
+def _bulk_insert(model, rows, batch, label):
+    """Insert an iterable of row dicts in `batch`-sized multi-row INSERTs, committing each batch."""
+    written, chunk, started = 0, [], time.perf_counter()
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= batch:
+            db.session.execute(db.insert(model), chunk)
+            db.session.commit()
+            written += len(chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(db.insert(model), chunk)
+        db.session.commit()
+        written += len(chunk)
+    elapsed = time.perf_counter() - started
+    print(f"  {label:14s} {written:10d} rows  {elapsed:7.1f}s  {written / max(elapsed, 1e-9):9.0f} rows/s")
+    return written
+
+def generated_keys(rnd, count, as_of, hwid_share):
+    for i in range(count):
+        # most keys were sold recently; a tail goes back over a year
+        created = as_of - timedelta(seconds=min(rnd.expovariate(1 / (90 * 86400)), 400 * 86400))
+        roll = rnd.random()
+        if roll < 0.1:
+            expires = None  # lifetime key
+        else:
+            expires = created + timedelta(days=rnd.choice(GENERATED_KEY_PLANS))
+        hwid = f"{rnd.getrandbits(128):032x}" if rnd.random() < hwid_share else None
+        yield {'value': f"{GENERATED_KEY_PREFIX}{i:09d}{rnd.getrandbits(40):010X}",
+               'hwid': hwid, 'expires_at': expires, 'created_at': created}
+
+def generated_bans(rnd, count, as_of, cidr_share):
+    seen = set()
+    while len(seen) < count:
+        if rnd.random() < cidr_share:
+            prefix = rnd.choice((16, 20, 24, 24, 24))
+            network = (rnd.randint(1, 223) << 24 | rnd.getrandbits(24)) & (0xFFFFFFFF << (32 - prefix))
+            address = f"{network >> 24}.{network >> 16 & 255}.{network >> 8 & 255}.{network & 255}/{prefix}"
+        else:
+            address = f"{rnd.randint(1, 223)}.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randint(1, 254)}"
+        if address in seen:
+            continue
+        seen.add(address)
+        yield {'ip_address': address, 'reason': f"{GENERATED_BAN_REASON}: {rnd.choice(GENERATED_BAN_REASONS)}",
+               'created_at': as_of - timedelta(seconds=rnd.randrange(365 * 86400))}
+
+def generated_scripts(rnd, project_ids, per_project, lua_kb, large_share, as_of):
+    for project_id in project_ids:
+        for n in range(rnd.randint(1, per_project * 2 - 1) if per_project > 1 else per_project):
+            if rnd.random() < large_share:
+                # the multi-MB sources that take the streaming paths: 1-8x INLINE_CONTENT_LIMIT
+                size = int(INLINE_CONTENT_LIMIT * 2 ** rnd.uniform(0, 3))
+            else:
+                # log-normal sizes with mean lua_kb: most scripts small, a long tail of big ones
+                size = int(lua_kb * 1024 * rnd.lognormvariate(-0.32, 0.8))
+            yield {'project_id': project_id, 'name': f"Script {n + 1}",
+                   'version': f"v{rnd.randint(0, 3)}.{rnd.randint(0, 20)}",
+                   'updated_at': as_of - timedelta(seconds=rnd.randrange(90 * 86400)),
+                   'code': synthetic_lua(rnd, size), 'build_hash': None}
+
+@app.cli.command('generate-data')
+@click.option('--keys', default=1_000_000, help='Key rows.')
+@click.option('--hwid-share', default=0.6, help='Share of keys already bound to a HWID.')
+@click.option('--blocked-ips', default=200_000, help='BlockedIP rows.')
+@click.option('--cidr-share', default=0.05, help='Share of bans that are CIDR ranges (matched by is_banned).')
+@click.option('--projects', default=2000, help='Projects.')
+@click.option('--scripts-per-project', default=3, help='Average scripts per project.')
+@click.option('--lua-kb', default=8, help='Mean script source size in KiB (log-normal).')
+@click.option('--large-script-share', default=0.002, help='Share of scripts sized 1-8x INLINE_CONTENT_LIMIT.')
+@click.option('--main-script-mb', default=0.0, help='Publish a synthetic loader script of this size (0 skips).')
+@click.option('--seed', 'rng_seed', default=1, help='Random seed; same seed, same data.')
+@click.option('--as-of', default=None, help='YYYY-MM-DD that generated timestamps are relative to (default today).')
+@click.option('--batch', default=10000, help='Rows per INSERT/commit.')
+@click.option('--reset', is_flag=True, help='Delete previously generated rows first.')
+def generate_data(keys, hwid_share, blocked_ips, cidr_share, projects, scripts_per_project, lua_kb,
+                  large_script_share, main_script_mb, rng_seed, as_of, batch, reset):
+    """Fill the database with production-scale synthetic keys, bans, projects and scripts."""
+    as_of = _parse_day(as_of) if as_of else datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    if reset:
+        gen_projects = db.session.query(Project.id).filter(Project.name.startswith(GENERATED_PROJECT_PREFIX))
+        db.session.execute(db.delete(Script).where(Script.project_id.in_(gen_projects.scalar_subquery())))
+        db.session.execute(db.delete(Project).where(Project.name.startswith(GENERATED_PROJECT_PREFIX)))
+        db.session.execute(db.delete(Key).where(Key.value.startswith(GENERATED_KEY_PREFIX)))
+        db.session.execute(db.delete(BlockedIP).where(BlockedIP.reason.startswith(GENERATED_BAN_REASON + ':')))
+        publish_invalidation('key')
+        publish_invalidation('ban')
         db.session.commit()
+    elif db.session.query(Key.id).filter(Key.value.startswith(GENERATED_KEY_PREFIX)).first() or \
+            db.session.query(Project.id).filter(Project.name.startswith(GENERATED_PROJECT_PREFIX)).first():
+        raise click.ClickException("generated data already present; pass --reset to replace it")
+
+    # one stream per table, so changing one volume leaves the other tables' rows unchanged
+    streams = {name: random.Random(f"{rng_seed}:{name}") for name in ('keys', 'bans', 'scripts', 'main')}
+    print(f"generating (seed {rng_seed}, as of {as_of:%Y-%m-%d}):")
+    _bulk_insert(Key, generated_keys(streams['keys'], keys, as_of, hwid_share), batch, 'keys')
+    _bulk_insert(BlockedIP, generated_bans(streams['bans'], blocked_ips, as_of, cidr_share), batch, 'blocked_ips')
+    _bulk_insert(Project, ({'name': f"{GENERATED_PROJECT_PREFIX}{i:06d}",
+                            'created_at': as_of - timedelta(days=i % 700)} for i in range(projects)),
+                 batch, 'projects')
+    publish_invalidation('key')
+    publish_invalidation('ban')
+    db.session.commit()
+    project_ids = [pid for (pid,) in db.session.query(Project.id)
+                   .filter(Project.name.startswith(GENERATED_PROJECT_PREFIX)).order_by(Project.id)]
+    # scripts carry whole sources, so keep their batches small
+    _bulk_insert(Script, generated_scripts(streams['scripts'], project_ids, scripts_per_project, lua_kb,
+                                           large_script_share, as_of),
+                 max(batch // 50, 1), 'scripts')
+
+    if main_script_mb > 0:
+        source = synthetic_lua(streams['main'], int(main_script_mb * (1 << 20)))
+        source_hash = payload_store.write_chunks(
+            source[i:i + STREAM_BLOCK_SIZE].encode() for i in range(0, len(source), STREAM_BLOCK_SIZE))
+        ms = MainScript.query.first() or MainScript(code='')
+        db.session.add(ms)
+        ms.code = payload_store.read_inline(source_hash)
+        ms.source_hash = source_hash
+        ms.updated_at = datetime.utcnow()
+        build_payload(ms)
+        record_script_version('single', source_hash, ms.build_hash)
+        publish_invalidation('build')
+        db.session.commit()
+        print(f"  main script    {len(source):10d} bytes, build {ms.build_hash[:12]}")
+
+@app.cli.command('explain-loader-queries')
+def explain_loader_queries():
+    """Print the query plan of each hot-path filter and fail if any of them scans the table."""
+    now = datetime.utcnow()
+    queries = [
+        ('ban check', BlockedIP.query.filter_by(ip_address='203.0.113.7')),
+        ('key lookup', Key.query.filter_by(value='ABCDEF1234567890')),
+        ('key by hwid', Key.query.filter_by(hwid='HWID-TEST')),
+        ('expired keys', Key.query.filter(Key.expires_at < now)),
+        ('single route lookup', EphemeralRoute.query.filter_by(route_name='abcdefgh')),
+        ('vm route lookup', EphemeralRouteVM.query.filter_by(route_name='abcdefgh')),
+        ('stale single routes', EphemeralRoute.query.filter(EphemeralRoute.created_at < now)),
+        ('stale vm routes', EphemeralRouteVM.query.filter(EphemeralRouteVM.created_at < now)),
+        ('project scripts', Script.query.filter_by(project_id=1)),
+    ]
+    postgres = db.engine.dialect.name == 'postgresql'
+    failed = False
+    with db.engine.begin() as conn:
+        if postgres:
+            # tiny tables are always cheaper to scan; ask whether an index is usable at all
+            conn.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        for label, query in queries:
+            compiled = query.statement.compile(dialect=db.engine.dialect)
+            params = compiled.params
+            if compiled.positional:
+                params = tuple(params[name] for name in compiled.positiontup)
+            prefix = 'EXPLAIN ' if postgres else 'EXPLAIN QUERY PLAN '
+            rows = conn.exec_driver_sql(prefix + str(compiled), params).fetchall()
+            plan = [row[0] if postgres else row[-1] for row in rows]
+            scans = [line for line in plan if ('Seq Scan' in line if postgres else 'USING' not in line)]
+            failed = failed or bool(scans)
+            print(f"{label}: {'SCAN' if scans else 'index'}")
+            for line in plan:
+                print(f"    {line}")
+    if failed:
+        raise SystemExit(1)
+
+############################
+# MAIN
+############################
+# Under `python main.py`, compile pool processes re-import this file as
+# __mp_main__; they only need vm_compile, so skip the boot work there.
+if __name__ != '__mp_main__':
+    with app.app_context():
+        db.create_all()
+        # Set AUTO_MIGRATE=0 to run `flask --app main migrate` as a deploy step
+        # instead (index builds on big tables would otherwise delay worker boot).
+        if os.environ.get('AUTO_MIGRATE', '1') == '1':
+            run_migrations()
+        seed_data()
+        fail_stale_compile_jobs()
+        single_route_filter.warm()
+        vm_route_filter.warm()
+    ensure_rollup_thread()
 
-    return Response(final_lua, mimetype='text/plain')
+if __name__ == '__main__':
+    app.run(host="0.0.0.0", debug=True, port=5000)
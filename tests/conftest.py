@@ -0,0 +1,98 @@
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+# main.py creates its tables and stores at import, so point every path at a
+# scratch directory before it is imported.
+SCRATCH = tempfile.mkdtemp(prefix='eaglehub-tests-')
+ADMIN_TOKEN = 'test-admin-token'
+os.environ.update(
+    DATABASE_URL=f'sqlite:///{SCRATCH}/test.db',
+    PAYLOAD_DIR=f'{SCRATCH}/payloads',
+    ROUTE_FILTER_DIR=f'{SCRATCH}/route-filters',
+    METRICS_DIR=f'{SCRATCH}/metrics',
+    INVALIDATION_DIR=f'{SCRATCH}/invalidation',
+    ADMIN_TOKEN=ADMIN_TOKEN,
+)
+os.environ.pop('METRICS_TOKEN', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+FIXTURE_SCRIPT = 'print("hello from the test suite")\n'
+
+
+@pytest.fixture(scope='session')
+def app():
+    main.app.testing = True  # _enforce_query_budget raises instead of logging
+    return main.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_headers():
+    return {'Authorization': f'Bearer {ADMIN_TOKEN}'}
+
+
+def call(client, path, method='GET', status=None, **kwargs):
+    """Request path, buffered so loader payloads release their admission slot."""
+    response = client.open(path, method=method, buffered=True, **kwargs)
+    if status is not None:
+        assert response.status_code == status, (path, response.status_code, response.get_data(as_text=True)[:200])
+    return response
+
+
+def make_key(app, hwid=None, expires_at=None):
+    with app.app_context():
+        key = main.Key(value=f'TEST{main.secrets.token_hex(8)}', hwid=hwid, expires_at=expires_at)
+        main.db.session.add(key)
+        main.db.session.commit()
+        main.publish_invalidation('key', key.value)
+        return key.id, key.value
+
+
+@pytest.fixture
+def key(app):
+    """(id, value) of a fresh active key."""
+    return make_key(app)
+
+
+@pytest.fixture(scope='session')
+def published(app):
+    """Publish the single-chunk script and wait for the VM compile job to finish."""
+    client = app.test_client()
+    call(client, '/loader_admin', 'POST', 302, data={'code': FIXTURE_SCRIPT})
+    call(client, '/vm_loader_admin_advanced', 'POST', 302, data={'code': FIXTURE_SCRIPT})
+    deadline = time.monotonic() + 60
+    with app.app_context():
+        while True:
+            job = main.CompileJob.query.order_by(main.CompileJob.id.desc()).first()
+            if job.status not in ('queued', 'running'):
+                break
+            assert time.monotonic() < deadline, 'compile job did not finish'
+            time.sleep(0.05)
+            main.db.session.rollback()
+        assert job.status == 'done', job.error
+        return job.id
+
+
+def create_route(app, client, kind):
+    """(route name, token) of a new ephemeral route for kind 'single' or 'vm'."""
+    path, model = {'single': ('/loader_create', main.EphemeralRoute),
+                   'vm': ('/vm_loader_create_advanced', main.EphemeralRouteVM)}[kind]
+    call(client, path, status=200)
+    with app.app_context():
+        route = model.query.order_by(model.id.desc()).first()
+        return route.route_name, route.token
+
+
+def loader_path(kind, route, key_value, hwid=''):
+    prefix = '/' if kind == 'single' else '/avm/'
+    return f'{prefix}{route[0]}?key={key_value}&token={route[1]}&hwid={hwid}'
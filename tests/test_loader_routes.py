@@ -0,0 +1,73 @@
+"""Single-use loader routes: one winner under concurrency, and rejected requests do not burn them."""
+import threading
+
+import pytest
+from sqlalchemy import event
+
+import main
+from conftest import call, create_route, loader_path
+
+LOADERS = ('single', 'vm')
+
+
+@pytest.mark.parametrize('kind', LOADERS)
+def test_concurrent_requests_serve_a_route_once(app, key, published, kind):
+    route = create_route(app, app.test_client(), kind)
+    path = loader_path(kind, route, key[1])
+    start = threading.Barrier(8)
+    statuses = []
+
+    def fetch():
+        client = app.test_client()
+        start.wait()
+        statuses.append(call(client, path).status_code)
+
+    threads = [threading.Thread(target=fetch) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(statuses) == [200] + [404] * 7
+
+
+@pytest.fixture
+def statements(app):
+    """SQL statements issued during the test."""
+    seen = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+
+    with app.app_context():
+        engine = main.db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield seen
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+@pytest.mark.parametrize('kind', LOADERS)
+def test_rejected_key_does_not_burn_the_route(app, client, key, published, statements, kind):
+    route = create_route(app, client, kind)
+    del statements[:]
+    call(client, loader_path(kind, route, 'NOT-A-KEY'), status=403)
+    call(client, loader_path(kind, route, ''), status=400)
+    # rejected before the consume UPDATE, so no write lock was taken
+    assert not [s for s in statements if s.lstrip().upper().startswith('UPDATE')]
+    call(client, loader_path(kind, route, key[1]), status=200)
+    call(client, loader_path(kind, route, key[1]), status=404)  # now used up
+
+
+@pytest.mark.parametrize('kind', LOADERS)
+def test_kill_switch_does_not_burn_the_route(app, client, key, published, kind):
+    route = create_route(app, client, kind)
+    call(client, '/killswitch/toggle?mode=on', status=302)
+    try:
+        call(client, loader_path(kind, route, key[1]), status=403)
+    finally:
+        call(client, '/killswitch/toggle?mode=off', status=302)
+    call(client, loader_path(kind, route, key[1]), status=200)
+
+
+@pytest.mark.parametrize('kind', LOADERS)
+def test_unknown_route_is_not_found(client, key, published, kind):
+    call(client, loader_path(kind, (main.new_route_name(), 'token'), key[1]), status=404)
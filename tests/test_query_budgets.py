@@ -0,0 +1,177 @@
+"""Every routed endpoint, driven down its worst path, stays within QUERY_BUDGETS.
+
+The app runs with testing=True, so _enforce_query_budget raises
+QueryBudgetExceeded out of the test client when a request goes over.
+"""
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from flask import request, request_finished
+
+import main
+from conftest import FIXTURE_SCRIPT, call, create_route, loader_path, make_key
+
+
+@pytest.fixture
+def hits(app):
+    """Endpoints dispatched during the test, in order."""
+    seen = []
+
+    def record(sender, response, **extra):
+        seen.append(request.endpoint)
+
+    with request_finished.connected_to(record, app):
+        yield seen
+
+
+def script_ids(app):
+    with app.app_context():
+        script = main.Script.query.order_by(main.Script.id).first()
+        return script.project_id, script.id
+
+
+def drive_toggle_kill_switch(app, client, headers, key):
+    with app.app_context():
+        main.KillSwitch.query.delete()  # worst path creates the row first
+        main.db.session.commit()
+    call(client, '/killswitch/toggle?mode=off', status=302)
+    call(client, '/killswitch/toggle', status=302)
+
+
+def drive_edit_script(app, client, headers, key):
+    project_id, script_id = script_ids(app)
+    call(client, f'/scripts/{project_id}/{script_id}/edit', status=200)
+    call(client, f'/scripts/{project_id}/{script_id}/edit', 'POST', 302,
+         data={'code': FIXTURE_SCRIPT, 'version': 'v2.0'})
+
+
+def drive_profiler_control(app, client, headers, key):
+    call(client, '/debug/profile/start?seconds=0.05&interval=0.01', 'POST', 200, headers=headers)
+    call(client, '/debug/profile/stop', 'POST', 200, headers=headers)
+
+
+def drive_memory_control(app, client, headers, key):
+    for action in ('start', 'snapshot', 'diff', 'stop'):
+        call(client, f'/debug/memory/{action}?limit=5', 'POST', 200, headers=headers)
+
+
+def drive_keys_page(app, client, headers, key):
+    call(client, '/keys', status=200)
+    call(client, '/keys', 'POST', 302, data={'hwid': 'HWID-1', 'days': '3'})
+
+
+def drive_edit_key(app, client, headers, key):
+    call(client, f'/keys/{key[0]}/edit', status=200)
+    call(client, f'/keys/{key[0]}/edit', 'POST', 302, data={'hwid': 'HWID-2', 'days': '5'})
+
+
+def drive_delete_key(app, client, headers, key):
+    key_id, _ = make_key(app)
+    call(client, f'/keys/{key_id}/delete', status=302)
+
+
+def drive_bulk_keys(app, client, headers, key):
+    make_key(app, expires_at=datetime.utcnow() + timedelta(days=1))
+    for dry_run in ('1', '0'):
+        call(client, '/keys/bulk', 'POST', 302,
+             data={'operation': 'extend', 'days': '7', 'state': 'active', 'prefix': 'TEST',
+                   'created_from': '2000-01-01', 'created_to': '2999-01-01', 'dry_run': dry_run})
+
+
+def drive_verify_keys_api(app, client, headers, key):
+    # worst case: a full batch, mostly unknown keys
+    batch = [key[1]] + [{'key': f'missing-{i}', 'hwid': 'HWID'} for i in range(main.KEY_VERIFY_MAX - 1)]
+    call(client, '/api/keys/verify', 'POST', 200, json={'keys': batch}, headers=headers)
+
+
+def drive_loader_admin(app, client, headers, key):
+    call(client, '/loader_admin', status=200)
+    call(client, '/loader_admin', 'POST', 302, data={'code': FIXTURE_SCRIPT + '-- edited\n'})
+
+
+def drive_loader_create(app, client, headers, key):
+    create_route(app, client, 'single')
+    _, script_id = script_ids(app)
+    call(client, f'/loader_create?script_id={script_id}')
+
+
+def drive_loader(kind):
+    def drive(app, client, headers, key):
+        route = create_route(app, client, kind)
+        call(client, loader_path(kind, route, key[1]), status=200)
+    return drive
+
+
+def drive_vm_loader_admin_advanced(app, client, headers, key):
+    call(client, '/vm_loader_admin_advanced', status=200)
+
+
+def drive_compile_job_status(app, client, headers, key):
+    with app.app_context():
+        job_id = main.CompileJob.query.order_by(main.CompileJob.id.desc()).first().id
+    call(client, f'/vm_loader_admin_advanced/jobs/{job_id}', status=200)
+
+
+def drive_rollback_version(app, client, headers, key):
+    call(client, '/loader_admin', 'POST', 302, data={'code': FIXTURE_SCRIPT + '-- rollback target\n'})
+    with app.app_context():
+        version = main.ScriptVersion.query.filter_by(kind='single', snapshot=False).order_by(
+            main.ScriptVersion.version.desc()).first()
+        number, blobs = version.version, [version.content_hash, version.build_hash]
+    for digest in blobs:  # worst path rebuilds the content from the history and re-renders the build
+        os.remove(main.payload_store.path(digest))
+    call(client, f'/versions/single/{number}/rollback', 'POST', 302)
+
+
+def get(path, status=200, admin=False):
+    def drive(app, client, headers, key):
+        call(client, path, status=status, headers=headers if admin else None)
+    return drive
+
+
+DRIVERS = {
+    'dashboard': get('/'),
+    'dashboard_stats_api': get('/api/dashboard/stats'),
+    'dashboard_series_api': get('/api/dashboard/series'),
+    'blocked_ips_page': get('/blocked_ips'),
+    'heavy_hitters_page': get('/blocked_ips/heavy-hitters'),
+    'kill_switch_page': get('/killswitch'),
+    'toggle_kill_switch': drive_toggle_kill_switch,
+    'scripts_page': lambda app, client, headers, key: call(client, f'/scripts/{script_ids(app)[0]}', status=200),
+    'projects_page': get('/projects'),
+    'metrics_page': get('/metrics', admin=True),
+    'healthz': get('/healthz?db=1'),
+    'admission_state': get('/debug/admission', admin=True),
+    'profiler_control': drive_profiler_control,
+    'profiler_stacks': get('/debug/profile', admin=True),
+    'memory_control': drive_memory_control,
+    'keys_page': drive_keys_page,
+    'edit_key': drive_edit_key,
+    'delete_key': drive_delete_key,
+    'bulk_keys': drive_bulk_keys,
+    'verify_keys_api': drive_verify_keys_api,
+    'loader_admin': drive_loader_admin,
+    'loader_create': drive_loader_create,
+    'loader_catch_all_single': drive_loader('single'),
+    'vm_loader_admin_advanced': drive_vm_loader_admin_advanced,
+    'compile_job_status': drive_compile_job_status,
+    'versions_page': lambda app, client, headers, key: [call(client, f'/versions/{kind}', status=200)
+                                                       for kind in main.VERSIONED_SCRIPTS],
+    'rollback_version': drive_rollback_version,
+    'vm_loader_create_advanced': get('/vm_loader_create_advanced'),
+    'vm_advanced_loader': drive_loader('vm'),
+    'edit_script': drive_edit_script,
+}
+
+
+def test_every_routed_endpoint_has_a_budget_and_a_driver(app):
+    routed = {rule.endpoint for rule in app.url_map.iter_rules() if rule.endpoint != 'static'}
+    assert routed == set(main.QUERY_BUDGETS)
+    assert set(DRIVERS) == set(main.QUERY_BUDGETS)
+
+
+@pytest.mark.parametrize('endpoint', sorted(main.QUERY_BUDGETS))
+def test_endpoint_within_query_budget(app, client, admin_headers, key, published, hits, endpoint):
+    DRIVERS[endpoint](app, client, admin_headers, key)
+    assert endpoint in hits
@@ -0,0 +1,56 @@
+"""Advanced VM tokenizer and segment compiler.
+
+Compile pool processes import only this module, so it must stay free of the
+app, its DB setup and anything else that does work at import time.
+"""
+import base64
+import re
+
+# Regex token definitions for advanced Lua parsing
+TOKENS = [
+    (r"[A-Za-z_]\w*", "IDENT"),
+    (r"==|~=|<=|>=|<|>", "COMP"),
+    (r"\+|\-|\*|\/|\%|\^", "ARITH"),
+    (r"\.\.\.", "VARARG"),
+    (r"\.\.", "CONCAT"),
+    (r"\=", "ASSIGN"),
+    (r"\(", "LPAREN"),
+    (r"\)", "RPAREN"),
+    (r"\{", "LBRACE"),
+    (r"\}", "RBRACE"),
+    (r"\[", "LBRACKET"),
+    (r"\]", "RBRACKET"),
+    (r";", "SEMICOLON"),
+    (r":", "COLON"),
+    (r"\.", "DOT"),
+    (r",", "COMMA"),
+    (r"\"(?:\\.|[^\"])*\"", "STRING_DQ"),
+    (r"\'(?:\\.|[^\'])*\'", "STRING_SQ"),
+    (r"\d+(\.\d+)?", "NUMBER"),
+    (r"if|then|else|elseif|end|while|do|for|in|repeat|until|function|local|return|break|true|false|nil|not|and|or", "KEYWORD"),
+]
+
+# Combine into one pattern
+token_regex = re.compile(
+    "|".join(f"(?P<{name}>{pattern})" for pattern, name in TOKENS)
+    + r"|(?P<WHITESPACE>\s+)|(?P<UNKNOWN>.)"
+)
+
+def advanced_tokenize(lua_source):
+    """Tokenize Lua code into (kind, text) pairs for advanced VM."""
+    tokens = []
+    for m in token_regex.finditer(lua_source):
+        kind = m.lastgroup
+        text = m.group(kind)
+        if kind == "WHITESPACE":
+            continue
+        elif kind == "UNKNOWN":
+            tokens.append(("UNKNOWN", text))
+        else:
+            tokens.append((kind, text))
+    return tokens
+
+def compile_segment(segment):
+    """Bytecode for one source segment; module-level so pool processes can run it."""
+    return "|".join(f"{kind}:{base64.b64encode(text.encode()).decode()}"
+                    for kind, text in advanced_tokenize(segment)).encode()